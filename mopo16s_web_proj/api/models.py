@@ -1,7 +1,11 @@
 from functools import wraps
 from accounts.models import ApiToken
-from mopo16s_web.models import Job, RepresentativeSequenceSet, InitialPrimerPairs
-from mopo16s_web.utils import validate_fasta_str
+from mopo16s_web.models import Job, JobBatch, RepresentativeSequenceSet, InitialPrimerPairs, Result
+from mopo16s_web.utils import validate_fasta_str, parse_sweep
+from mopo16s_web.progress import get_progress
+from mopo16s_web.columnar import THRESHOLD_NAMES
+from mopo16s_web.tasks import cancel_job, submit_jobs
+from mopo16s_web_proj.settings import MOPO16S_PARAMETERS
 from django.forms import ValidationError
 
 
@@ -77,6 +81,7 @@ class Bot(ApiToken):
             list_jobs=dict(http_method='GET', url_path='jobs',
                            optional_params=(
                                dict(name='offset', type=int),
+                               dict(name='status', type=str),
                                ),
                            ),
             list_sequences=dict(http_method='GET', url_path='sequences',
@@ -94,6 +99,49 @@ class Bot(ApiToken):
                               dict(name='job_id', url_path='<int:job_id>'),
                               ),
                           ),
+            view_job_progress=dict(http_method='GET', url_path='jobs/progress',
+                                   url_params=(
+                                       dict(name='job_id', url_path='<int:job_id>'),
+                                       ),
+                                   ),
+            list_result_rows=dict(http_method='GET', url_path='results/rows',
+                                  url_params=(
+                                      dict(name='job_id', url_path='<int:job_id>'),
+                                      dict(name='prefix', url_path='<str:prefix>'),
+                                      ),
+                                  optional_params=(
+                                      dict(name='order_by', type=str),
+                                      dict(name='fields', type=str),
+                                      dict(name='offset', type=int),
+                                      dict(name='limit', type=int),
+                                      dict(name='after', type=int),
+                                      *(dict(name=name, type=float) for name in THRESHOLD_NAMES),
+                                      ),
+                                  ),
+            cancel_job=dict(http_method='POST', url_path='jobs/cancel',
+                            url_params=(
+                                dict(name='job_id', url_path='<int:job_id>'),
+                                ),
+                            ),
+            view_batch=dict(http_method='GET', url_path='batches',
+                            url_params=(
+                                dict(name='batch_id', url_path='<int:batch_id>'),
+                                ),
+                            ),
+            new_batch=dict(http_method='POST', url_path='batches/new',
+                           required_params=(
+                               dict(name='name', type=str),
+                               dict(name='description', type=str),
+                               dict(name='rep_set_id', type=int),
+                               dict(name='good_pairs_id', type=int),
+                               dict(name='sweep', type=str),
+                               ),
+                           optional_params=(
+                               dict(name='is_public', type=bool, decoder=bool),
+                               dict(name='distributed', type=bool, decoder=bool),
+                               dict(name='force_run', type=bool, decoder=bool),
+                               ),
+                           ),
             view_sequence_set=dict(http_method='GET', url_path='sequences',
                                    url_params=(
                                        dict(name='sequence_set_id', url_path='<int:sequence_set_id>'),
@@ -149,9 +197,14 @@ class Bot(ApiToken):
         return self._to_dict()
     
     @check_parameters
-    def list_jobs(self, offset=0):
+    def list_jobs(self, offset=0, status=None):
+        queryset = self.get_jobs_queryset()
+        if status is not None:
+            if status not in Job.STATUSES:
+                raise BadParameterException("parameter 'status' must be one of: " + ', '.join(Job.STATUSES))
+            queryset = queryset.filter(status=status)
         return (job.to_api_dict() for job in
-                self.get_jobs_queryset().order_by('-id')[offset:offset + self.PAGINATE_BY])
+                queryset.order_by('-id')[offset:offset + self.PAGINATE_BY])
     
     @check_parameters
     def list_sequences(self, offset=0):
@@ -170,6 +223,70 @@ class Bot(ApiToken):
         except Job.DoesNotExist:
             raise ObjectNotFoundException
     
+    @check_parameters
+    def view_job_progress(self, job_id):
+        if not self.get_jobs_queryset().filter(id=job_id).exists():
+            raise ObjectNotFoundException
+        return get_progress(job_id) or {}
+    
+    @check_parameters
+    def list_result_rows(self, job_id, prefix, **kwargs):
+        try:
+            result = Result.objects.filter(request_user=self.owner).only('job_id', 'data_npz').get(job_id=job_id)
+        except Result.DoesNotExist:
+            raise ObjectNotFoundException
+        try:
+            return result.get_rows(prefix, **kwargs)
+        except ValueError as e:
+            raise BadParameterException(str(e))
+    
+    @check_parameters
+    def cancel_job(self, job_id):
+        try:
+            job = self.get_jobs_queryset().get(id=job_id)
+        except Job.DoesNotExist:
+            raise ObjectNotFoundException
+        if job.created_by_id != self.owner_id and not self.owner.is_staff:
+            raise ObjectForbiddenException('only the creator can cancel the job')
+        if not cancel_job(job):
+            raise BadParameterException('job is {}, it cannot be cancelled'.format(job.status))
+        job.refresh_from_db()
+        return job.to_api_dict()
+    
+    @check_parameters
+    def view_batch(self, batch_id):
+        try:
+            batch = JobBatch.objects.filter(request_user=self.owner).get(id=batch_id)
+        except JobBatch.DoesNotExist:
+            raise ObjectNotFoundException
+        return dict(batch.to_api_dict(), comparison=batch.get_comparison())
+    
+    @check_parameters
+    def new_batch(self, name, description, rep_set_id, good_pairs_id, sweep, is_public=False, distributed=False,
+                  force_run=False):
+        try:
+            rep_set = self.get_sequences_queryset().get(id=rep_set_id)
+            good_pairs = self.get_primers_queryset().get(id=good_pairs_id)
+        except (RepresentativeSequenceSet.DoesNotExist, InitialPrimerPairs.DoesNotExist, ValueError):
+            raise ObjectNotFoundException
+        # threads and verbose can't be set by the user, the other parameters are the defaults unless swept
+        parameters = dict((name, details) for name, details in MOPO16S_PARAMETERS.items()
+                          if name not in ('threads', 'verbose'))
+        try:
+            sweep = parse_sweep(sweep, parameters)
+        except ValueError as e:
+            raise BadParameterException('invalid sweep: {}'.format(e))
+        batch = JobBatch(name=name, description=description, is_public=is_public, sweep=sweep,
+                         created_by_id=self.owner_id, rep_set=rep_set, good_pairs=good_pairs)
+        try:
+            jobs = batch.save_with_jobs(batch.get_parameters_grid(
+                    dict((name, details['type'](details['default'])) for name, details in parameters.items())),
+                    distributed)
+        except ValueError as e:
+            raise BadParameterException(str(e))
+        submit_jobs(jobs, force_run=force_run)
+        return batch.to_api_dict()
+    
     @check_parameters
     def view_sequence_set(self, sequence_set_id):
         try:
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Synthetic stand-in of mopo16s, to benchmark the scheduling of the jobs without the real binary
+(see the benchmark_scheduler command).
+
+It accepts the same arguments, prints the same kind of progress on stdout and writes .primers/.scores files in the
+format of mopo16s, but it only sleeps (or burns CPU on its threads) instead of optimizing the primers.
+It is configured by environment variables:
+    FAKE_MOPO16S_SECONDS    seconds of every run, the runs are executed in parallel on the threads (default 0.1)
+    FAKE_MOPO16S_MODE       'sleep' or 'burn' (default 'sleep')
+    FAKE_MOPO16S_PAIRS      primer set pairs of every output file (default 20)
+    FAKE_MOPO16S_FAIL_RATE  probability of failing with exit code 1, to exercise the retries (default 0)
+"""
+from multiprocessing import Process
+from os import environ
+from random import Random, random
+from time import sleep, time
+import sys
+
+
+SCORES_HEADER = 'Efficiency\tCoverage\tMatchingBias'
+BASES = 'ACGT'
+
+
+def parse_args(argv):
+    # positional arguments (input files) and '--name=value' options, as mopo16s
+    files, options = [], {}
+    for arg in argv:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            options[name] = value
+        else:
+            files.append(arg)
+    return files, options
+
+
+def burn(deadline):
+    while time() < deadline:
+        pass
+
+
+def work(seconds, threads, mode):
+    if mode == 'burn':
+        processes = [Process(target=burn, args=(time() + seconds,)) for _ in range(threads)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        sleep(seconds)
+
+
+def random_primer_set(rng):
+    # variants of a primer, of similar length, as mopo16s lists the sequences of a degenerate primer
+    primer = [rng.choice(BASES) for _ in range(rng.randint(17, 21))]
+    primers = []
+    for _ in range(rng.randint(1, 4)):
+        variant = list(primer)
+        variant[rng.randrange(len(variant))] = rng.choice(BASES)
+        primers.append(''.join(variant[:len(variant) - rng.randint(0, 1)]))
+    return primers
+
+
+def write_output(file_path, rng, pairs, best):
+    with open(file_path + '.primers', 'wt') as primers_file, open(file_path + '.scores', 'wt') as scores_file:
+        scores_file.write(SCORES_HEADER + '\n')
+        for _ in range(pairs):
+            primers_file.write('\t'.join(random_primer_set(rng)) + '\tx\t' + '\t'.join(random_primer_set(rng)) + '\n')
+            scores_file.write('\t'.join(repr(round(score, 6)) for score in (
+                    best * rng.uniform(0.7, 1), best * rng.uniform(0.8, 1), rng.uniform(0, 1 - best / 2))) + '\n')
+
+
+def main(argv):
+    files, options = parse_args(argv)
+    if len(files) != 2 or 'outFileName' not in options or 'outInitFileName' not in options:
+        sys.stderr.write('usage: fake_mopo16s.py <rep_set> <primers> --outInitFileName=... --outFileName=...\n')
+        return 2
+    seconds = float(environ.get('FAKE_MOPO16S_SECONDS', 0.1))
+    mode = environ.get('FAKE_MOPO16S_MODE', 'sleep')
+    pairs = int(environ.get('FAKE_MOPO16S_PAIRS', 20))
+    fail_rate = float(environ.get('FAKE_MOPO16S_FAIL_RATE', 0))
+    threads = max(1, int(options.get('threads', 1)))
+    runs = max(1, int(options.get('runs', 1)))
+    restarts = max(1, int(options.get('restarts', 1)))
+    rng = Random(options.get('seed', '') + options['outFileName'])
+    
+    # the inputs are read as mopo16s does, to exercise the staging
+    for file_path in files:
+        with open(file_path, 'rb') as file:
+            while file.read(1024 * 1024):
+                pass
+    
+    best = 0
+    for run in range(0, runs, threads):
+        batch = min(threads, runs - run)
+        work(seconds, batch, mode)
+        for i in range(run, run + batch):
+            for restart in range(restarts):
+                print('Restart {} done'.format(restart + 1))
+            best = max(best, rng.uniform(0.5, 0.99))
+            print('Run {} done'.format(i + 1))
+            print('{:.6f}\t{:.6f}\t{:.6f}'.format(best, best * rng.uniform(0.8, 1), 1 - best), flush=True)
+        # not seeded: a retry does not fail necessarily
+        if run == 0 and random() < fail_rate:
+            sys.stderr.write('Error: simulated failure after run {}\n'.format(batch))
+            return 1
+    
+    write_output(options['outInitFileName'], rng, pairs, best * 0.8)
+    write_output(options['outFileName'], rng, pairs, best)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Job, RepresentativeSequenceSet, InitialPrimerPairs, Run, Result
+from .models import Job, JobBatch, RepresentativeSequenceSet, InitialPrimerPairs, Run, Result
 
 
 admin.site.register(Job)
+admin.site.register(JobBatch)
 admin.site.register(RepresentativeSequenceSet)
 admin.site.register(InitialPrimerPairs)
 admin.site.register(Run)
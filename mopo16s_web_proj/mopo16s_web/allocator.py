@@ -0,0 +1,265 @@
+from mopo16s_web_proj.caches import cache
+from mopo16s_web_proj.settings import MOPO16S_NODE_NAME
+from json import dumps
+
+
+# every lease is a field of a single hash (lease_id -> threads),
+# the memory reserved by the lease is in another hash (lease_id -> bytes), as its owner (lease_id -> user id)
+# and the worker node it runs on (lease_id -> node name), its expiration timestamp is kept in a sorted set
+LEASES_KEY = 'threads_allocated'
+LEASES_MEMORY_KEY = 'threads_allocated:memory'
+LEASES_USER_KEY = 'threads_allocated:user'
+LEASES_NODE_KEY = 'threads_allocated:node'
+LEASES_EXPIRY_KEY = 'threads_allocated:expiry'
+
+# returned instead of the threads granted, when the owner of the lease has already reached its threads cap
+USER_CAP_REACHED = -1
+
+# leases are renewed by the heartbeat of the running task, if the worker dies
+# the allocated threads will be released after a few minutes
+# this is to prevent failed tasks to mess up thread count
+# only in the case 'clean_allocated_threads' didn't fix it
+LEASE_TTL = 5 * 60
+
+# prefix of the scripts that need the current time ('now', in seconds): writes after TIME are allowed only with
+# effects replication, the default from Redis 5
+LUA_NOW = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+"""
+
+# reserve up to ARGV[2] threads for the lease ARGV[1] on the node ARGV[10], without exceeding its capacity ARGV[3],
+# together with the memory they need (ARGV[6] + ARGV[7] for each thread), without exceeding its budget ARGV[5],
+# and without exceeding the threads cap ARGV[9] of the user ARGV[8] on all the nodes (0 for no cap)
+# the lease expires after ARGV[4] seconds, expired leases are purged and the previous lease with the same id is
+# replaced, all atomically
+# returns the number of threads granted, 0 if there are no free threads or not enough memory for one thread,
+# -1 if the user has already reached its cap
+# expiration timestamps are taken from the clock of Redis, the clocks of the worker nodes may differ
+_reserve_threads_script = cache.register_script(LUA_NOW + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, lease_id in ipairs(expired) do
+    redis.call('HDEL', KEYS[1], lease_id)
+    redis.call('HDEL', KEYS[3], lease_id)
+    redis.call('HDEL', KEYS[4], lease_id)
+    redis.call('HDEL', KEYS[5], lease_id)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+redis.call('HDEL', KEYS[5], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+
+local used = 0
+local leases = 0
+local used_by_user = 0
+local used_memory = 0
+local leases_threads = redis.call('HGETALL', KEYS[1])
+for i = 1, #leases_threads, 2 do
+    local threads = tonumber(leases_threads[i + 1])
+    if redis.call('HGET', KEYS[5], leases_threads[i]) == ARGV[10] then
+        used = used + threads
+        leases = leases + 1
+        used_memory = used_memory + tonumber(redis.call('HGET', KEYS[3], leases_threads[i]) or 0)
+    end
+    if redis.call('HGET', KEYS[4], leases_threads[i]) == ARGV[8] then
+        used_by_user = used_by_user + threads
+    end
+end
+local user_cap = tonumber(ARGV[9])
+if user_cap > 0 and used_by_user >= user_cap then
+    return -1
+end
+local granted = math.min(tonumber(ARGV[2]), tonumber(ARGV[3]) - used)
+if user_cap > 0 then
+    granted = math.min(granted, user_cap - used_by_user)
+end
+local memory_per_thread = tonumber(ARGV[7])
+if memory_per_thread > 0 then
+    -- downsize to the threads whose memory fits the budget,
+    -- a single thread is always admitted when nothing else is running (it could never fit otherwise)
+    local fitting = math.floor((tonumber(ARGV[5]) - used_memory - tonumber(ARGV[6])) / memory_per_thread)
+    if leases == 0 then
+        fitting = math.max(fitting, 1)
+    end
+    granted = math.min(granted, fitting)
+end
+if granted < 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], granted)
+redis.call('HSET', KEYS[3], ARGV[1], tonumber(ARGV[6]) + granted * memory_per_thread)
+redis.call('HSET', KEYS[4], ARGV[1], ARGV[8])
+redis.call('HSET', KEYS[5], ARGV[1], ARGV[10])
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[4]), ARGV[1])
+return granted
+""")
+
+
+def reserve_threads(lease_id, threads, capacity, ttl=LEASE_TTL, memory_budget=0, memory_base=0, memory_per_thread=0,
+                    user_id=None, user_max_threads=0, node=None):
+    """
+    Atomically reserve threads, and the memory they need, for a lease, in a single round trip.
+    :param lease_id: lease identifier, a previous lease with the same id is replaced
+    :param threads: maximum number of threads wanted
+    :param capacity: total number of threads that can be allocated on the node
+    :param ttl: seconds after which the lease expires
+    :param memory_budget: total bytes of memory that can be reserved on the node
+    :param memory_base: bytes needed by the process regardless of its threads
+    :param memory_per_thread: bytes needed by every thread, 0 to ignore memory
+    :param user_id: owner of the lease
+    :param user_max_threads: maximum number of threads the leases of the owner can hold together, 0 for no cap
+    :param node: worker node the threads belong to. Default: this node
+    :return: number of threads granted (less or equal to 'threads'), 0 if no thread is free or no memory is enough,
+             USER_CAP_REACHED if the owner holds already its maximum number of threads
+    """
+    return int(_reserve_threads_script(keys=(LEASES_KEY, LEASES_EXPIRY_KEY, LEASES_MEMORY_KEY, LEASES_USER_KEY,
+                                             LEASES_NODE_KEY),
+                                       args=(lease_id, threads, capacity, ttl,
+                                             int(memory_budget), int(memory_base), int(memory_per_thread),
+                                             '' if user_id is None else user_id, user_max_threads or 0,
+                                             node or MOPO16S_NODE_NAME)))
+
+
+def release_threads(lease_id):
+    pipe = cache.pipeline()
+    pipe.hdel(LEASES_KEY, lease_id)
+    pipe.hdel(LEASES_MEMORY_KEY, lease_id)
+    pipe.hdel(LEASES_USER_KEY, lease_id)
+    pipe.hdel(LEASES_NODE_KEY, lease_id)
+    pipe.zrem(LEASES_EXPIRY_KEY, lease_id)
+    pipe.execute()
+
+
+# postpone to ARGV[2] seconds from now the expiration of the existing lease ARGV[1], never create a new one
+_renew_threads_script = cache.register_script(LUA_NOW + """
+return redis.call('ZADD', KEYS[1], 'XX', now + tonumber(ARGV[2]), ARGV[1])
+""")
+
+
+def renew_threads(lease_id, ttl=LEASE_TTL):
+    _renew_threads_script(keys=(LEASES_EXPIRY_KEY,), args=(lease_id, ttl))
+
+
+def get_leases():
+    """
+    :return: dict lease_id -> allocated threads
+    """
+    return dict((lease_id, int(threads)) for lease_id, threads in cache.hgetall(LEASES_KEY).items())
+
+
+def get_threads_by_user():
+    """
+    :return: dict user id (string) -> threads allocated to the leases of the user
+    """
+    pipe = cache.pipeline(transaction=False)
+    pipe.hgetall(LEASES_KEY)
+    pipe.hgetall(LEASES_USER_KEY)
+    leases, users = pipe.execute()
+    threads_by_user = {}
+    for lease_id, threads in leases.items():
+        user_id = users.get(lease_id)
+        if user_id:
+            threads_by_user[user_id] = threads_by_user.get(user_id, 0) + int(threads)
+    return threads_by_user
+
+
+def get_threads_by_node():
+    """
+    :return: dict node name -> threads allocated to the leases running on the node
+    """
+    pipe = cache.pipeline(transaction=False)
+    pipe.hgetall(LEASES_KEY)
+    pipe.hgetall(LEASES_NODE_KEY)
+    leases, nodes = pipe.execute()
+    threads_by_node = {}
+    for lease_id, threads in leases.items():
+        node = nodes.get(lease_id)
+        if node:
+            threads_by_node[node] = threads_by_node.get(node, 0) + int(threads)
+    return threads_by_node
+
+
+# the CPUs of every host assigned to the leases, hash cpu -> lease_id
+CORES_KEY = 'threads_allocated:cores:{}'
+
+# assign up to ARGV[2] free CPUs to the lease ARGV[1], chosen in the topology ARGV[3] (json list of the CPUs of every
+# NUMA node): the node with the least free CPUs that fits all of them, otherwise the nodes with the most free CPUs first
+# CPUs of leases that do not exist anymore (released or expired) are freed first, as the previous ones of the lease
+_reserve_cores_script = cache.register_script("""
+local cores = redis.call('HGETALL', KEYS[1])
+for i = 1, #cores, 2 do
+    if cores[i + 1] == ARGV[1] or redis.call('HEXISTS', KEYS[2], cores[i + 1]) == 0 then
+        redis.call('HDEL', KEYS[1], cores[i])
+    end
+end
+local count = tonumber(ARGV[2])
+local free = {}
+for node, cpus in ipairs(cjson.decode(ARGV[3])) do
+    free[node] = {}
+    for _, cpu in ipairs(cpus) do
+        if redis.call('HEXISTS', KEYS[1], cpu) == 0 then
+            table.insert(free[node], cpu)
+        end
+    end
+end
+local order = {}
+for node = 1, #free do
+    if #free[node] >= count and (order[1] == nil or #free[node] < #free[order[1]]) then
+        order = {node}
+    end
+end
+if order[1] == nil then
+    for node = 1, #free do
+        table.insert(order, node)
+    end
+    table.sort(order, function(a, b) return #free[a] > #free[b] end)
+end
+local granted = {}
+for _, node in ipairs(order) do
+    for _, cpu in ipairs(free[node]) do
+        if #granted < count then
+            table.insert(granted, cpu)
+            redis.call('HSET', KEYS[1], cpu, ARGV[1])
+        end
+    end
+end
+return granted
+""")
+
+_release_cores_script = cache.register_script("""
+local cores = redis.call('HGETALL', KEYS[1])
+for i = 1, #cores, 2 do
+    if cores[i + 1] == ARGV[1] then
+        redis.call('HDEL', KEYS[1], cores[i])
+    end
+end
+""")
+
+
+def reserve_cores(lease_id, count, topology, host=None):
+    """
+    Atomically assign CPUs of this host to an existing lease, disjoint from the ones of the other leases,
+    preferring a single NUMA node
+    :param count: number of CPUs wanted (e.g. the threads granted to the lease)
+    :param topology: list of the CPU ids of every NUMA node, see utils.read_cpu_topology
+    :param host: host of the CPUs. Default: this node
+    :return: list of CPU ids, less than count if not enough are free
+    """
+    return [int(cpu) for cpu in _reserve_cores_script(keys=(CORES_KEY.format(host or MOPO16S_NODE_NAME), LEASES_KEY),
+                                                      args=(lease_id, count, dumps(topology)))]
+
+
+def release_cores(lease_id, host=None):
+    _release_cores_script(keys=(CORES_KEY.format(host or MOPO16S_NODE_NAME),), args=(lease_id,))
+
+
+def get_leases_memory():
+    """
+    :return: dict lease_id -> reserved bytes of memory
+    """
+    return dict((lease_id, int(float(memory))) for lease_id, memory in cache.hgetall(LEASES_MEMORY_KEY).items())
@@ -0,0 +1,58 @@
+from mopo16s_web_proj.settings import RESULT_ARCHIVE_COMPRESSION, RESULT_ARCHIVE_COMPRESSLEVEL, RESULT_ARCHIVES_ROOT
+from mopo16s_web.utils import stream_zip
+from os import path, makedirs, replace, remove
+from uuid import uuid4
+from zipfile import ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA
+
+
+ARCHIVE_COMPRESSIONS = dict(stored=ZIP_STORED, deflated=ZIP_DEFLATED, bzip2=ZIP_BZIP2, lzma=ZIP_LZMA)
+
+
+def result_archive_etag(job_id, date_completed):
+    # the archive of a result is reproducible, it changes only with the compression
+    return '{}-{}-{}{}'.format(job_id, int(date_completed.timestamp()), RESULT_ARCHIVE_COMPRESSION,
+                               RESULT_ARCHIVE_COMPRESSLEVEL if RESULT_ARCHIVE_COMPRESSLEVEL is not None else '')
+
+
+def get_result_archive_path(job_id, date_completed):
+    return path.join(RESULT_ARCHIVES_ROOT, 'results_{}.zip'.format(result_archive_etag(job_id, date_completed)))
+
+
+def get_cached_result_archive(job_id, date_completed):
+    """
+    :return: path of the complete archive of the result, None if it is not cached (or the cache is disabled)
+    """
+    if RESULT_ARCHIVES_ROOT is None:
+        return None
+    file_path = get_result_archive_path(job_id, date_completed)
+    return file_path if path.exists(file_path) else None
+
+
+def stream_result_archive(result):
+    """
+    Zip of the raw outputs of a result (init.primers, init.scores, out.primers, out.scores), generated while it is
+    streamed. If the cache is enabled it is written there too, and it appears only once complete:
+    concurrent downloads write their own temporary file, an interrupted download leaves nothing.
+    :param result: Result, with the raw outputs and date_completed
+    :return: generator of bytes
+    """
+    chunks = stream_zip(((name.replace('_', '.'), getattr(result, name)) for name in result.RAW_FIELDS),
+                        ARCHIVE_COMPRESSIONS[RESULT_ARCHIVE_COMPRESSION], RESULT_ARCHIVE_COMPRESSLEVEL,
+                        # the same timestamps in every archive of the result, so that the ETag holds
+                        date_time=result.date_completed.utctimetuple()[:6])
+    if RESULT_ARCHIVES_ROOT is None:
+        yield from chunks
+        return
+    
+    file_path = get_result_archive_path(result.job_id, result.date_completed)
+    tmp_file_path = '{}.{}.tmp'.format(file_path, uuid4().hex)
+    makedirs(RESULT_ARCHIVES_ROOT, exist_ok=True)
+    try:
+        with open(tmp_file_path, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                yield chunk
+        replace(tmp_file_path, file_path)
+    finally:
+        if path.exists(tmp_file_path):
+            remove(tmp_file_path)
@@ -0,0 +1,160 @@
+from io import BytesIO
+import numpy as np
+
+
+PREFIXES = ('init', 'out')
+SIDES = ('forward', 'reverse')
+SCORE_NAMES = ('efficiency', 'coverage', 'matching_bias')
+# fields of a row returned by ResultColumns.select, besides its index
+ROW_FIELDS = (*SIDES, *SCORE_NAMES)
+# thresholds accepted by ResultColumns.select, e.g. min_efficiency
+THRESHOLD_NAMES = tuple('{}_{}'.format(bound, score_name) for score_name in SCORE_NAMES for bound in ('min', 'max'))
+
+
+class ResultColumns:
+    """
+    Parsed outputs of mopo16s (initial and optimized primer pairs), stored column-wise in a compressed npz:
+    'primer_sets' is the dictionary of the primer sets of all the rows, as ASCII bytes (the degenerate primers of a
+    set are separated by tabs, the sets by newlines), '<prefix>_primer_sets' are the int32 indexes in the dictionary
+    of the forward and reverse primer set of every row, '<prefix>_scores' are the float64 scores of every row
+    (efficiency, coverage, matching-bias).
+    Every array is decompressed only when it is accessed the first time.
+    """
+    
+    def __init__(self, arrays):
+        # name -> array, or a lazy NpzFile
+        self._arrays = arrays
+        self._loaded = {}
+    
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            self._loaded[name] = self._arrays[name]
+        return self._loaded[name]
+    
+    @property
+    def names(self):
+        return list(getattr(self._arrays, 'files', None) or self._arrays.keys())
+    
+    @classmethod
+    def from_rows(cls, matrices):
+        """
+        :param matrices: dict prefix -> list of rows [forward primers, reverse primers, efficiency, coverage,
+                         matching-bias], the primers are lists of degenerate sequences
+        """
+        dictionary = {}
+        arrays = {}
+        for prefix in PREFIXES:
+            rows = matrices.get(prefix) or []
+            arrays[prefix + '_primer_sets'] = np.array(
+                    [[dictionary.setdefault('\t'.join(row[i]), len(dictionary)) for i in range(len(SIDES))]
+                     for row in rows], dtype=np.int32).reshape(-1, len(SIDES))
+            arrays[prefix + '_scores'] = np.array([row[2:5] for row in rows], dtype=np.float64).reshape(-1, 3)
+        arrays['primer_sets'] = np.frombuffer('\n'.join(dictionary).encode('ascii'), dtype=np.uint8)
+        return cls(arrays)
+    
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(np.load(BytesIO(data), allow_pickle=False))
+    
+    def to_bytes(self):
+        buffer = BytesIO()
+        np.savez_compressed(buffer, **dict((name, self[name]) for name in self.names))
+        return buffer.getvalue()
+    
+    @property
+    def primer_sets(self):
+        # the dictionary, decoded once: object array of lists of degenerate primers
+        if 'primer_sets.decoded' not in self._loaded:
+            primer_sets = self['primer_sets'].tobytes().decode('ascii').split('\n')
+            decoded = np.empty(len(primer_sets), dtype=object)
+            for i, primer_set in enumerate(primer_sets):
+                decoded[i] = primer_set.split('\t')
+            self._loaded['primer_sets.decoded'] = decoded
+        return self._loaded['primer_sets.decoded']
+    
+    def count(self, prefix):
+        return len(self[prefix + '_scores'])
+    
+    def scores(self, prefix):
+        # rows x (efficiency, coverage, matching-bias)
+        return self[prefix + '_scores']
+    
+    def primers(self, prefix, side, indexes=None):
+        """
+        :param side: 'forward' or 'reverse'
+        :param indexes: [Optional] indexes of the rows, all the rows if None. Default: None.
+        :return: object array of the lists of degenerate primers of every row
+        """
+        codes = self[prefix + '_primer_sets'][:, SIDES.index(side)]
+        return self.primer_sets[codes if indexes is None else codes[indexes]]
+    
+    def rows(self, prefix, indexes=None):
+        """
+        :param indexes: [Optional] indexes of the rows, all the rows if None. Default: None.
+        :return: list of rows [forward primers, reverse primers, efficiency, coverage, matching-bias]
+        """
+        scores = self.scores(prefix)
+        return [[forward, reverse, *row_scores] for forward, reverse, row_scores in zip(
+                self.primers(prefix, 'forward', indexes), self.primers(prefix, 'reverse', indexes),
+                (scores if indexes is None else scores[indexes]).tolist())]
+    
+    def select(self, prefix, order_by=None, thresholds=None, fields=ROW_FIELDS, offset=0, limit=None, after=None):
+        """
+        Rows filtered, sorted and sliced on the arrays, only the primers of the returned rows are decoded
+        :param order_by: [Optional] name of a score, '-' prefixed for descending order, rows with the same score are
+                         in file order. File order if None. Default: None.
+        :param thresholds: [Optional] dict 'min_<score name>' or 'max_<score name>' -> value. Default: None.
+        :param fields: [Optional] ROW_FIELDS to return, the index of the row (in file order) is returned always.
+        :param offset: [Optional] rows to skip. Default: 0.
+        :param limit: [Optional] maximum number of rows, all the rows if None. Default: None.
+        :param after: [Optional] index of the last row of the previous page: keyset paging, the rows after it in the
+                      order are returned (offset is applied after them). Default: None.
+        :return: dict total (number of rows after the thresholds), rows (list of dicts), next (index to pass as after
+                 to get the next page, None if this is the last one)
+        Raises ValueError if a parameter is invalid
+        """
+        unknown = set(fields) - set(ROW_FIELDS)
+        if unknown:
+            raise ValueError("unknown fields: " + ', '.join(sorted(unknown)))
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit must not be negative")
+        scores = self.scores(prefix)
+        indexes = np.arange(len(scores))
+        mask = np.ones(len(scores), dtype=bool)
+        for name, value in (thresholds or {}).items():
+            if name not in THRESHOLD_NAMES:
+                raise ValueError("unknown threshold '{}'".format(name))
+            bound, _, score_name = name.partition('_')
+            column = scores[:, SCORE_NAMES.index(score_name)]
+            mask &= column >= value if bound == 'min' else column <= value
+        
+        if order_by is None:
+            key = np.zeros(len(scores))
+        elif order_by.lstrip('-') in SCORE_NAMES:
+            key = scores[:, SCORE_NAMES.index(order_by.lstrip('-'))]
+            if order_by.startswith('-'):
+                key = -key
+        else:
+            raise ValueError("order_by must be one of: " + ', '.join(SCORE_NAMES) + ", optionally prefixed by '-'")
+        
+        total = int(mask.sum())
+        if after is not None:
+            if not 0 <= after < len(scores):
+                raise ValueError("after must be the index of a row")
+            mask &= (key > key[after]) | ((key == key[after]) & (indexes > after))
+        selected = indexes[mask]
+        # stable: file order among equal keys, as the keyset condition above
+        selected = selected[np.argsort(key[selected], kind='stable')]
+        page = selected[offset:None if limit is None else offset + limit]
+        
+        rows = [dict(index=index) for index in page.tolist()]
+        for side in SIDES:
+            if side in fields:
+                for row, primers in zip(rows, self.primers(prefix, side, page)):
+                    row[side] = primers
+        for i, score_name in enumerate(SCORE_NAMES):
+            if score_name in fields:
+                for row, score in zip(rows, scores[page, i].tolist()):
+                    row[score_name] = score
+        return dict(total=total, rows=rows,
+                    next=rows[-1]['index'] if rows and offset + len(page) < len(selected) else None)
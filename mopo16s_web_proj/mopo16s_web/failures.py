@@ -0,0 +1,72 @@
+from mopo16s_web_proj.settings import MOPO16S_PATH, MOPO16S_FAILURE_PATTERNS, MOPO16S_RETRY_DELAY, \
+    MOPO16S_RETRY_BACKOFF_MAX, MOPO16S_RETRY_DOWNSIZE_FACTOR
+from errno import ENOSPC, ENOMEM, EDQUOT
+from signal import SIGKILL
+import re
+import subprocess
+
+
+# the same failure would happen again: fail fast
+FAILURE_DETERMINISTIC = 'deterministic'
+# not enough memory or disk: retry later, with less threads
+FAILURE_RESOURCE = 'resource'
+# anything else (e.g. worker shutdown, connection errors): retry normally
+FAILURE_TRANSIENT = 'transient'
+
+_failure_patterns = dict((kind, [re.compile(pattern) for pattern in patterns])
+                         for kind, patterns in MOPO16S_FAILURE_PATTERNS.items())
+
+
+def classify_failure(exc, resources=None, memory_reserved=None):
+    """
+    Classify the failure of a run of mopo16s by its exit code, its stderr and its resource usage
+    :param exc: exception raised by the run
+    :param resources: resources used by mopo16s, see utils.rusage_to_dict
+    :param memory_reserved: bytes of memory reserved for mopo16s
+    :return: tuple (kind, reason), kind is one of FAILURE_DETERMINISTIC, FAILURE_RESOURCE, FAILURE_TRANSIENT
+    """
+    resources = resources or {}
+    if isinstance(exc, subprocess.CalledProcessError):
+        if resources.get('oom_kills'):
+            return FAILURE_RESOURCE, 'killed by the OOM killer'
+        if exc.returncode == -SIGKILL:
+            return FAILURE_RESOURCE, 'killed by SIGKILL'
+        # resource patterns first: e.g. 'cannot allocate memory' must not be taken for 'cannot open'
+        for kind in (FAILURE_RESOURCE, FAILURE_DETERMINISTIC):
+            for pattern in _failure_patterns.get(kind, ()):
+                match = pattern.search(exc.stderr or '')
+                if match:
+                    return kind, "stderr contains '{}'".format(match.group(0))
+        if exc.returncode in (126, 127):
+            return FAILURE_DETERMINISTIC, 'mopo16s cannot be executed (exit code {})'.format(exc.returncode)
+        if memory_reserved and resources.get('max_rss', 0) >= memory_reserved:
+            return FAILURE_RESOURCE, 'used all the memory reserved ({} bytes)'.format(memory_reserved)
+        return FAILURE_TRANSIENT, 'exit code {}'.format(exc.returncode)
+    if isinstance(exc, MemoryError):
+        return FAILURE_RESOURCE, 'out of memory'
+    if isinstance(exc, OSError):
+        if exc.errno in (ENOSPC, ENOMEM, EDQUOT):
+            return FAILURE_RESOURCE, exc.strerror
+        if exc.filename == MOPO16S_PATH:
+            return FAILURE_DETERMINISTIC, 'mopo16s cannot be executed: {}'.format(exc.strerror)
+    if isinstance(exc, (KeyError, ValueError, TypeError)):
+        # e.g. invalid parameters of the job
+        return FAILURE_DETERMINISTIC, '{}: {}'.format(type(exc).__name__, exc)
+    return FAILURE_TRANSIENT, type(exc).__name__
+
+
+def retry_policy(kind, retries, threads=None):
+    """
+    What to do after a failure of the given kind
+    :param retries: number of retries already done
+    :param threads: threads used by the failed run
+    :return: dict with action ('fail' or 'retry'), countdown (seconds) and max_threads (None for no limit)
+    """
+    if kind == FAILURE_DETERMINISTIC:
+        return dict(action='fail', countdown=None, max_threads=None)
+    if kind == FAILURE_RESOURCE:
+        # exponential backoff, so the memory pressure can go down, and less threads (that need less memory)
+        return dict(action='retry',
+                    countdown=min(MOPO16S_RETRY_DELAY * 2 ** (retries + 1), MOPO16S_RETRY_BACKOFF_MAX),
+                    max_threads=max(1, int(threads * MOPO16S_RETRY_DOWNSIZE_FACTOR)) if threads else None)
+    return dict(action='retry', countdown=MOPO16S_RETRY_DELAY, max_threads=None)
@@ -0,0 +1,53 @@
+from mopo16s_web_proj.caches import cache
+from mopo16s_web_proj.settings import MOPO16S_FAIR_SHARE_HALF_LIFE, MOPO16S_FAIR_SHARE_UNIT
+from mopo16s_web.allocator import get_threads_by_user
+from math import log2
+from time import time
+
+
+# CPU-hours used by every user (user_id -> hours), decayed with a half-life, and the time of their last update
+USAGE_KEY = 'fairshare:usage'
+USAGE_UPDATED_KEY = 'fairshare:usage:updated'
+
+# decay the usage of the user ARGV[1] to the time ARGV[3], then add ARGV[2] CPU-hours, atomically
+_charge_usage_script = cache.register_script("""
+local usage = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local updated = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or ARGV[3])
+usage = usage * math.pow(0.5, (tonumber(ARGV[3]) - updated) / tonumber(ARGV[4])) + tonumber(ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[1], usage)
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+return tostring(usage)
+""")
+
+
+def charge_usage(user_id, cpu_hours):
+    return float(_charge_usage_script(keys=(USAGE_KEY, USAGE_UPDATED_KEY),
+                                      args=(user_id, cpu_hours, time(), MOPO16S_FAIR_SHARE_HALF_LIFE)))
+
+
+def get_usages(user_ids):
+    """
+    :return: dict user_id -> CPU-hours recently used, decayed to now
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    pipe = cache.pipeline(transaction=False)
+    pipe.hmget(USAGE_KEY, user_ids)
+    pipe.hmget(USAGE_UPDATED_KEY, user_ids)
+    usages, updates = pipe.execute()
+    now = time()
+    return dict((user_id, float(usage) * 0.5 ** ((now - float(updated)) / MOPO16S_FAIR_SHARE_HALF_LIFE)
+                 if usage is not None else 0.0)
+                for user_id, usage, updated in zip(user_ids, usages, updates))
+
+
+def get_penalties(user_ids):
+    """
+    Priority levels lost by every user: one for every doubling of its usage, in MOPO16S_FAIR_SHARE_UNIT units.
+    Threads allocated right now count as a unit each, so a user running many jobs is deferred at once.
+    :return: dict user_id -> levels
+    """
+    threads_by_user = get_threads_by_user()
+    return dict((user_id, int(log2(1 + usage / MOPO16S_FAIR_SHARE_UNIT + threads_by_user.get(str(user_id), 0))))
+                for user_id, usage in get_usages(user_ids).items())
@@ -0,0 +1,73 @@
+from mopo16s_web.models import Result, cluster_seq_by_length, degenerate_primer_set
+from django.core.management.base import BaseCommand, CommandError
+from Bio import motifs
+from Bio.Seq import Seq
+from random import Random
+from time import perf_counter
+
+
+def bio_primer_set(primer_set):
+    # the previous implementation: Bio.motifs for every cluster of every row, without memoization
+    return tuple(str(motifs.create([Seq(seq) for seq in cluster]).degenerate_consensus)
+                 for cluster in cluster_seq_by_length(primer_set.split('\t')))
+
+
+def synthetic_primer_sets(rows, unique, seed=0):
+    """
+    Primer sets like the ones of mopo16s: variants of similar length of a primer
+    :param rows: number of primer sets
+    :param unique: fraction of distinct primer sets, the others are repeated
+    """
+    rng = Random(seed)
+    pool = []
+    for _ in range(max(1, int(rows * unique))):
+        primer = [rng.choice('ACGT') for _ in range(rng.randint(17, 21))]
+        variants = []
+        for _ in range(rng.randint(1, 8)):
+            variant = list(primer)
+            for _ in range(rng.randint(0, 2)):
+                variant[rng.randrange(len(variant))] = rng.choice('ACGT')
+            variants.append(''.join(variant[:len(variant) - rng.randint(0, 1)]))
+        pool.append('\t'.join(variants))
+    return pool + [rng.choice(pool) for _ in range(rows - len(pool))]
+
+
+class Command(BaseCommand):
+    help = 'Compare the degenerate sequences computed by Bio.motifs and by the NumPy engine used by ' \
+           'Result.structure_data: check that they are identical and report the speedup.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Number of synthetic primer sets.')
+        parser.add_argument('--unique', type=float, default=0.5, help='Fraction of distinct synthetic primer sets.')
+        parser.add_argument('--result', type=int, default=None,
+                            help='Job id of a result to use instead of the synthetic primer sets.')
+    
+    def handle(self, *args, **options):
+        if options['result'] is not None:
+            try:
+                result = Result.objects.get(job_id=options['result'])
+            except Result.DoesNotExist as e:
+                raise CommandError(e)
+            primer_sets = [primer_set for prefix in Result.PREFIXES
+                           for line in getattr(result, prefix + '_primers').splitlines()
+                           for primer_set in line.split('\tx\t')]
+        else:
+            primer_sets = synthetic_primer_sets(options['rows'], options['unique'])
+        
+        started = perf_counter()
+        expected = [bio_primer_set(primer_set) for primer_set in primer_sets]
+        bio_time = perf_counter() - started
+        degenerate_primer_set.cache_clear()
+        started = perf_counter()
+        computed = [degenerate_primer_set(primer_set) for primer_set in primer_sets]
+        numpy_time = perf_counter() - started
+        
+        mismatches = sum(a != b for a, b in zip(expected, computed))
+        self.stdout.write('{} primer sets ({} distinct)\n'
+                          'Bio.motifs: {:.3f} s\n'
+                          'NumPy, memoized: {:.3f} s ({:.1f}x faster)\n'
+                          '{}'.format(len(primer_sets), len(set(primer_sets)), bio_time, numpy_time,
+                                      bio_time / numpy_time if numpy_time else float('inf'),
+                                      'identical' if not mismatches else '{} MISMATCHES'.format(mismatches)))
+        if mismatches:
+            raise CommandError('the NumPy engine differs from Bio.motifs')
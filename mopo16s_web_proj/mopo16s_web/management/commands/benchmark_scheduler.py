@@ -0,0 +1,269 @@
+from mopo16s_web_proj.settings import MOPO16S_PARAMETERS, MOPO16S_LOGS_ROOT
+from mopo16s_web_proj.celery import app as celery_app
+from mopo16s_web_proj.caches import cache
+from mopo16s_web.models import Job, Run, Result, RepresentativeSequenceSet, InitialPrimerPairs
+from mopo16s_web import tasks
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.conf import settings
+from redis.client import Redis, Pipeline
+from redis.exceptions import ResponseError
+from contextlib import contextmanager, ExitStack
+from threading import Lock
+from shutil import rmtree
+from json import dumps
+from time import sleep, time
+from os import path, environ
+
+
+FINAL_STATUSES = (Job.STATUS_COMPLETED, Job.STATUS_FAILED, Job.STATUS_CANCELLED)
+
+
+class CallCounter:
+    # thread-safe counter, for the calls made by the threads of an in-process worker too
+    
+    def __init__(self):
+        self.count = 0
+        self._lock = Lock()
+    
+    def add(self, count=1):
+        with self._lock:
+            self.count += count
+    
+    def __call__(self, execute, sql, params, many, context):
+        # django database execute wrapper
+        self.add()
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_db_queries(counter):
+    # queries of the connections already open and of the ones opened by other threads meanwhile
+    def add_wrapper(sender, connection, **kwargs):
+        connection.execute_wrappers.append(counter)
+    
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        connection_created.connect(add_wrapper, weak=False)
+        try:
+            yield counter
+        finally:
+            connection_created.disconnect(add_wrapper)
+
+
+@contextmanager
+def count_redis_commands(counter):
+    # commands sent by this process (pipelines count their commands), fakeredis included
+    execute_command, execute = Redis.execute_command, Pipeline.execute
+    
+    def counted_execute_command(self, *args, **kwargs):
+        counter.add()
+        return execute_command(self, *args, **kwargs)
+    
+    def counted_execute(self, *args, **kwargs):
+        counter.add(len(self.command_stack))
+        return execute(self, *args, **kwargs)
+    
+    Redis.execute_command, Pipeline.execute = counted_execute_command, counted_execute
+    try:
+        yield counter
+    finally:
+        Redis.execute_command, Pipeline.execute = execute_command, execute
+
+
+def redis_server_commands():
+    # commands executed by the Redis server (all the clients, workers included), None if not supported
+    try:
+        return sum(stats['calls'] for stats in cache.info('commandstats').values())
+    except (ResponseError, KeyError, TypeError):
+        return None
+
+
+def percentiles(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return dict(count=0)
+    
+    def percentile(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+    
+    return dict(count=len(values), mean=sum(values) / len(values), p50=percentile(50), p90=percentile(90),
+                p99=percentile(99), max=values[-1])
+
+
+def collect_job_metrics(jobs_ids):
+    """
+    Timings of the jobs, from the database, so that they include the work of any worker
+    :return: dict job id -> dict (status, queue_latency, allocation_attempts, allocation_wait, mopo16s_time,
+             end_to_end, overhead), times in seconds, None if not measured
+    """
+    metrics = dict((job_id, dict(status=status, created=created, started=None, allocation_attempts=0,
+                                 allocation_wait=0, mopo16s_time=None, end_to_end=None))
+                   for job_id, status, created in Job.objects.filter(id__in=jobs_ids)
+                   .values_list('id', 'status', 'date_created'))
+    for job_id, started, log_data in Run.objects.filter(job_id__in=jobs_ids).order_by('id') \
+            .values_list('job_id', 'date_started', 'log_data'):
+        job = metrics[job_id]
+        job['started'] = min(job['started'] or started, started)
+        allocation = log_data.get('allocation') or {}
+        job['allocation_attempts'] += allocation.get('attempts', 0)
+        job['allocation_wait'] += allocation.get('wait', 0)
+        wall_time = (log_data.get('resources') or {}).get('wall_time')
+        if log_data.get('completed') and wall_time is not None:
+            # the longest shard, for a distributed job
+            job['mopo16s_time'] = max(job['mopo16s_time'] or 0, wall_time)
+    for job_id, completed in Result.objects.filter(job_id__in=jobs_ids).values_list('job_id', 'date_completed'):
+        metrics[job_id]['end_to_end'] = (completed - metrics[job_id]['created']).total_seconds()
+    for job in metrics.values():
+        job['queue_latency'] = (job.pop('started') - job['created']).total_seconds() if job['started'] else None
+        job['overhead'] = None
+        if job['end_to_end'] is not None and job['mopo16s_time'] is not None:
+            job['overhead'] = job['end_to_end'] - job['mopo16s_time']
+        del job['created']
+    return metrics
+
+
+def delete_jobs(jobs_ids):
+    # models are not managed: delete the dependent rows first
+    Result.objects.filter(job_id__in=jobs_ids).delete()
+    Run.objects.filter(job_id__in=jobs_ids).delete()
+    Job.objects.filter(id__in=jobs_ids).delete()
+    for job_id in jobs_ids:
+        rmtree(MOPO16S_LOGS_ROOT + '/job_{}'.format(job_id), ignore_errors=True)
+
+
+class Command(BaseCommand):
+    help = 'Submit many jobs executed by a synthetic mopo16s (benchmark/fake_mopo16s.py) and report queue latency, ' \
+           'allocation contention, database and Redis calls and end-to-end overhead per job. ' \
+           'Run it with MOPO16S_PATH pointing to the fake mopo16s (and MOPO16S_FAKEREDIS=1 for an in-process Redis), ' \
+           'with --in-process, or with workers started with the same environment.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=100, help='Number of jobs to submit.')
+        parser.add_argument('--user', required=True, help='Username of the creator of the jobs.')
+        parser.add_argument('--rep-set', type=int, required=True, help='Id of the representative sequence set.')
+        parser.add_argument('--good-pairs', type=int, required=True, help='Id of the initial primer pairs.')
+        parser.add_argument('--runs', type=int, default=MOPO16S_PARAMETERS['runs']['default'],
+                            help='Runs of every job.')
+        parser.add_argument('--distributed', action='store_true', help='Split the runs of every job in shards.')
+        parser.add_argument('--reuse', action='store_true',
+                            help='Let the jobs reuse identical results, otherwise every job runs the fake mopo16s.')
+        parser.add_argument('--in-process', type=int, default=0, metavar='CONCURRENCY',
+                            help='Execute the jobs with a worker of CONCURRENCY threads in this process, '
+                                 'with an in-memory broker. Default: 0, use the running workers.')
+        parser.add_argument('--fake-seconds', type=float, default=0.1, help='Seconds of every run of the fake.')
+        parser.add_argument('--fake-mode', choices=('sleep', 'burn'), default='sleep')
+        parser.add_argument('--fake-pairs', type=int, default=20, help='Primer pairs written by the fake.')
+        parser.add_argument('--fake-fail-rate', type=float, default=0, help='Probability of a failure of the fake.')
+        parser.add_argument('--timeout', type=float, default=3600, help='Seconds to wait for the jobs.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+        parser.add_argument('--keep', action='store_true', help='Keep the jobs, otherwise they are deleted.')
+    
+    def handle(self, *args, **options):
+        if path.basename(tasks.MOPO16S_PATH) != 'fake_mopo16s.py':
+            raise CommandError('MOPO16S_PATH is {}: set it to benchmark/fake_mopo16s.py, '
+                               'the benchmark would run the real mopo16s'.format(tasks.MOPO16S_PATH))
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+            rep_set = RepresentativeSequenceSet.objects.get(id=options['rep_set'])
+            good_pairs = InitialPrimerPairs.objects.get(id=options['good_pairs'])
+        except (get_user_model().DoesNotExist, RepresentativeSequenceSet.DoesNotExist,
+                InitialPrimerPairs.DoesNotExist) as e:
+            raise CommandError(e)
+        # inherited by the fake mopo16s of the in-process worker (external workers need them in their environment)
+        environ.update(FAKE_MOPO16S_SECONDS=str(options['fake_seconds']), FAKE_MOPO16S_MODE=options['fake_mode'],
+                       FAKE_MOPO16S_PAIRS=str(options['fake_pairs']),
+                       FAKE_MOPO16S_FAIL_RATE=str(options['fake_fail_rate']))
+        
+        db_queries, redis_commands = CallCounter(), CallCounter()
+        jobs_ids = []
+        with ExitStack() as stack:
+            if options['in_process']:
+                stack.enter_context(self.in_process_worker(options['in_process']))
+            stack.enter_context(count_db_queries(db_queries))
+            stack.enter_context(count_redis_commands(redis_commands))
+            server_commands = redis_server_commands()
+            started = time()
+            for i in range(options['jobs']):
+                # the same path of jobs_new
+                job = Job(name='benchmark #{}'.format(i), description='Scheduler benchmark', is_public=False,
+                          created_by=user, rep_set=rep_set, good_pairs=good_pairs)
+                # a different seed for every job, so that they are not identical
+                job.set_mopo16s_parameters((('runs', options['runs']), ('seed', i)))
+                job.set_shards(options['distributed'])
+                job.estimated_runtime = job.estimate_runtime()
+                job.save()
+                tasks.submit_jobs([job], force_run=not options['reuse'])
+                jobs_ids.append(job.id)
+            submitted = time()
+            finished, polls = self.wait(jobs_ids, options['timeout'])
+            elapsed = time() - started
+            if server_commands is not None:
+                server_commands = redis_server_commands() - server_commands
+        
+        metrics = collect_job_metrics(jobs_ids)
+        statuses = dict((status, 0) for status in Job.STATUSES)
+        for job in metrics.values():
+            statuses[job['status']] += 1
+        jobs = len(jobs_ids)
+        report = dict(jobs=jobs, finished=finished, statuses=statuses,
+                      submit_time=submitted - started, elapsed=elapsed, throughput=jobs / elapsed,
+                      # the polling of the statuses excluded
+                      db_queries_per_job=(db_queries.count - polls) / jobs,
+                      redis_commands_per_job=redis_commands.count / jobs,
+                      redis_server_commands_per_job=server_commands / jobs if server_commands is not None else None,
+                      emails=len(getattr(self, 'outbox', ())) if options['in_process'] else None,
+                      **dict((name, percentiles(job[name] for job in metrics.values()))
+                             for name in ('queue_latency', 'allocation_attempts', 'allocation_wait', 'mopo16s_time',
+                                          'end_to_end', 'overhead')))
+        if not options['keep']:
+            delete_jobs(jobs_ids)
+        self.stdout.write(dumps(report, indent=2) if options['json'] else self.format_report(report))
+    
+    @contextmanager
+    def in_process_worker(self, concurrency):
+        from celery.contrib.testing.worker import start_worker
+        from django.core import mail
+        # in-memory broker and outbox, the tasks are executed by the threads of a worker in this process
+        celery_app.conf.broker_url = 'memory://'
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+        mail.outbox = self.outbox = []
+        with start_worker(celery_app, pool='threads', concurrency=concurrency, perform_ping_check=False,
+                          queues=[celery_app.conf.task_default_queue, tasks.run_mopo16s_job.queue]):
+            yield
+    
+    @staticmethod
+    def wait(jobs_ids, timeout):
+        # poll the statuses of the jobs, until all of them are completed, failed or cancelled
+        # :return: tuple (True if all the jobs finished, number of polling queries)
+        deadline = time() + timeout
+        polls = 0
+        while time() < deadline:
+            polls += 1
+            if not Job.objects.filter(id__in=jobs_ids).exclude(status__in=FINAL_STATUSES).exists():
+                return True, polls
+            sleep(1)
+        return False, polls
+    
+    @staticmethod
+    def format_report(report):
+        lines = ['{jobs} jobs in {elapsed:.1f} s ({throughput:.2f} jobs/s), submitted in {submit_time:.1f} s{}'.format(
+                '' if report['finished'] else ', NOT ALL FINISHED', **report),
+            'statuses: ' + ', '.join('{} {}'.format(count, status) for status, count in report['statuses'].items()
+                                     if count),
+            'per job: {:.1f} database queries, {:.1f} Redis commands from this process{}'.format(
+                    report['db_queries_per_job'], report['redis_commands_per_job'],
+                    '' if report['redis_server_commands_per_job'] is None else
+                    ', {:.1f} on the server (all clients)'.format(report['redis_server_commands_per_job'])),
+            '{:<20} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9}'.format('', 'count', 'mean', 'p50', 'p90', 'p99', 'max')]
+        if report['emails'] is not None:
+            lines.insert(2, 'emails sent: {}'.format(report['emails']))
+        for name in ('queue_latency', 'allocation_attempts', 'allocation_wait', 'mopo16s_time', 'end_to_end',
+                     'overhead'):
+            stats = report[name]
+            lines.append('{:<20} {:>6}'.format(name, stats['count']) + ''.join(
+                    ' {:>9.3f}'.format(stats[key]) for key in ('mean', 'p50', 'p90', 'p99', 'max') if key in stats))
+        return '\n'.join(lines)
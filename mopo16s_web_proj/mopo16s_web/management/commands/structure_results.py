@@ -0,0 +1,34 @@
+from mopo16s_web.models import Result
+from mopo16s_web.columnar import ResultColumns
+from django.core.management.base import BaseCommand
+from json import dumps as json_dumps
+
+
+class Command(BaseCommand):
+    help = 'Convert the parsed matrices of the results structured before data_npz from JSON to columns ' \
+           '(see ResultColumns), and report the storage saved.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Results converted per query.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the storage that would be saved.')
+    
+    def handle(self, *args, **options):
+        json_bytes = npz_bytes = converted = 0
+        queryset = Result.objects.filter(data_npz__isnull=True).only('job_id', 'data').order_by('job_id')
+        last_id = None
+        while True:
+            batch = list((queryset if last_id is None else queryset.filter(job_id__gt=last_id))
+                         [:options['batch_size']])
+            if not batch:
+                break
+            for result in batch:
+                data_npz = ResultColumns.from_rows(result.data).to_bytes()
+                json_bytes += len(json_dumps(result.data))
+                npz_bytes += len(data_npz)
+                if not options['dry_run']:
+                    Result.objects.filter(job_id=result.job_id).update(data_npz=data_npz, data={})
+                converted += 1
+            last_id = batch[-1].job_id
+        self.stdout.write('{} results {}: {} bytes of JSON, {} bytes of columns ({:.1f}x smaller)'.format(
+                converted, 'to convert' if options['dry_run'] else 'converted', json_bytes, npz_bytes,
+                json_bytes / npz_bytes if npz_bytes else 0))
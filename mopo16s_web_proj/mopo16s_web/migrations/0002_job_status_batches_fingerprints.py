@@ -0,0 +1,168 @@
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# the mopo16s tables are not managed by Django: the schema is changed by RunSQL, the state by the operations below
+SCHEMA_SQL = """
+CREATE TABLE mopo16s_job_batch (
+    id serial PRIMARY KEY,
+    name varchar(128) NOT NULL,
+    description text NOT NULL,
+    is_public boolean NOT NULL,
+    sweep jsonb NOT NULL DEFAULT '{}',
+    date_created timestamp with time zone NOT NULL,
+    created_by_id integer NOT NULL REFERENCES accounts_user (id) DEFERRABLE INITIALLY DEFERRED,
+    rep_set_id integer NOT NULL REFERENCES mopo16s_representative_sequence_set (id) DEFERRABLE INITIALLY DEFERRED,
+    good_pairs_id integer NOT NULL REFERENCES mopo16s_initial_primer_pairs (id) DEFERRABLE INITIALLY DEFERRED
+);
+CREATE INDEX mopo16s_job_batch_created_by_id ON mopo16s_job_batch (created_by_id);
+
+ALTER TABLE mopo16s_job
+    ADD COLUMN status varchar(16) NOT NULL DEFAULT 'pending',
+    ADD COLUMN date_status_changed timestamp with time zone NULL,
+    ADD COLUMN shards smallint NOT NULL DEFAULT 1 CHECK (shards >= 0),
+    ADD COLUMN estimated_runtime double precision NULL,
+    ADD COLUMN force_run boolean NOT NULL DEFAULT false,
+    ADD COLUMN batch_id integer NULL REFERENCES mopo16s_job_batch (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX mopo16s_job_status ON mopo16s_job (status);
+CREATE INDEX mopo16s_job_batch_id ON mopo16s_job (batch_id);
+
+ALTER TABLE mopo16s_result
+    ADD COLUMN fingerprint varchar(64) NULL,
+    ADD COLUMN data_npz bytea NULL;
+CREATE INDEX mopo16s_result_fingerprint ON mopo16s_result (fingerprint);
+
+ALTER TABLE mopo16s_representative_sequence_set ADD COLUMN file_sha256 varchar(64) NULL;
+"""
+
+REVERSE_SCHEMA_SQL = """
+ALTER TABLE mopo16s_representative_sequence_set DROP COLUMN file_sha256;
+ALTER TABLE mopo16s_result DROP COLUMN fingerprint, DROP COLUMN data_npz;
+ALTER TABLE mopo16s_job
+    DROP COLUMN status,
+    DROP COLUMN date_status_changed,
+    DROP COLUMN shards,
+    DROP COLUMN estimated_runtime,
+    DROP COLUMN force_run,
+    DROP COLUMN batch_id;
+DROP TABLE mopo16s_job_batch;
+"""
+
+# status of the existing jobs, as the task signals would have set it, with the rules of the former Job.status
+# and check_failed_jobs: a job is completed if it has a result, running if its task was started and its last run
+# is not finished (check_failed_jobs requeues it if its worker is gone), pending if it was never started,
+# otherwise its runs finished without a result (or its task failed) and it is failed
+STATUS_SQL = """
+WITH job_state AS (
+    SELECT job.id,
+           result.date_completed,
+           task.status AS task_status,
+           last_run.id AS last_run_id,
+           last_run.date_started AS last_run_started,
+           last_run.date_finished AS last_run_finished
+    FROM mopo16s_job job
+    LEFT JOIN mopo16s_result result ON result.job_id = job.id
+    LEFT JOIN django_celery_results_taskresult task ON task.task_id = job.task_id
+    LEFT JOIN LATERAL (SELECT run.id, run.date_started, run.date_finished
+                       FROM mopo16s_run run
+                       WHERE run.job_id = job.id
+                       ORDER BY run.id DESC
+                       LIMIT 1) last_run ON true
+)
+UPDATE mopo16s_job
+SET status = CASE
+        WHEN job_state.date_completed IS NOT NULL THEN 'completed'
+        WHEN job_state.task_status = 'RETRY' THEN 'pending retry'
+        WHEN job_state.task_status = 'STARTED' AND job_state.last_run_finished IS NULL THEN 'running'
+        WHEN job_state.task_status IS NULL AND job_state.last_run_id IS NULL THEN 'pending'
+        ELSE 'failed'
+    END,
+    date_status_changed = COALESCE(job_state.date_completed, job_state.last_run_finished,
+                                   job_state.last_run_started, mopo16s_job.date_created)
+FROM job_state
+WHERE mopo16s_job.id = job_state.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mopo16s_web', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(SCHEMA_SQL, REVERSE_SCHEMA_SQL),
+                migrations.RunSQL(STATUS_SQL, migrations.RunSQL.noop),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='JobBatch',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('name', models.CharField(max_length=128)),
+                        ('description', models.TextField()),
+                        ('is_public', models.BooleanField()),
+                        ('sweep', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                        ('date_created', models.DateTimeField(auto_now_add=True)),
+                        ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='submitted_batches', related_query_name='submitted_batch', to=settings.AUTH_USER_MODEL)),
+                        ('rep_set', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='batches_served', related_query_name='is_used_by_batch', to='mopo16s_web.RepresentativeSequenceSet')),
+                        ('good_pairs', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='batches_served', related_query_name='is_used_by_batch', to='mopo16s_web.InitialPrimerPairs')),
+                    ],
+                    options={
+                        'db_table': 'mopo16s_job_batch',
+                        'managed': False,
+                    },
+                ),
+                migrations.AddField(
+                    model_name='job',
+                    name='status',
+                    field=models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('pending retry', 'pending retry'), ('completed', 'completed'), ('failed', 'failed'), ('cancelled', 'cancelled')], db_index=True, default='pending', max_length=16),
+                ),
+                migrations.AddField(
+                    model_name='job',
+                    name='date_status_changed',
+                    field=models.DateTimeField(default=None, null=True),
+                ),
+                migrations.AddField(
+                    model_name='job',
+                    name='shards',
+                    field=models.PositiveSmallIntegerField(default=1),
+                ),
+                migrations.AddField(
+                    model_name='job',
+                    name='estimated_runtime',
+                    field=models.FloatField(default=None, null=True),
+                ),
+                migrations.AddField(
+                    model_name='job',
+                    name='force_run',
+                    field=models.BooleanField(default=False),
+                ),
+                migrations.AddField(
+                    model_name='job',
+                    name='batch',
+                    field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='jobs', related_query_name='job', to='mopo16s_web.JobBatch'),
+                ),
+                migrations.AddField(
+                    model_name='result',
+                    name='fingerprint',
+                    field=models.CharField(db_index=True, default=None, max_length=64, null=True),
+                ),
+                migrations.AddField(
+                    model_name='result',
+                    name='data_npz',
+                    field=models.BinaryField(default=None, editable=False, null=True),
+                ),
+                migrations.AddField(
+                    model_name='representativesequenceset',
+                    name='file_sha256',
+                    field=models.CharField(default=None, max_length=64, null=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mopo16s_web', '0002_job_status_batches_fingerprints'),
+    ]
+
+    operations = [
+        # the jobs queued before have no date_enqueued: their aging starts from date_created, as before
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL('ALTER TABLE mopo16s_job ADD COLUMN date_enqueued timestamp with time zone NULL;',
+                                  'ALTER TABLE mopo16s_job DROP COLUMN date_enqueued;'),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='job',
+                    name='date_enqueued',
+                    field=models.DateTimeField(default=None, null=True),
+                ),
+            ],
+        ),
+    ]
@@ -1,16 +1,32 @@
 from django.db import models
 from django.contrib.postgres.fields import JSONField
-from mopo16s_web_proj.settings import MOPO16S_VERSION, AUTH_USER_MODEL, MOPO16S_PARAMETERS
-from django.db.models import Q, F, Func, Value
-from django.db.models.functions import Concat
+from django.contrib.postgres.fields.jsonb import KeyTransform, KeyTextTransform
+from mopo16s_web_proj.settings import MOPO16S_VERSION, AUTH_USER_MODEL, MOPO16S_PARAMETERS, \
+    MOPO16S_MAX_SHARDS, MOPO16S_LOGS_ROOT, MOPO16S_MEMORY_BASE, \
+    MOPO16S_MEMORY_PER_REP_SET_BYTE, MOPO16S_MEMORY_PER_THREAD, MOPO16S_MEMORY_SAFETY_MARGIN, \
+    MOPO16S_PRIORITY_AGING_INTERVAL, MOPO16S_MAX_BATCH_JOBS, MOPO16S_ALLOCATION_MAX_WAIT
+from django.db import transaction
+from django.db.models import Q, F, Func, Value, Count, Avg, Max, FloatField, IntegerField
+from django.db.models.functions import Concat, Cast, Coalesce, NullIf
 from time import strftime, time
+from datetime import timedelta
 from django.utils.timezone import now as tznow
 from django.core.files.base import File
+from django.utils.functional import cached_property
 from celery.result import AsyncResult
-from mopo16s_web_proj.celery import task_is_running
 from django_celery_results.models import TaskResult
-from mopo16s_web_proj.caches import cache_celery
-from json import loads as json_loads
+from mopo16s_web_proj.celery import get_queue_position
+from mopo16s_web.utils import file_sha256, split_runs, derive_seed, fit_memory_model, sweep_grid, \
+    degenerate_consensus
+from mopo16s_web.runtime import runtime_features, fit_runtime_model, predict_runtime, get_runtime_model, \
+    set_runtime_model, runtime_priority, RUNTIME_HISTORY_SIZE, PRIORITY_HIGHEST, PRIORITY_LOWEST
+from mopo16s_web.fairshare import get_penalties
+from mopo16s_web.progress import get_progresses
+from mopo16s_web.nodes import get_max_threads_per_instance, get_task_queue
+from mopo16s_web.columnar import ResultColumns, SIDES, ROW_FIELDS
+from hashlib import sha256
+from functools import lru_cache
+from json import dumps as json_dumps
 from Bio import motifs
 from Bio.Seq import Seq
 import pandas as pd
@@ -59,6 +75,8 @@ class RepresentativeSequenceSet(models.Model):
     description = models.TextField(null=False, blank=False)
     file = models.FileField(upload_to=rep_sets_upload_path, db_column='file_path', max_length=128)
     file_size = models.IntegerField(verbose_name='File size')
+    # digest of the file, computed at upload (or at its first use, for older sets)
+    file_sha256 = models.CharField(max_length=64, null=True, default=None)
     sequences_count = models.IntegerField(verbose_name='Number of sequences')
     is_public = models.BooleanField()
     is_curated = models.BooleanField()
@@ -90,6 +108,13 @@ class RepresentativeSequenceSet(models.Model):
                 s = s[:max_length - 5 - len(count)] + '[...]'
         return s + count
     
+    @property
+    def content_hash(self):
+        if self.file_sha256 is None:
+            self.file_sha256 = file_sha256(self.file.path)
+            self.save(update_fields=['file_sha256'])
+        return self.file_sha256
+    
     def delete(self, **kwargs):
         # when deleting the object, delete the file too
         self.file.delete()
@@ -116,6 +141,11 @@ class InitialPrimerPairsManager(models.Manager):
     
     def get_content_size_queryset(self):
         return self.annotate(content_size=Func(F('content'), function='octet_length'))
+    
+    def get_content_hash(self, primer_pairs_id):
+        # the digest is computed by the database, without transferring the content
+        return self.filter(id=primer_pairs_id).annotate(content_hash=Func(F('content'), function='md5')) \
+            .values_list('content_hash', flat=True).get()
 
 
 class InitialPrimerPairs(models.Model):
@@ -198,7 +228,140 @@ class JobManager(models.Manager):
 JOB_MAX_RUN_RETRIES = 5
 
 
+class JobBatch(models.Model):
+    """
+    Parameter sweep: one job for every combination of the swept values, with the same input files
+    """
+    # parameters (low, high): combinations with low greater than high are not created
+    PARAMETER_BOUNDS = (('minPrimerLen', 'maxPrimerLen'), ('minGCCont', 'maxGCCont'))
+    
+    # same visibility of the jobs
+    objects = JobManager()
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=128, null=False, blank=False)
+    description = models.TextField(null=False, blank=False)
+    is_public = models.BooleanField()
+    # parameter name -> swept values, the other parameters are the same for all the jobs
+    sweep = JSONField(default=dict, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    created_by = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.DO_NOTHING,
+                                   related_name='submitted_batches', related_query_name='submitted_batch')
+    rep_set = models.ForeignKey(RepresentativeSequenceSet, on_delete=models.DO_NOTHING,
+                                related_name='batches_served', related_query_name='is_used_by_batch')
+    good_pairs = models.ForeignKey(InitialPrimerPairs, on_delete=models.DO_NOTHING,
+                                   related_name='batches_served', related_query_name='is_used_by_batch')
+    
+    # jobs = reverse relation with Job
+    
+    def __str__(self):
+        return 'Batch {:2d}'.format(self.id)
+    
+    def to_api_dict(self):
+        d = dict(
+                created_by=self.created_by.to_api_dict(),
+                created_at=self.date_created.timestamp(),
+                rep_set=self.rep_set.to_api_dict(),
+                good_pairs=self.good_pairs.to_api_dict(),
+                progress=self.get_progress(),
+                )
+        d.update((name, getattr(self, name)) for name in ('id', 'name', 'description', 'is_public', 'sweep'))
+        return d
+    
+    @property
+    def swept_parameters(self):
+        # parameters with more than one value, the ones that differ between the jobs
+        return sorted(name for name, values in self.sweep.items() if len(values) > 1)
+    
+    def get_parameters_grid(self, parameters):
+        """
+        :param parameters: dict of the parameters shared by the jobs, overridden by the sweep
+        :return: list of the parameters of every job
+        """
+        return sweep_grid(self.sweep, parameters, self.PARAMETER_BOUNDS)
+    
+    def save_with_jobs(self, parameters_grid, distributed=False):
+        """
+        Save the batch and create its jobs in a single transaction, with a single insert for all the jobs.
+        The jobs are not queued, see tasks.submit_jobs
+        :param parameters_grid: list of the mopo16s parameters of every job
+        :param distributed: split the runs of every job in shards
+        :return: list of the created jobs
+        """
+        if not 0 < len(parameters_grid) <= MOPO16S_MAX_BATCH_JOBS:
+            raise ValueError('a batch must have between 1 and {} jobs'.format(MOPO16S_MAX_BATCH_JOBS))
+        swept = self.swept_parameters
+        with transaction.atomic():
+            self.save()
+            jobs = []
+            for parameters in parameters_grid:
+                label = ', '.join('{}={}'.format(name, parameters[name]) for name in swept)
+                job = Job(batch=self, name='{} [{}]'.format(self.name, label)[:128] if label else self.name,
+                          description=self.description, is_public=self.is_public, created_by_id=self.created_by_id,
+                          # the same instances for every job: the sequence set file is hashed only once
+                          rep_set=self.rep_set, good_pairs=self.good_pairs, mopo16s_parameters=parameters)
+                job.set_shards(distributed)
+                job.estimated_runtime = job.estimate_runtime()
+                jobs.append(job)
+            return Job.objects.bulk_create(jobs)
+    
+    def get_progress(self):
+        """
+        Aggregate progress of the jobs of the batch
+        :return: dict with the number of jobs (total, by status and still active),
+                 runs and runs done by the running jobs
+        """
+        jobs = dict(self.jobs.values_list('id', 'status'))
+        statuses = dict((status, 0) for status in Job.STATUSES)
+        for status in jobs.values():
+            statuses[status] += 1
+        running = [job_id for job_id, status in jobs.items() if status == Job.STATUS_RUNNING]
+        snapshots = get_progresses(running).values()
+        return dict(jobs=len(jobs), statuses=statuses,
+                    active=sum(statuses[status] for status in (Job.STATUS_PENDING, Job.STATUS_RUNNING,
+                                                               Job.STATUS_PENDING_RETRY)),
+                    runs=sum(snapshot.get('runs', 0) for snapshot in snapshots),
+                    runs_done=sum(snapshot.get('runs_done', 0) for snapshot in snapshots))
+    
+    def get_comparison(self):
+        """
+        Best scores of the optimized primer pairs of every job, to compare the swept values
+        :return: list of dicts (job_id, name, status, parameters, pairs, efficiency, coverage, matching_bias),
+                 scores are None until the job is completed
+        """
+        swept = self.swept_parameters
+        # only the scores are decompressed, not the primers
+        results = dict((result.job_id, result.columns.scores('out')) for result in
+                       Result.objects.filter(job__batch_id=self.id).only('job_id', 'data_npz'))
+        rows = []
+        for job in self.jobs.order_by('id').only('id', 'name', 'status', 'mopo16s_parameters'):
+            scores = results.get(job.id, ())
+            rows.append(dict(
+                    job_id=job.id, name=job.name, status=job.status,
+                    parameters=dict((name, job.mopo16s_parameters.get(name)) for name in swept),
+                    pairs=len(scores) if job.id in results else None,
+                    # efficiency and coverage are maximized, matching-bias is minimized
+                    efficiency=float(scores[:, 0].max()) if len(scores) else None,
+                    coverage=float(scores[:, 1].max()) if len(scores) else None,
+                    matching_bias=float(scores[:, 2].min()) if len(scores) else None,
+                    ))
+        return rows
+    
+    class Meta:
+        managed = False
+        db_table = 'mopo16s_job_batch'
+
+
 class Job(models.Model):
+    # status is kept up to date by the lifecycle signals of the task (see tasks.py)
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_PENDING_RETRY = 'pending retry'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUSES = (STATUS_PENDING, STATUS_RUNNING, STATUS_PENDING_RETRY, STATUS_COMPLETED, STATUS_FAILED,
+                STATUS_CANCELLED)
+    
     objects = JobManager()
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=128, null=False, blank=False)
@@ -215,6 +378,20 @@ class Job(models.Model):
                                 related_name='jobs_served', related_query_name='is_used')
     good_pairs = models.ForeignKey(InitialPrimerPairs, on_delete=models.DO_NOTHING,
                                    related_name='jobs_served', related_query_name='is_used')
+    status = models.CharField(max_length=16, choices=[(status, status) for status in STATUSES],
+                              default=STATUS_PENDING, db_index=True)
+    date_status_changed = models.DateTimeField(null=True, default=None)
+    # first time the job was queued, kept by the retries and the requeues: the waiting time for the aging
+    date_enqueued = models.DateTimeField(null=True, default=None)
+    # number of tasks the runs are split into, each one with its own runs range and seed
+    shards = models.PositiveSmallIntegerField(default=1)
+    # seconds, predicted at submission by the runtime model (None if there was not enough history)
+    estimated_runtime = models.FloatField(null=True, default=None)
+    # run mopo16s even if an identical job was completed, honored by every task of the job (retries, requeues)
+    force_run = models.BooleanField(default=False)
+    # parameter sweep the job belongs to, if any
+    batch = models.ForeignKey(JobBatch, on_delete=models.DO_NOTHING, null=True, default=None,
+                              related_name='jobs', related_query_name='job')
     
     # result = reverse relation with Result
     # runs = reverse relation with Run
@@ -229,20 +406,95 @@ class Job(models.Model):
         d = dict(
                 created_by=self.created_by.to_api_dict(),
                 created_at=self.date_created.timestamp(),
+                status_changed_at=self.date_status_changed.timestamp() if self.date_status_changed else None,
                 rep_set=self.rep_set.to_api_dict(),
                 good_pairs=self.good_pairs.to_api_dict(),
                 )
         d.update((name, getattr(self, name))
                  for name in (
-                     'id', 'name', 'description', 'is_public',
+                     'id', 'name', 'description', 'is_public', 'status', 'shards', 'estimated_runtime', 'batch_id',
                      'mopo16s_version', 'mopo16s_parameters')
                  )
+        if self.is_pending:
+            d['queue_position'] = self.queue_position
         return d
     
     @property
     def mopo16s_command_options(self):
         return ('--{}={}'.format(option, value) for option, value in self.mopo16s_parameters.items())
     
+    def get_shard_command_options(self, shard):
+        # same options of the job, but with the runs and the seed of the shard
+        start, stop = self.get_shard_runs_range(shard)
+        parameters = dict(self.mopo16s_parameters, runs=stop - start, seed=self.get_shard_seed(shard))
+        return ('--{}={}'.format(option, value) for option, value in parameters.items())
+    
+    def get_shard_runs_range(self, shard):
+        return split_runs(self.mopo16s_parameters['runs'], self.shards)[shard]
+    
+    def get_shard_seed(self, shard):
+        return derive_seed(self.mopo16s_parameters_normalized['seed'], shard)
+    
+    def set_shards(self, distributed):
+        # split the runs across workers, so that every shard fits a single mopo16s instance
+        self.shards = 1
+        if distributed:
+            runs = self.mopo16s_parameters['runs']
+            self.shards = max(1, min(-(-runs // get_max_threads_per_instance()), MOPO16S_MAX_SHARDS, runs))
+    
+    def get_memory_model(self):
+        """
+        Memory needed by mopo16s for this job, estimated from the last measured runs with the same
+        representative sequence set, or from the size of its file if there are none
+        :return: tuple (base, per_thread) in bytes, safety margin included
+        """
+        resources = KeyTransform('resources', 'log_data')
+        points = Run.objects.filter(job__rep_set_id=self.rep_set_id, log_data__has_key='resources') \
+            .annotate(threads=Cast(KeyTextTransform('threads', 'log_data'), IntegerField()),
+                      peak=Coalesce(Cast(KeyTextTransform('memory_peak', resources), FloatField()),
+                                    Cast(KeyTextTransform('max_rss', resources), FloatField()))) \
+            .order_by('-id').values_list('threads', 'peak')[:100]
+        model = fit_memory_model(((threads, peak) for threads, peak in points if threads and peak),
+                                 MOPO16S_MEMORY_PER_THREAD)
+        if model is None:
+            model = (MOPO16S_MEMORY_BASE + self.rep_set.file_size * MOPO16S_MEMORY_PER_REP_SET_BYTE,
+                     MOPO16S_MEMORY_PER_THREAD)
+        return tuple(int(value * MOPO16S_MEMORY_SAFETY_MARGIN) for value in model)
+    
+    def estimate_runtime(self):
+        """
+        Predict the runtime of the job (of its longest shard) with the model fitted on the previous runs
+        :return: seconds, None if the model is not fitted: it cannot be fitted yet, or the 'fit_runtime_model' task
+                 did not run since the cache was emptied (fitting it here would delay the submission)
+        """
+        coefficients = get_runtime_model()
+        if not coefficients:
+            return None
+        parameters = self.mopo16s_parameters_normalized
+        runs = max(stop - start for start, stop in split_runs(parameters['runs'], self.shards))
+        return predict_runtime(coefficients, runtime_features(
+                self.rep_set.sequences_count, self.rep_set.file_size, runs, parameters['restarts'],
+                parameters['minPrimerLen'], parameters['maxPrimerLen'],
+                threads=min(runs, get_max_threads_per_instance())))
+    
+    @property
+    def estimated_duration(self):
+        if self.estimated_runtime is None:
+            return None
+        return timedelta(seconds=round(self.estimated_runtime))
+    
+    def get_priority(self, penalty=None):
+        """
+        Shortest expected job first, demoted by the fair share penalty of the user,
+        promoted by one level for every MOPO16S_PRIORITY_AGING_INTERVAL in queue
+        :param penalty: priority levels lost by the user, see fairshare.get_penalties. Default: computed now
+        """
+        if penalty is None:
+            penalty = get_penalties((self.created_by_id,))[self.created_by_id]
+        waited = (tznow() - (self.date_enqueued or self.date_created)).total_seconds()
+        return max(PRIORITY_HIGHEST, min(PRIORITY_LOWEST, runtime_priority(self.estimated_runtime) + penalty)
+                   - int(waited // MOPO16S_PRIORITY_AGING_INTERVAL))
+    
     def set_mopo16s_parameters(self, pairs):
         self.mopo16s_parameters = dict((name, MOPO16S_PARAMETERS[name]['type'](value)) for name, value in pairs)
     
@@ -251,29 +503,38 @@ class Job(models.Model):
         return sorted(self.mopo16s_parameters.items(), key=lambda tup: tup[0])
     
     @property
-    def status(self):
-        if self.is_completed:
-            return 'completed'
-        try:
-            if self.task is None:
-                raise TaskResult.DoesNotExist
-            status = self.task.status
-        except TaskResult.DoesNotExist:
-            for value in cache_celery.lrange('queue_mopo16s', 0, -1):
-                mapping = json_loads(value)
-                if 'headers' in mapping and mapping['headers']['id'] == self.task_id:
-                    return 'pending'
-            return 'failed'
-        
-        if status == 'STARTED':
-            if task_is_running(self.task_id, pattern='*mopo_run*'):
-                return 'running'
-            return 'pending retry'
-        if status == 'RETRY':
-            return 'pending retry'
-        if status == 'FAILURE':
-            return 'failed'
-        return status
+    def mopo16s_parameters_normalized(self):
+        # missing parameters get their default value, the ones that don't change the result are excluded
+        return dict((name, details['type'](self.mopo16s_parameters.get(name, details['default'])))
+                    for name, details in MOPO16S_PARAMETERS.items() if name not in ('threads', 'verbose'))
+    
+    @cached_property
+    def fingerprint(self):
+        """
+        mopo16s is deterministic, so jobs with the same fingerprint produce the same result
+        :return: digest of input contents, normalized parameters and mopo16s version
+        """
+        return sha256('\n'.join((
+            self.rep_set.content_hash,
+            InitialPrimerPairs.objects.get_content_hash(self.good_pairs_id),
+            json_dumps(self.mopo16s_parameters_normalized, sort_keys=True),
+            self.mopo16s_version,
+            # shards have different seeds, so the result of a sharded job differs from a single run
+            *(('shards={}'.format(self.shards),) if self.shards > 1 else ()),
+            )).encode()).hexdigest()
+    
+    @property
+    def is_pending(self):
+        return self.status in (self.STATUS_PENDING, self.STATUS_PENDING_RETRY)
+    
+    @property
+    def queue_position(self):
+        """
+        :return: tuple (position, queue length), None if the task is not waiting in queue
+        """
+        if not self.task_id:
+            return None
+        return get_queue_position(self.task_id, get_task_queue(self.task_id))
     
     @property
     def is_completed(self):
@@ -307,22 +568,143 @@ class Job(models.Model):
         def __init__(self):
             super().__init__(self.description)
     
-    def create_run(self):
-        return self.runs.create()
+    class CancelledException(Exception):
+        description = 'Job has been cancelled'
+        
+        def __init__(self):
+            super().__init__(self.description)
+    
+    class UserThreadsCapException(Exception):
+        description = 'User is running its maximum number of threads'
+        
+        def __init__(self):
+            super().__init__(self.description)
+    
+    class AllocationTimeoutException(Exception):
+        description = 'No free threads on this node for {} seconds'.format(MOPO16S_ALLOCATION_MAX_WAIT)
+        
+        def __init__(self):
+            super().__init__(self.description)
+    
+    class NodeBusyException(Exception):
+        description = 'No free threads on this node'
+        
+        def __init__(self, node):
+            super().__init__('{}, routed to node {}'.format(self.description, node))
+            self.node = node
+    
+    @classmethod
+    def update_status(cls, job_id, status):
+        """
+        Update the status of the job with a single query,
+        a completed or cancelled job never changes its status (e.g. because of a duplicated task)
+        """
+        now = tznow()
+        fields = dict(status=status, date_status_changed=now)
+        if status in (cls.STATUS_PENDING, cls.STATUS_PENDING_RETRY):
+            # only the first time, the task of a job is published again when it is retried, deferred or routed
+            fields['date_enqueued'] = Coalesce('date_enqueued', Value(now))
+        return cls.objects.filter(id=job_id).exclude(status__in=(cls.STATUS_COMPLETED, cls.STATUS_CANCELLED)) \
+            .update(**fields)
+    
+    @property
+    def is_cancellable(self):
+        return self.status in (self.STATUS_PENDING, self.STATUS_RUNNING, self.STATUS_PENDING_RETRY)
+    
+    def create_run(self, **log_data):
+        return self.runs.create(log_data=log_data)
+    
+    @property
+    def job_runs(self):
+        # runs of the whole job, excluding the ones of its shards and the ones deferred before starting mopo16s
+        return self.runs.exclude(log_data__has_key='shard').exclude(log_data__has_key='deferred')
+    
+    def reuse_result(self, run=None):
+        """
+        If a job with the same fingerprint was completed already, copy its result instead of running mopo16s.
+        :param run: [Optional] Run to be marked as completed, a new one is created if None. Default: None.
+        :return: True if a result was reused
+        """
+        source = Result.objects.filter(fingerprint=self.fingerprint).exclude(job_id=self.id).first()
+        if source is None:
+            return False
+        Result.objects.clone(source, job=self)
+        (run or self.create_run()).set_reused(source.job_id)
+        self.update_status(self.id, self.STATUS_COMPLETED)
+        return True
     
     def set_result(self, init_file_path, out_file_path):
         Result.objects.create(job=self,
+                              fingerprint=self.fingerprint,
                               init_primers=File(open(init_file_path + '.primers', 'rt')).read(),
                               init_scores=File(open(init_file_path + '.scores', 'rt')).read(),
                               out_primers=File(open(out_file_path + '.primers', 'rt')).read(),
                               out_scores=File(open(out_file_path + '.scores', 'rt')).read())
+        self.update_status(self.id, self.STATUS_COMPLETED)
     
     class Meta:
         managed = False
         db_table = 'mopo16s_job'
 
 
+class RunManager(models.Manager):
+    def get_resources_summary(self, **filters):
+        """
+        Resources measured for the executions of mopo16s, grouped by representative sequence set and parameters
+        :param filters: filters of the runs, e.g. job__rep_set_id
+        :return: queryset of dicts (rep_set_id, parameters, shards, numa_nodes, runs, threads, wall_time, cpu_time,
+                 max_rss, memory_peak, oom_kills), times are averages in seconds, memory is the maximum in bytes,
+                 numa_nodes is the number of NUMA nodes mopo16s was pinned to (None if not pinned)
+        """
+        
+        def resource(name):
+            return Cast(KeyTextTransform(name, KeyTransform('resources', 'log_data')), FloatField())
+        
+        return self.filter(log_data__has_key='resources', **filters) \
+            .annotate(numa_nodes=NullIf(Func(KeyTransform('numa_nodes', 'log_data'), function='jsonb_array_length',
+                                             output_field=IntegerField()), Value(0))) \
+            .values('numa_nodes', rep_set_id=F('job__rep_set_id'), parameters=F('job__mopo16s_parameters'),
+                    shards=F('job__shards')) \
+            .annotate(runs=Count('id'),
+                      threads=Avg(Cast(KeyTextTransform('threads', 'log_data'), FloatField())),
+                      wall_time=Avg(resource('wall_time')),
+                      cpu_time=Avg(resource('user_time') + resource('system_time')),
+                      max_rss=Max(resource('max_rss')),
+                      memory_peak=Max(resource('memory_peak')),
+                      oom_kills=Max(resource('oom_kills'))) \
+            .order_by('rep_set_id', '-runs')
+    
+    def fit_runtime_model(self):
+        """
+        Fit the runtime model on the last completed runs of mopo16s, and store it in cache
+        :return: list of coefficients, None if there is not enough history
+        """
+        rows = self.filter(log_data__completed=True, log_data__has_key='resources') \
+            .annotate(threads=Cast(KeyTextTransform('threads', 'log_data'), IntegerField()),
+                      wall_time=Cast(KeyTextTransform('wall_time', KeyTransform('resources', 'log_data')),
+                                     FloatField()),
+                      runs_range=KeyTransform('runs_range', 'log_data')) \
+            .order_by('-id') \
+            .values_list('job__rep_set__sequences_count', 'job__rep_set__file_size', 'job__mopo16s_parameters',
+                         'runs_range', 'threads', 'wall_time')[:RUNTIME_HISTORY_SIZE]
+        defaults = dict((name, details['default']) for name, details in MOPO16S_PARAMETERS.items())
+        
+        def sample(sequences_count, file_size, parameters, runs_range, threads, wall_time):
+            parameters = dict(defaults, **parameters)
+            # a shard executes only a range of the runs
+            runs = runs_range[1] - runs_range[0] if runs_range else parameters['runs']
+            return runtime_features(sequences_count, file_size, runs, parameters['restarts'],
+                                    parameters['minPrimerLen'], parameters['maxPrimerLen'], threads or 1), wall_time
+        
+        coefficients = fit_runtime_model(sample(*row) for row in rows if row[-1] is not None)
+        set_runtime_model(coefficients)
+        return coefficients
+
+
 class Run(models.Model):
+    LOG_STREAMS = ('stdout', 'stderr')
+    
+    objects = RunManager()
     id = models.AutoField(primary_key=True)
     job = models.ForeignKey(Job, on_delete=models.DO_NOTHING, related_name='runs', related_query_name='run')
     log_data = JSONField(blank=True, null=True, default=dict)
@@ -344,10 +726,59 @@ class Run(models.Model):
         self.date_finished = tznow()
         self.save()
     
-    def set_threads(self, threads):
+    def set_finished(self, stdout, **kwargs):
+        # completed without a result on its own (e.g. a shard, its output is merged later)
+        self.log_data.update(kwargs)
+        self.log_data['stdout'] = stdout
+        self.log_data['completed'] = True
+        self.date_finished = tznow()
+        self.save()
+    
+    def set_cancelled(self, **kwargs):
+        self.log_data.update(kwargs)
+        self.log_data['cancelled'] = True
+        self.date_finished = tznow()
+        self.save()
+    
+    def set_deferred(self, reason):
+        # the same run is deferred again and again while the job waits for threads (see run_mopo16s_job)
+        self.log_data['deferred'] = reason
+        self.log_data['deferrals'] = self.log_data.get('deferrals', 0) + 1
+        self.date_finished = tznow()
+        self.save()
+    
+    def set_resumed(self):
+        # a deferred run attempted again
+        self.log_data.pop('deferred', None)
+        self.date_finished = None
+        self.save()
+    
+    def set_salvaged(self, source_run_id):
+        # outputs produced by a previous run (e.g. a shard finished before its job failed), not executed again
+        self.log_data['salvaged_run'] = source_run_id
+        self.log_data['completed'] = True
+        self.date_finished = tznow()
+        self.save()
+    
+    def set_reused(self, source_job_id):
+        self.log_data['reused_result_of_job'] = source_job_id
+        self.log_data['completed'] = True
+        self.date_finished = tznow()
+        self.save()
+    
+    def set_threads(self, threads, **kwargs):
+        self.log_data.update(kwargs)
         self.log_data['threads'] = threads
         self.save()
     
+    def get_log_file_path(self, stream):
+        # full output of mopo16s, log_data contains only its beginning and its end
+        return MOPO16S_LOGS_ROOT + '/job_{}/run_{}.{}'.format(self.job_id, self.id, stream)
+    
+    @property
+    def log_streams(self):
+        return [stream for stream in self.LOG_STREAMS if stream + '_size' in self.log_data]
+    
     class Meta:
         managed = False
         db_table = 'mopo16s_run'
@@ -369,10 +800,22 @@ class ResultManager(models.Manager):
         instance.structure_data()
         instance.save()
         return instance
+    
+    def clone(self, result, job):
+        # copy of an already structured result, for another job with the same fingerprint
+        return super().create(job=job, **dict((name, getattr(result, name)) for name in Result.COPIED_FIELDS))
+
+
+# primer sets whose degenerate sequences are memoized in every process
+DEGENERATE_PRIMER_SETS_CACHE_SIZE = 1 << 14
 
 
 def degenerate_sequence(sequences):
-    return str(motifs.create([Seq(seq) for seq in sequences]).degenerate_consensus)
+    try:
+        return degenerate_consensus(sequences)
+    except ValueError:
+        # e.g. already degenerate or lowercase bases: left to Bio.motifs
+        return str(motifs.create([Seq(seq) for seq in sequences]).degenerate_consensus)
 
 
 def cluster_seq_by_length(sequences):
@@ -386,9 +829,22 @@ def cluster_seq_by_length(sequences):
     return cluster.values()
 
 
+@lru_cache(maxsize=DEGENERATE_PRIMER_SETS_CACHE_SIZE)
+def degenerate_primer_set(primer_set):
+    # degenerate sequence of every length cluster of a primer set (primers separated by tabs),
+    # the same primer sets recur in many rows of a result and in the results of similar jobs
+    return tuple(degenerate_sequence(cluster) for cluster in cluster_seq_by_length(primer_set.split('\t')))
+
+
 class Result(models.Model):
     COLUMN_MAMES = ['Forward primers', 'Reverse primers', 'Efficiency', 'Coverage', 'Matching-bias']
     PREFIXES = ('init', 'out')
+    # raw outputs of mopo16s, loaded only to be downloaded
+    RAW_FIELDS = ('init_primers', 'init_scores', 'out_primers', 'out_scores')
+    COPIED_FIELDS = ('fingerprint', *RAW_FIELDS, 'data', 'data_npz')
+    # rows of a page of get_rows, by default and at most
+    ROWS_PAGE_SIZE = 100
+    ROWS_MAX_PAGE_SIZE = 1000
     
     objects = ResultManager()
     job = models.OneToOneField(Job, on_delete=models.DO_NOTHING, primary_key=True,
@@ -397,11 +853,16 @@ class Result(models.Model):
     init_scores = models.TextField(null=False, blank=False)
     out_primers = models.TextField(null=False, blank=False)
     out_scores = models.TextField(null=False, blank=False)
+    # parsed matrices of the results structured before data_npz, empty for the others
     data = JSONField(default=dict, null=False, blank=False)
+    # parsed outputs, see ResultColumns
+    data_npz = models.BinaryField(null=True, default=None, editable=False)
+    # digest of inputs, parameters and version, see Job.fingerprint
+    fingerprint = models.CharField(max_length=64, null=True, default=None, db_index=True)
     date_completed = models.DateTimeField(auto_now_add=True)
     
     def structure_data(self):
-        self.data = {}
+        matrices = {}
         for prefix in self.PREFIXES:
             matrix = []
             # skip the first line, that contains the 3 score names
@@ -411,15 +872,44 @@ class Result(models.Model):
                 forward_set, reverse_set = primer_set_pair.split('\tx\t')
                 scores = (float(s) for s in scores_line.split('\t'))
                 matrix.append([
-                    *([degenerate_sequence(cluster)
-                       for cluster in cluster_seq_by_length(primer_set.split('\t'))]
-                      for primer_set in primer_set_pair.split('\tx\t')),
+                    *(list(degenerate_primer_set(primer_set)) for primer_set in primer_set_pair.split('\tx\t')),
                     # primer_set is forward_set on the 1st iteration, then reverse_set
                     *scores,
                     ])
-            self.data[prefix] = matrix
+            matrices[prefix] = matrix
+        self.data = {}
+        self.data_npz = ResultColumns.from_rows(matrices).to_bytes()
+        self.__dict__.pop('columns', None)
         # self.save()
     
+    @cached_property
+    def columns(self):
+        if self.data_npz is None:
+            # structured before data_npz
+            return ResultColumns.from_rows(self.data)
+        return ResultColumns.from_bytes(bytes(self.data_npz))
+    
+    def get_matrices(self):
+        # dict prefix -> list of rows [forward primers, reverse primers, efficiency, coverage, matching-bias]
+        return dict((prefix, self.columns.rows(prefix)) for prefix in self.PREFIXES)
+    
+    def get_rows(self, prefix, order_by=None, fields=None, offset=0, limit=None, after=None, **thresholds):
+        """
+        Page of the rows of the initial or optimized primer pairs, see ResultColumns.select for the other parameters
+        :param prefix: 'init' or 'out'
+        :param fields: [Optional] comma-separated names of the fields (see ROW_FIELDS), all if None. Default: None.
+        :param limit: [Optional] rows per page, at most ROWS_MAX_PAGE_SIZE. ROWS_PAGE_SIZE if None. Default: None.
+        :param thresholds: e.g. min_efficiency=0.9, max_matching_bias=0.1
+        :return: dict total, rows, next (see ResultColumns.select), offset and limit
+        Raises ValueError if a parameter is invalid
+        """
+        if prefix not in self.PREFIXES:
+            raise ValueError('prefix must be one of: ' + ', '.join(self.PREFIXES))
+        limit = self.ROWS_PAGE_SIZE if limit is None else min(limit, self.ROWS_MAX_PAGE_SIZE)
+        fields = [field.strip() for field in fields.split(',')] if fields else ROW_FIELDS
+        return dict(self.columns.select(prefix, order_by or None, thresholds, fields, offset, limit, after),
+                    offset=offset, limit=limit)
+    
     def get_html_tables(self):
         # resulting tables will have id: T_table_init and T_table_out
         
@@ -461,7 +951,11 @@ class Result(models.Model):
         return tables
     
     def get_dataframes(self):
-        return (pd.DataFrame(self.data[prefix], columns=self.COLUMN_MAMES) for prefix in self.PREFIXES)
+        columns = self.columns
+        for prefix in self.PREFIXES:
+            scores = columns.scores(prefix)
+            yield pd.DataFrame(dict(zip(self.COLUMN_MAMES, (*(columns.primers(prefix, side) for side in SIDES),
+                                                            *scores.T))))
     
     class Meta:
         managed = False
@@ -0,0 +1,148 @@
+from mopo16s_web_proj.settings import MOPO16S_NODE_NAME, MOPO16S_MAX_THREADS, MOPO16S_MAX_THREADS_PER_INSTANCE, \
+    MOPO16S_MEMORY_BUDGET, MOPO16S_SCRATCH_ROOT, MOPO16S_NODE_HEARTBEAT_INTERVAL, MOPO16S_NODE_HEARTBEAT_TTL, \
+    MOPO16S_NODE_MIN_SCRATCH_FREE
+from mopo16s_web_proj.caches import cache
+from mopo16s_web.allocator import get_threads_by_node
+from os import path, cpu_count
+from shutil import disk_usage
+from threading import Thread, Event
+from time import time
+from redis.exceptions import RedisError
+
+
+# worker nodes alive, sorted set node name -> timestamp of the last heartbeat,
+# the capacity of every node is a hash that expires if the node stops beating
+NODES_KEY = 'nodes'
+# queue shared by all the worker nodes, every node consumes also its own queue (see node_queue)
+MOPO16S_QUEUE = 'queue_mopo16s'
+# integer fields of the capacity of a node
+CAPACITY_FIELDS = ('cores', 'max_threads', 'max_threads_per_instance', 'memory_budget', 'scratch_free')
+# jobs waiting in the queue of a node, hash task_id -> node name
+ROUTED_TASKS_KEY = 'queue_mopo16s:routed'
+
+
+def node_key(node):
+    return 'nodes:' + node
+
+
+def node_queue(node):
+    return '{}.{}'.format(MOPO16S_QUEUE, node)
+
+
+def get_task_queue(task_id):
+    # queue where the task of a job is waiting
+    node = cache.hget(ROUTED_TASKS_KEY, task_id)
+    return node_queue(node) if node else MOPO16S_QUEUE
+
+
+def disk_free(dir_path):
+    # bytes free on the disk of the directory, or of its nearest existing parent
+    while not path.exists(dir_path) and path.dirname(dir_path) != dir_path:
+        dir_path = path.dirname(dir_path)
+    return disk_usage(dir_path).free
+
+
+def get_node_capacity():
+    """
+    :return: dict with the capacity of this node: cores, threads and memory that mopo16s can use, free scratch disk
+    """
+    return dict(cores=cpu_count(), max_threads=MOPO16S_MAX_THREADS,
+                max_threads_per_instance=MOPO16S_MAX_THREADS_PER_INSTANCE, memory_budget=MOPO16S_MEMORY_BUDGET,
+                scratch_free=disk_free(MOPO16S_SCRATCH_ROOT))
+
+
+def register_node(node=MOPO16S_NODE_NAME, capacity=None, ttl=MOPO16S_NODE_HEARTBEAT_TTL):
+    """
+    Publish the capacity of a node (this one by default) and its heartbeat, the node expires after ttl seconds
+    """
+    now = time()
+    pipe = cache.pipeline()
+    pipe.hset(node_key(node), mapping=dict(capacity or get_node_capacity(), heartbeat=now))
+    pipe.expire(node_key(node), ttl)
+    pipe.zadd(NODES_KEY, {node: now})
+    pipe.execute()
+
+
+def unregister_node(node=MOPO16S_NODE_NAME):
+    pipe = cache.pipeline()
+    pipe.delete(node_key(node))
+    pipe.zrem(NODES_KEY, node)
+    pipe.execute()
+
+
+def get_live_nodes(ttl=MOPO16S_NODE_HEARTBEAT_TTL):
+    """
+    :return: dict node name -> capacity (see get_node_capacity) of the nodes whose heartbeat is not expired
+    """
+    cache.zremrangebyscore(NODES_KEY, '-inf', time() - ttl)
+    nodes = cache.zrange(NODES_KEY, 0, -1)
+    pipe = cache.pipeline(transaction=False)
+    for node in nodes:
+        pipe.hgetall(node_key(node))
+    return dict((node, dict((field, int(float(capacity[field]))) for field in CAPACITY_FIELDS if field in capacity))
+                for node, capacity in zip(nodes, pipe.execute()) if capacity)
+
+
+def get_nodes_load():
+    """
+    :return: dict node name -> capacity of the live node, with the threads used and free and the load (used / max)
+    """
+    threads_by_node = get_threads_by_node()
+    nodes = get_live_nodes()
+    for node, capacity in nodes.items():
+        used = threads_by_node.get(node, 0)
+        max_threads = capacity.get('max_threads') or 1
+        capacity.update(threads_used=used, threads_free=max(0, max_threads - used), load=used / max_threads)
+    return nodes
+
+
+def pick_node(exclude=(), min_scratch_free=MOPO16S_NODE_MIN_SCRATCH_FREE):
+    """
+    Choose the least-loaded live node with free threads and enough scratch disk,
+    the one with the most free threads among the equally loaded ones
+    :param exclude: names of the nodes not to choose (e.g. the current one)
+    :return: node name, None if no node has free threads
+    """
+    candidates = [(capacity['load'], -capacity['threads_free'], node) for node, capacity in get_nodes_load().items()
+                  if node not in exclude and capacity['threads_free'] > 0
+                  and capacity.get('scratch_free', 0) >= min_scratch_free]
+    if not candidates:
+        return None
+    return min(candidates)[2]
+
+
+def get_max_threads_per_instance():
+    # the largest instance of mopo16s any live node can run, this node settings if no node is registered
+    return max((capacity.get('max_threads_per_instance', 0) for capacity in get_live_nodes().values()),
+               default=0) or MOPO16S_MAX_THREADS_PER_INSTANCE
+
+
+class NodeHeartbeat:
+    """
+    Publish the capacity of this node from a background thread, every MOPO16S_NODE_HEARTBEAT_INTERVAL seconds,
+    the free scratch disk is measured again at every beat.
+    The node is unregistered on stop, or it expires if the worker dies.
+    """
+    
+    def __init__(self, node=MOPO16S_NODE_NAME, interval=MOPO16S_NODE_HEARTBEAT_INTERVAL):
+        self.node = node
+        self.interval = interval
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                register_node(self.node)
+            except RedisError:
+                # the node is registered again at the next beat, if redis is back in time
+                pass
+    
+    def start(self):
+        register_node(self.node)
+        self._thread.start()
+    
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        unregister_node(self.node)
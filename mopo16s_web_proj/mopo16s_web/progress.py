@@ -0,0 +1,117 @@
+from mopo16s_web_proj.caches import cache
+from mopo16s_web_proj.settings import MOPO16S_PROGRESS_PATTERNS, MOPO16S_PROGRESS_INTERVAL
+from json import dumps, loads
+from time import time
+import re
+
+
+# latest snapshot of the progress of a job (json string), events are published on the channel with the same name
+PROGRESS_TTL = 24 * 60 * 60
+
+# store the snapshot of a shard (ARGV[2], json) into the snapshot of the job, then recompute the totals
+# the snapshot is rewritten at every update, so a single GET returns the whole progress of the job
+_update_progress_script = cache.register_script("""
+local snapshot = redis.call('GET', KEYS[1])
+if snapshot then
+    snapshot = cjson.decode(snapshot)
+else
+    snapshot = {shards = {}}
+end
+snapshot['shards'][ARGV[1]] = cjson.decode(ARGV[2])
+snapshot['runs_done'] = 0
+snapshot['restarts_done'] = 0
+snapshot['best'] = {}
+for _, shard in pairs(snapshot['shards']) do
+    snapshot['runs_done'] = snapshot['runs_done'] + shard['runs_done']
+    snapshot['restarts_done'] = snapshot['restarts_done'] + shard['restarts_done']
+    for name, score in pairs(shard['best']) do
+        local best = snapshot['best'][name]
+        if best == nil or (name == 'matching_bias' and score < best) or (name ~= 'matching_bias' and score > best) then
+            snapshot['best'][name] = score
+        end
+    end
+end
+snapshot['runs'] = tonumber(ARGV[3])
+snapshot['updated_at'] = tonumber(ARGV[4])
+snapshot = cjson.encode(snapshot)
+redis.call('SET', KEYS[1], snapshot, 'EX', ARGV[5])
+redis.call('PUBLISH', KEYS[1], snapshot)
+return 1
+""")
+
+
+def progress_key(job_id):
+    return 'job.progress:{}'.format(job_id)
+
+
+def get_progress(job_id):
+    """
+    :return: dict with runs, runs_done, restarts_done, best scores and the progress of every shard, None if unknown
+    """
+    snapshot = cache.get(progress_key(job_id))
+    return loads(snapshot) if snapshot is not None else None
+
+
+def get_progresses(jobs_ids):
+    """
+    Progress of many jobs with a single round trip, see get_progress
+    :return: dict job id -> progress snapshot, unknown ones are missing
+    """
+    jobs_ids = list(jobs_ids)
+    if not jobs_ids:
+        return {}
+    return dict((job_id, loads(snapshot)) for job_id, snapshot
+                in zip(jobs_ids, cache.mget([progress_key(job_id) for job_id in jobs_ids])) if snapshot is not None)
+
+
+def delete_progress(job_id):
+    cache.delete(progress_key(job_id))
+
+
+class ProgressReporter:
+    """
+    Parse the stdout of mopo16s while it runs and publish its progress, at most once every MOPO16S_PROGRESS_INTERVAL.
+    
+    @param job:     Job executed.
+    @param shard:   [Optional] Shard executed, None for the whole job. Default: None.
+    """
+    
+    def __init__(self, job, shard=None):
+        self.job_id = job.id
+        self.runs = job.mopo16s_parameters['runs']
+        self.shard = str(shard or 0)
+        self.patterns = dict((name, re.compile(pattern)) for name, pattern in MOPO16S_PROGRESS_PATTERNS.items())
+        self.runs_done = 0
+        self.restarts_done = 0
+        self.best = {}
+        self.buffer = b''
+        self.published_at = 0
+    
+    def feed(self, data):
+        # data is a chunk of stdout, the last line could be incomplete
+        *lines, self.buffer = (self.buffer + data).split(b'\n')
+        for line in lines:
+            self.parse_line(line.decode('utf-8', errors='replace'))
+        if time() - self.published_at >= MOPO16S_PROGRESS_INTERVAL:
+            self.publish()
+    
+    def parse_line(self, line):
+        if self.patterns['run'].search(line):
+            self.runs_done += 1
+        if self.patterns['restart'].search(line):
+            self.restarts_done += 1
+        match = self.patterns['scores'].search(line)
+        if match:
+            for name, score in match.groupdict().items():
+                score = float(score)
+                best = self.best.get(name)
+                if best is None or (score < best if name == 'matching_bias' else score > best):
+                    self.best[name] = score
+    
+    def publish(self):
+        self.published_at = time()
+        _update_progress_script(keys=(progress_key(self.job_id),),
+                                args=(self.shard,
+                                      dumps(dict(runs_done=self.runs_done, restarts_done=self.restarts_done,
+                                                 best=self.best)),
+                                      self.runs, self.published_at, PROGRESS_TTL))
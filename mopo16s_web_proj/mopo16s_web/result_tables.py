@@ -0,0 +1,43 @@
+from mopo16s_web_proj.caches import cache
+from mopo16s_web_proj.settings import RESULT_TABLES_VERSION, RESULT_TABLES_TTL
+from json import dumps
+
+
+# hash of the tables of a result: init and out (styled HTML), matrices (json for the charts)
+RESULT_TABLES_FIELDS = ('init', 'out', 'matrices')
+
+
+def result_tables_key(job_id, version=RESULT_TABLES_VERSION):
+    return 'result_tables:{}:v{}'.format(job_id, version)
+
+
+def result_tables_etag(job_id, date_completed, version=RESULT_TABLES_VERSION):
+    # a result never changes once created, its tables change only with the version
+    return '{}-{}-v{}'.format(job_id, int(date_completed.timestamp()), version)
+
+
+def render_result_tables(result):
+    """
+    Render the tables of a result and cache them, replacing the ones already cached
+    :param result: Result, its data_npz is loaded if deferred
+    :return: dict, see RESULT_TABLES_FIELDS
+    """
+    html_init, html_out = result.get_html_tables()
+    tables = dict(init=html_init, out=html_out, matrices=dumps(result.get_matrices()))
+    pipe = cache.pipeline()
+    pipe.hset(result_tables_key(result.job_id), mapping=tables)
+    pipe.expire(result_tables_key(result.job_id), RESULT_TABLES_TTL)
+    pipe.execute()
+    return tables
+
+
+def get_result_tables(result):
+    """
+    Tables of a result, rendered (and cached) now only if they were not cached, e.g. rendered with another version
+    :param result: Result, data_npz is needed only if the tables are not cached
+    :return: dict, see RESULT_TABLES_FIELDS
+    """
+    tables = cache.hgetall(result_tables_key(result.job_id))
+    if all(field in tables for field in RESULT_TABLES_FIELDS):
+        return tables
+    return render_result_tables(result)
@@ -0,0 +1,66 @@
+from mopo16s_web_proj.caches import cache
+from json import dumps, loads
+from math import log, log2, exp
+import numpy as np
+
+
+# coefficients of the log-linear runtime model, refitted periodically by the 'fit_runtime_model' task
+RUNTIME_MODEL_KEY = 'mopo16s.runtime_model'
+RUNTIME_MODEL_TTL = 24 * 60 * 60
+# the model is fitted on the last executions only, and only if there are enough of them
+RUNTIME_HISTORY_SIZE = 1000
+RUNTIME_MIN_SAMPLES = 20
+
+# Celery priorities of the Redis broker go from 0 (highest) to 9 (lowest)
+PRIORITY_HIGHEST = 0
+PRIORITY_LOWEST = 9
+PRIORITY_UNKNOWN = 5
+
+
+def runtime_features(sequences_count, file_size, runs, restarts, min_primer_len, max_primer_len, threads):
+    # runtime is assumed to be a product of powers of the features: linear in their logarithms
+    return [1.0, log(max(sequences_count, 1)), log(max(file_size, 1)), log(max(runs, 1)), log(restarts + 1),
+            log(max((min_primer_len + max_primer_len) / 2, 1)), log(max(threads, 1))]
+
+
+def fit_runtime_model(samples):
+    """
+    Least squares fit of log(runtime) on the logarithms of the features
+    :param samples: iterable of tuples (features, runtime in seconds), see runtime_features
+    :return: list of coefficients, None if there are not enough samples
+    """
+    samples = [(features, runtime) for features, runtime in samples if runtime > 0]
+    if len(samples) < RUNTIME_MIN_SAMPLES:
+        return None
+    x = np.array([features for features, _ in samples])
+    y = np.log([runtime for _, runtime in samples])
+    coefficients, *_ = np.linalg.lstsq(x, y, rcond=None)
+    return coefficients.tolist()
+
+
+def predict_runtime(coefficients, features):
+    return exp(float(np.dot(coefficients, features)))
+
+
+def get_runtime_model():
+    """
+    :return: list of coefficients, [] if there is not enough history to fit the model, None if not fitted yet
+    """
+    coefficients = cache.get(RUNTIME_MODEL_KEY)
+    return loads(coefficients) if coefficients is not None else None
+
+
+def set_runtime_model(coefficients):
+    cache.set(RUNTIME_MODEL_KEY, dumps(coefficients or []), RUNTIME_MODEL_TTL)
+
+
+def runtime_priority(seconds):
+    """
+    Shortest expected job first: one priority level for every doubling of the runtime, starting from 1 minute
+    :param seconds: expected runtime, None if unknown
+    """
+    if seconds is None:
+        return PRIORITY_UNKNOWN
+    if seconds < 60:
+        return PRIORITY_HIGHEST
+    return min(PRIORITY_LOWEST, PRIORITY_HIGHEST + 1 + int(log2(seconds / 60)))
@@ -0,0 +1,113 @@
+from mopo16s_web_proj.settings import MOPO16S_STAGING_ROOT, MOPO16S_STAGING_BUDGET, MOPO16S_STAGING_VERIFY_HITS
+from mopo16s_web.utils import file_digest
+from contextlib import contextmanager
+from fcntl import flock, LOCK_SH, LOCK_EX, LOCK_NB
+from os import path, makedirs, replace, remove, scandir, fstat, utime, getpid
+from uuid import uuid4
+
+
+class StagingVerificationError(Exception):
+    description = 'Staged file does not match its content hash'
+    
+    def __init__(self, key):
+        super().__init__('{}: {}'.format(self.description, key))
+
+
+class StagingCache:
+    """
+    Worker-local cache of the input files of mopo16s, keyed by the hash of their content.
+    
+    A file is written only on a miss: into a temporary file first, verified against its hash, then moved atomically
+    into place, so concurrent workers never read a partial file. A hit only refreshes its modification time, that is
+    used for LRU eviction when the cache exceeds its disk budget.
+    Files in use are held with a shared lock, eviction skips them.
+    """
+    
+    def __init__(self, root=MOPO16S_STAGING_ROOT, budget=MOPO16S_STAGING_BUDGET,
+                 verify_hits=MOPO16S_STAGING_VERIFY_HITS):
+        self.root = root
+        self.budget = budget
+        self.verify_hits = verify_hits
+    
+    def get_file_path(self, algorithm, digest):
+        return path.join(self.root, digest[:2], '{}-{}'.format(algorithm, digest))
+    
+    @contextmanager
+    def stage(self, algorithm, digest, write):
+        """
+        Get the staged file with the given content hash, populating it if missing.
+        The file cannot be evicted until the context exits.
+        :param algorithm: hashlib algorithm of the digest, e.g. 'sha256'
+        :param digest: hex digest of the content
+        :param write: function writing the content into the binary file passed as argument, called only on a miss
+        :return: file path
+        Raises StagingVerificationError if the written content does not match the digest.
+        """
+        file_path = self.get_file_path(algorithm, digest)
+        while True:
+            if not path.exists(file_path):
+                self._populate(file_path, algorithm, digest, write)
+            try:
+                file = open(file_path, 'rb')
+            except FileNotFoundError:
+                # evicted in the meantime
+                continue
+            flock(file, LOCK_SH)
+            if fstat(file.fileno()).st_nlink > 0:
+                break
+            # evicted before the lock was acquired
+            file.close()
+        try:
+            if self.verify_hits and file_digest(file_path, algorithm) != digest:
+                remove(file_path)
+                raise StagingVerificationError(path.basename(file_path))
+            utime(file_path)
+            yield file_path
+        finally:
+            file.close()
+    
+    def _populate(self, file_path, algorithm, digest, write):
+        makedirs(path.dirname(file_path), exist_ok=True)
+        tmp_file_path = '{}.{}.{}.tmp'.format(file_path, getpid(), uuid4().hex)
+        try:
+            with open(tmp_file_path, 'wb') as tmp_file:
+                write(tmp_file)
+            if file_digest(tmp_file_path, algorithm) != digest:
+                raise StagingVerificationError(path.basename(file_path))
+            replace(tmp_file_path, file_path)
+        finally:
+            if path.exists(tmp_file_path):
+                remove(tmp_file_path)
+        self.evict(keep=file_path)
+    
+    def evict(self, keep=None):
+        """
+        Remove the least recently used files, until the cache fits its disk budget
+        :param keep: file path never removed (e.g. the one just staged)
+        :return: number of bytes freed
+        """
+        entries = []
+        for directory in scandir(self.root) if path.isdir(self.root) else ():
+            if directory.is_dir():
+                entries.extend(entry for entry in scandir(directory.path)
+                               if entry.is_file() and not entry.name.endswith('.tmp'))
+        files = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries))
+        used = sum(size for _, size, _ in files)
+        freed = 0
+        for _, size, file_path in files:
+            if used - freed <= self.budget:
+                break
+            if file_path == keep:
+                continue
+            try:
+                with open(file_path, 'rb') as file:
+                    # skip the files used by a running mopo16s
+                    flock(file, LOCK_EX | LOCK_NB)
+                    remove(file_path)
+            except (BlockingIOError, FileNotFoundError):
+                continue
+            freed += size
+        return freed
+
+
+staging_cache = StagingCache()
@@ -1,36 +1,105 @@
 from mopo16s_web_proj.settings import MEDIA_ROOT, DEFAULT_FROM_EMAIL, EMAIL_SUBJECT_PREFIX, \
-    MOPO16S_PATH, MOPO16S_MAX_THREADS, MOPO16S_MAX_THREADS_PER_INSTANCE, MOPO16S_PARAMETERS
+    MOPO16S_PATH, MOPO16S_MAX_THREADS, MOPO16S_MAX_THREADS_PER_INSTANCE, MOPO16S_PARAMETERS, \
+    MOPO16S_ALLOCATION_RETRY_DELAY, MOPO16S_ALLOCATION_MAX_WAIT, MOPO16S_LOG_EXCERPT_SIZE, MOPO16S_CGROUP_ROOT, \
+    MOPO16S_MEMORY_BUDGET, MOPO16S_USER_MAX_THREADS, MOPO16S_CANCEL_KILL_TIMEOUT, MOPO16S_SCRATCH_ROOT, \
+    MOPO16S_RETRY_DELAY, MOPO16S_CPU_AFFINITY, MOPO16S_NODE_NAME
 from mopo16s_web_proj.caches import cache
-from mopo16s_web.models import Job, JOB_MAX_RUN_RETRIES
-from os import path, remove
+from mopo16s_web.allocator import reserve_threads, renew_threads, release_threads, get_leases, USER_CAP_REACHED, \
+    reserve_cores, release_cores
+from mopo16s_web.fairshare import charge_usage, get_penalties
+from mopo16s_web.models import Job, Run, InitialPrimerPairs, Result, JOB_MAX_RUN_RETRIES
+from mopo16s_web.utils import merge_mopo16s_outputs, run_streaming, ProcessCancelledError, write_checkpoint, \
+    read_checkpoint, read_cpu_topology
+from mopo16s_web.progress import ProgressReporter
+from mopo16s_web.staging import staging_cache
+from mopo16s_web.failures import classify_failure, retry_policy, FAILURE_DETERMINISTIC
+from mopo16s_web.nodes import pick_node, node_queue, get_live_nodes, ROUTED_TASKS_KEY
+from mopo16s_web.result_tables import render_result_tables
+from os import path, remove, makedirs
+from shutil import copyfileobj, rmtree
+from contextlib import contextmanager
+from time import sleep, time
+from functools import partial
 import subprocess
 from django.core.mail import send_mail
-from mopo16s_web_proj.celery import app as celery_app, get_running_tasks_ids, task_is_running
+from mopo16s_web_proj.celery import app as celery_app, TaskHeartbeat, task_is_running, tasks_are_running, \
+    index_pending_task, unindex_pending_tasks, get_pending_tasks_ids, move_pending_task
 from celery.utils.log import get_task_logger
-from django.db.models import Q
 from celery.result import AsyncResult
+from celery.utils import uuid
+from celery import chord
+from celery.signals import before_task_publish, task_prerun, task_success, task_failure, task_retry, \
+    task_revoked
 
 
 logger = get_task_logger(__name__)
 
 
-def deallocate_threads(job_id):
-    cache.delete('threads_allocated@job_{}'.format(job_id))
+def lease_id(job_id, shard=None):
+    if shard is None:
+        return 'job_{}'.format(job_id)
+    return 'job_{}_shard_{}'.format(job_id, shard)
 
 
-def allocate_threads(job, current_run):
-    runs = job.mopo16s_parameters['runs']
+def lease_job_id(lease):
+    return int(lease.split('_')[1])
+
+
+def deallocate_threads(job_id, shard=None):
+    release_threads(lease_id(job_id, shard))
+
+
+# flag read by the workers running a cancelled job, to kill mopo16s
+CANCEL_TTL = 7 * 24 * 60 * 60
+
+
+def cancel_key(job_id):
+    return 'job.cancel:{}'.format(job_id)
+
+
+def is_cancel_requested(job_id):
+    return bool(cache.exists(cancel_key(job_id)))
+
+
+def cancel_job(job):
+    """
+    Cancel a job: its waiting task is revoked, its running mopo16s is killed by the worker within seconds,
+    and its threads are released immediately, to be taken by the next job in queue.
+    :return: False if the job cannot be cancelled (e.g. already completed)
+    """
+    if not job.is_cancellable:
+        return False
+    was_running = job.status == Job.STATUS_RUNNING
+    cache.set(cancel_key(job.id), 1, CANCEL_TTL)
+    Job.update_status(job.id, Job.STATUS_CANCELLED)
+    if job.task_id:
+        AsyncResult(job.task_id).revoke()
+        unindex_pending_tasks(job.task_id)
+    for shard in (None, *range(job.shards if job.shards > 1 else 0)):
+        deallocate_threads(job.id, shard)
+    delete_job_scratch(job.id)
+    if not was_running:
+        # a running job records its cancelled run from the worker
+        job.create_run().set_cancelled()
+    return True
+
+
+def allocate_threads(job, current_run, shard=None, reroute=False):
+    if shard is None:
+        runs = job.mopo16s_parameters['runs']
+        previous_runs = job.job_runs
+    else:
+        start, stop = job.get_shard_runs_range(shard)
+        runs = stop - start
+        previous_runs = job.runs.filter(log_data__shard=shard)
     restarts = job.mopo16s_parameters['restarts']
     threads = MOPO16S_MAX_THREADS
-    deallocate_threads(job.id)
-    for key in cache.keys('threads_allocated@job_*'):
-        threads -= int(cache.get(key))
-    
-    # if previous job was killed with SIGKILL (-9), assign one less thread
-    last_run = job.runs.exclude(id=current_run.id).last()
-    if (last_run is not None) and (last_run.log_data.get('exit_code') == -9) \
-            and ('threads' in last_run.log_data) and (threads >= last_run.log_data['threads']):
-        threads = last_run.log_data['threads'] - 1
+    
+    # if the previous run failed for lack of resources (e.g. killed by the OOM killer),
+    # assign the downsized threads decided by the retry policy
+    last_run = previous_runs.exclude(id=current_run.id).exclude(log_data__has_key='deferred').last()
+    if (last_run is not None) and (last_run.log_data.get('failure') or {}).get('max_threads'):
+        threads = min(threads, last_run.log_data['failure']['max_threads'])
     # allocate maximum a thread per run
     if threads > runs:
         threads = runs
@@ -42,38 +111,187 @@ def allocate_threads(job, current_run):
     # assign one thread at least, obviously
     if threads < 1:
         threads = 1
-    # assume a maximum runtime of 36 hours, the allocated threads will be reset
-    # this is to prevent long runnning (or failed) tasks to mess up thread count
-    # only in the case 'clean_allocated_threads' didn't fix it
-    cache.set('threads_allocated@job_{}'.format(job.id), threads, 36 * 60 * 60)
-    return threads
+    # reserve the threads and their estimated memory on this node atomically, never exceeding MOPO16S_MAX_THREADS,
+    # MOPO16S_MEMORY_BUDGET and MOPO16S_USER_MAX_THREADS for the user (on all the nodes): less threads are granted
+    # if not enough are free or their memory does not fit, wait if none is free (up to MOPO16S_ALLOCATION_MAX_WAIT)
+    memory_base, memory_per_thread = job.get_memory_model()
+    reserve = partial(reserve_threads, lease_id(job.id, shard), threads, MOPO16S_MAX_THREADS,
+                      memory_budget=MOPO16S_MEMORY_BUDGET, memory_base=memory_base, memory_per_thread=memory_per_thread,
+                      user_id=job.created_by_id, user_max_threads=MOPO16S_USER_MAX_THREADS)
+    started, attempts = time(), 1
+    granted = reserve()
+    while granted < 1:
+        # a whole job gives its place to the jobs of the other users, a shard of a started job waits
+        if granted == USER_CAP_REACHED and shard is None:
+            raise Job.UserThreadsCapException
+        # a whole job moves to the least-loaded node with free threads, if any
+        if granted == 0 and reroute and shard is None:
+            node = pick_node(exclude=(MOPO16S_NODE_NAME,))
+            if node is not None:
+                raise Job.NodeBusyException(node)
+        if time() - started >= MOPO16S_ALLOCATION_MAX_WAIT:
+            raise Job.AllocationTimeoutException
+        sleep(MOPO16S_ALLOCATION_RETRY_DELAY)
+        if is_cancel_requested(job.id):
+            raise Job.CancelledException
+        granted = reserve()
+        attempts += 1
+    # contention for the threads, saved with them by run.set_threads
+    current_run.log_data['allocation'] = dict(attempts=attempts, wait=time() - started)
+    return granted, memory_base + memory_per_thread * granted
+
+
+def run_mopo16s(job, run, rep_set_file_path, primers_file_path, init_file_path, out_file_path, shard=None,
+                reroute=False):
+    """
+    Allocate the threads and execute mopo16s, for the whole job or for one of its shards.
+    Threads are released at the end, even if the execution fails.
+    stdout and stderr are streamed to the log files of the run, only their excerpts are returned.
+    The progress parsed from stdout is published while mopo16s runs.
+    The resources used by mopo16s (CPU time, max RSS, I/O) are stored in the log data of the run.
+    mopo16s is pinned to as many free CPUs of this host as its threads, on a single NUMA node if possible.
+    Raises subprocess.CalledProcessError if mopo16s fails,
+    Job.NodeBusyException if reroute is set and another node has free threads while this one has none,
+    Job.AllocationTimeoutException if no thread was free for MOPO16S_ALLOCATION_MAX_WAIT seconds.
+    :return: tuple (completed process, command arguments)
+    """
+    threads, memory = allocate_threads(job, run, shard, reroute)
+    cpus, numa_nodes = [], []
+    if MOPO16S_CPU_AFFINITY:
+        topology = read_cpu_topology()
+        cpus = reserve_cores(lease_id(job.id, shard), threads, topology)
+        numa_nodes = [node for node, node_cpus in enumerate(topology) if set(node_cpus).intersection(cpus)]
+    run.set_threads(threads, memory_reserved=memory, cpus=cpus, numa_nodes=numa_nodes)
+    cmd_args = [MOPO16S_PATH,
+                rep_set_file_path,
+                primers_file_path,
+                '--threads=' + str(threads),
+                *(job.mopo16s_command_options if shard is None else job.get_shard_command_options(shard)),
+                '--outInitFileName=' + init_file_path,
+                '--outFileName=' + out_file_path]
+    stdout_file_path, stderr_file_path = (run.get_log_file_path(stream) for stream in run.LOG_STREAMS)
+    makedirs(path.dirname(stdout_file_path), exist_ok=True)
+    cgroup_path = MOPO16S_CGROUP_ROOT + '/run_{}'.format(run.id) if MOPO16S_CGROUP_ROOT else None
+    progress = ProgressReporter(job, shard)
+    progress.publish()
+    
+    def record_resources(resources):
+        run.log_data.update(resources=resources)
+        # CPU-hours for the fair share of the user
+        charge_usage(job.created_by_id, resources['wall_time'] * threads / 3600)
+    
+    try:
+        return run_streaming(cmd_args, stdout_file_path, stderr_file_path, MOPO16S_LOG_EXCERPT_SIZE,
+                             on_stdout=progress.feed, on_exit=record_resources, cgroup_path=cgroup_path,
+                             is_cancelled=lambda: is_cancel_requested(job.id),
+                             kill_timeout=MOPO16S_CANCEL_KILL_TIMEOUT, cpus=set(cpus) or None), cmd_args
+    except ProcessCancelledError:
+        raise Job.CancelledException
+    finally:
+        progress.publish()
+        if cpus:
+            release_cores(lease_id(job.id, shard))
+        deallocate_threads(job.id, shard)
+        run.log_data.update(stdout_size=path.getsize(stdout_file_path) if path.exists(stdout_file_path) else 0,
+                            stderr_size=path.getsize(stderr_file_path) if path.exists(stderr_file_path) else 0)
+
+
+@contextmanager
+def stage_inputs(job):
+    """
+    Stage the input files of mopo16s in the worker-local cache, keyed by their content hash.
+    Only the hashes are read from the database: retries and jobs with the same inputs find the files already staged,
+    the content is transferred (from the database and MEDIA_ROOT storage) only on a miss.
+    :return: tuple (representative sequence set file path, initial primer pairs file path)
+    """
+    
+    def write_rep_set(file):
+        with job.rep_set.file.open('rb') as source:
+            copyfileobj(source, file)
+    
+    def write_good_pairs(file):
+        file.write(InitialPrimerPairs.objects.values_list('content', flat=True).get(id=job.good_pairs_id).encode())
+    
+    with staging_cache.stage('sha256', job.rep_set.content_hash, write_rep_set) as rep_set_file_path, \
+            staging_cache.stage('md5', InitialPrimerPairs.objects.get_content_hash(job.good_pairs_id),
+                                write_good_pairs) as primers_file_path:
+        yield rep_set_file_path, primers_file_path
+
+
+def submit_jobs(jobs, force_run=False):
+    """
+    Queue new jobs (e.g. the jobs of a batch), shortest expected job first.
+    Their task ids are saved with a single query.
+    The result of an identical job is looked up by the task (see run_mopo16s_job), not while submitting:
+    the fingerprint hashes the input files.
+    :param force_run: run again even if an identical job exists, otherwise its result is reused
+    """
+    jobs = list(jobs)
+    if force_run:
+        # saved before publishing, the tasks read it from the job
+        Job.objects.filter(id__in=[job.id for job in jobs]).update(force_run=True)
+    for job in jobs:
+        job.task_id = run_mopo16s_job.apply_async((job.id,), priority=job.get_priority()).id
+    Job.objects.bulk_update(jobs, ['task_id'])
+
+
+def fail_or_retry(task, run, exc, retries=None):
+    """
+    Classify the failure of a run, record the decision in its log data, then fail at once (deterministic failures)
+    or retry the task, after a delay and with less threads for resource failures.
+    Always raises: the retry, or exc if the task must not (or cannot anymore) be retried.
+    :param retries: [Optional] failed attempts before this one, if some retries of the task were not failures
+                    (e.g. waiting for threads). Default: all the retries of the task.
+    """
+    if retries is None:
+        retries = task.request.retries
+    kind, reason = classify_failure(exc, run.log_data.get('resources'), run.log_data.get('memory_reserved'))
+    policy = retry_policy(kind, retries, run.log_data.get('threads'))
+    if policy['action'] == 'retry' and retries >= task.max_retries:
+        policy['action'] = 'fail'
+    run.log_data['failure'] = dict(policy, kind=kind, reason=reason, retries=retries)
+    run.save(update_fields=['log_data'])
+    logger.info('Run {} failure - {} ({}), {}'.format(run.id, kind, reason, policy['action']))
+    if policy['action'] == 'fail':
+        raise exc
+    raise task.retry(exc=exc, countdown=policy['countdown'],
+                     max_retries=task.max_retries + task.request.retries - retries)
+
+
+def delete_output_files(*file_paths):
+    # remove mopo16s output files (paths without extension), if they exist
+    for file_path in file_paths:
+        for extension in ('.primers', '.scores'):
+            if path.exists(file_path + extension):
+                remove(file_path + extension)
 
 
 @celery_app.task(bind=True, expire=1200)
 def clean_allocated_threads(self):
-    # get ids of running tasks
-    active_tasks = get_running_tasks_ids('*mopo_run*')
-    
     # get allocated threads
-    keys = cache.keys('threads_allocated@job_*')
-    if not keys:
+    leases = get_leases()
+    if not leases:
         return 'OK, zero threads allocated'
-    threads_allocated = (int(cache.get(key)) for key in keys)
+    
+    # get task ids of the jobs holding the leases, then check their heartbeats at once
+    # (the shards of a job refresh the heartbeat of the job task)
+    jobs_ids = dict((lease, lease_job_id(lease)) for lease in leases)
+    jobs_task_ids = dict(Job.objects.filter(id__in=jobs_ids.values()).values_list('id', 'task_id'))
+    running = dict(zip(jobs_task_ids.keys(), tasks_are_running(jobs_task_ids.values())))
     
     result = ''
-    for key, threads in zip(keys, threads_allocated):
-        job_id = key.rsplit('_', 1)[-1]
-        try:
-            job_task_id = Job.objects.only('task_id').get(id=job_id).task_id
-        except Job.DoesNotExist:
-            cache.delete(key)
+    for lease, threads in leases.items():
+        job_id = jobs_ids[lease]
+        if job_id not in jobs_task_ids:
+            release_threads(lease)
             result += '\n job {} notfound-{:2d} threads - job does not exist!'.format(job_id, threads)
             continue
+        job_task_id = jobs_task_ids[job_id]
         
         # if the task is not running, delete threads allocation
         # the worker could have crashed
-        if job_task_id not in active_tasks:
-            cache.delete(key)
+        if not running[job_id]:
+            release_threads(lease)
             result += '\n job {} cleaned -{:2d} threads - {} not running'.format(job_id, threads, job_task_id)
         else:
             result += '\n job {}   OK    -{:2d} threads - {} running'.format(job_id, threads, job_task_id)
@@ -82,37 +300,107 @@ def clean_allocated_threads(self):
 
 @celery_app.task(bind=True, expire=1200)
 def check_failed_jobs(self):
-    # load not completed jobs (no 'result')
-    # that were sent ('task' exists and 'task.status' is 'STARTED') but killed ('run' without 'date_finished')
-    jobs = Job.objects.filter(result=None, task__status='STARTED') \
-        .filter(Q(run__date_finished=None) | Q(run=None)).distinct().only('task_id')
-    running_tasks = get_running_tasks_ids()
+    # load jobs that were started ('running' status) but killed (no heartbeat)
+    jobs = list(Job.objects.filter(status=Job.STATUS_RUNNING)
+                .only('task_id', 'shards', 'created_by_id', 'estimated_runtime', 'date_created', 'date_enqueued'))
+    penalties = get_penalties(job.created_by_id for job in jobs)
     result = ''
     jobs_resetted = 0
-    for job in jobs:
-        # check if not running
-        if job.task_id not in running_tasks:
+    for job, is_running in zip(jobs, tasks_are_running(job.task_id for job in jobs)):
+        # check if not running, a distributed job is alive also while its shards are waiting in queue
+        if not is_running and not (job.shards > 1 and job_has_pending_shards(job)):
             # create a new task, the other is lost
-            job.task_id = run_mopo16s_job.delay(job.id).id
-            job.save()
+            job.task_id = run_mopo16s_job.apply_async(
+                    (job.id,), priority=job.get_priority(penalties[job.created_by_id])).id
+            job.save(update_fields=['task_id'])
             jobs_resetted += 1
             result += '\n job {} resetted - new task_id: {}'.format(job.id, job.task_id)
-    return '{} jobs resetted'.format(jobs_resetted) + result
+    
+    # the jobs routed to a node that is gone would wait forever in its queue: queue them again in the shared one
+    live_nodes = get_live_nodes()
+    stranded_tasks = [task_id for task_id, node in cache.hgetall(ROUTED_TASKS_KEY).items() if node not in live_nodes]
+    for job in Job.objects.filter(task_id__in=stranded_tasks,
+                                  status__in=(Job.STATUS_PENDING, Job.STATUS_PENDING_RETRY)) \
+            .only('task_id', 'created_by_id', 'estimated_runtime', 'date_created', 'date_enqueued'):
+        AsyncResult(job.task_id).revoke()
+        unindex_pending_tasks(job.task_id)
+        job.task_id = run_mopo16s_job.apply_async((job.id,), priority=job.get_priority()).id
+        job.save(update_fields=['task_id'])
+        jobs_resetted += 1
+        result += '\n job {} rerouted - new task_id: {}'.format(job.id, job.task_id)
+    if stranded_tasks:
+        cache.hdel(ROUTED_TASKS_KEY, *stranded_tasks)
+    
+    # drop from the pending index the tasks that will never be consumed (e.g. lost or replaced)
+    pending_tasks = get_pending_tasks_ids()
+    waiting_tasks = Job.objects.filter(task_id__in=pending_tasks,
+                                       status__in=(Job.STATUS_PENDING, Job.STATUS_PENDING_RETRY)) \
+        .values_list('task_id', flat=True)
+    lost_tasks = set(pending_tasks).difference(waiting_tasks)
+    unindex_pending_tasks(*lost_tasks)
+    if lost_tasks:
+        cache.hdel(ROUTED_TASKS_KEY, *lost_tasks)
+    pending_shards = cache.zrange(PENDING_SHARDS_KEY, 0, -1)
+    running_jobs = set(str(job_id) for job_id in Job.objects.filter(
+            id__in=set(int(shard.split(':')[0]) for shard in pending_shards),
+            status=Job.STATUS_RUNNING).values_list('id', flat=True))
+    lost_shards = [shard for shard in pending_shards if shard.split(':')[0] not in running_jobs]
+    if lost_shards:
+        cache.zrem(PENDING_SHARDS_KEY, *lost_shards)
+    return '{} jobs resetted, {} lost tasks unindexed'.format(jobs_resetted, len(lost_tasks)) + result
+
+
+@celery_app.task(bind=True, expire=1200)
+def reprioritize_pending_jobs(self):
+    # reorder the waiting jobs by the recent usage of their users (fair share) and by their waiting time (aging),
+    # so that occasional users are served first and long jobs are never starved by the shorter ones
+    jobs = list(Job.objects.filter(task_id__in=get_pending_tasks_ids(),
+                                   status__in=(Job.STATUS_PENDING, Job.STATUS_PENDING_RETRY))
+                .only('task_id', 'created_by_id', 'estimated_runtime', 'date_created', 'date_enqueued'))
+    penalties = get_penalties(job.created_by_id for job in jobs)
+    routed = cache.hgetall(ROUTED_TASKS_KEY)
+    moved = 0
+    for job in jobs:
+        queue = node_queue(routed[job.task_id]) if job.task_id in routed else run_mopo16s_job.queue
+        moved += move_pending_task(job.task_id, queue, job.get_priority(penalties[job.created_by_id]))
+    return '{} jobs moved'.format(moved)
+
+
+@celery_app.task(bind=True, expire=1200)
+def fit_runtime_model(self):
+    coefficients = Run.objects.fit_runtime_model()
+    if coefficients is None:
+        return 'NOT ENOUGH HISTORY'
+    return 'OK, coefficients: {}'.format(coefficients)
 
 
-@celery_app.task(bind=True, queue='queue_mopo16s', max_retries=JOB_MAX_RUN_RETRIES, default_retry_delay=30)
-def run_mopo16s_job(self, job_id):
+@celery_app.task(bind=True, queue='queue_mopo16s', max_retries=JOB_MAX_RUN_RETRIES,
+                 default_retry_delay=MOPO16S_RETRY_DELAY)
+def run_mopo16s_job(self, job_id, routed=False, force_run=False, deferrals=0, deferred_run_id=None):
     # this method is idempotent
+    # a job waiting for threads is routed to a less loaded node, only once (routed is set)
+    # force_run is read from the job, the argument is only for the tasks published before it was stored there
+    # deferrals are the retries of the task that gave its threads to other users or waited too long for them,
+    # they are not failures, and they all share the run deferred_run_id
     
     logger.info('Running job {} - (re)try #{}'.format(job_id, self.request.retries))
     job = Job.objects.get(id=job_id)
-    run = job.create_run()
+    if job.status == Job.STATUS_CANCELLED:
+        return 'CANCELLED'
+    if force_run and not job.force_run:
+        job.force_run = True
+        job.save(update_fields=['force_run'])
+    if deferred_run_id is not None:
+        run = job.runs.get(id=deferred_run_id)
+        run.set_resumed()
+    else:
+        run = job.create_run()
     
     if job.is_completed:
         logger.error('Skipping job {} - {}'.format(job_id, Job.AlreadyCompletedException.description))
         run.set_failed(Job.AlreadyCompletedException.description)
         raise Job.AlreadyCompletedException
-    if job.runs.count() > JOB_MAX_RUN_RETRIES or self.request.retries > JOB_MAX_RUN_RETRIES:
+    if job.job_runs.count() > JOB_MAX_RUN_RETRIES or self.request.retries - deferrals > JOB_MAX_RUN_RETRIES:
         logger.error('Stopping job {} - {}'.format(job_id, Job.MaxRunReachedException.description))
         run.set_failed(Job.MaxRunReachedException.description)
         raise Job.MaxRunReachedException
@@ -122,68 +410,258 @@ def run_mopo16s_job(self, job_id):
             return 'task_id CHANGED, skipping'
         else:
             AsyncResult(job.task_id).revoke()
+            unindex_pending_tasks(job.task_id)
             job.task_id = self.request.id
-            job.save()
+            job.save(update_fields=['task_id'])
     
     tmp_path = MEDIA_ROOT + '/tmp/job_{}_'.format(job.id)
-    tmp_primers_file_path = tmp_path + 'good_pairs_{}.fasta'.format(job.good_pairs_id)
     tmp_init_file_path = tmp_path + 'init'
     tmp_out_file_path = tmp_path + 'out'
     
     def delete_tmp_files():
-        # remove InitialPrimerPairs temp file
-        if path.exists(tmp_primers_file_path):
-            remove(tmp_primers_file_path)
-        # remove the 4 output files
-        for path_ in (tmp_init_file_path, tmp_out_file_path):
-            for extension in ('.primers', '.scores'):
-                if path.exists(path_ + extension):
-                    remove(path_ + extension)
+        # remove the 4 output files (the input files are kept in the staging cache, for the next attempts)
+        delete_output_files(tmp_init_file_path, tmp_out_file_path)
     
-    try:
-        # write (or overwrite) temp initial_primer_pairs file
-        with open(tmp_primers_file_path, 'w') as temp_file:
-            temp_file.write(job.good_pairs.content)
+    # publish the heartbeat while running, renewing the threads lease too:
+    # the job is running since the task started, and the fingerprint and the staging hash the input files
+    with TaskHeartbeat(self.request.id, on_beat=lambda: renew_threads(lease_id(job_id))):
+        # an identical job could have been completed while this one was waiting in queue
+        if not job.force_run and job.reuse_result(run):
+            logger.info('Job {} - reused the result of an identical job'.format(job_id))
+            prerender_result_tables.delay(job.id)
+            send_job_completed_email.delay(job.id)
+            return 'OK'
+        
+        # distributed job: run the shards in parallel, then merge their outputs
+        if job.shards > 1:
+            logger.info('Job {} - split into {} shards'.format(job_id, job.shards))
+            run.set_finished(stdout='', shards=job.shards)
+            chord(run_mopo16s_shard.s(job_id, shard, self.request.id) for shard in range(job.shards))(
+                    merge_mopo16s_shards.s(job_id, self.request.id).on_error(set_job_failed.si(job_id)))
+            return 'SHARDED'
         
-        threads = allocate_threads(job, run)
-        run.set_threads(threads)
-        cmd_args = [MOPO16S_PATH,
-                    job.rep_set.file.path,
-                    tmp_primers_file_path,
-                    '--threads=' + str(threads),
-                    *job.mopo16s_command_options,
-                    '--outInitFileName=' + tmp_init_file_path,
-                    '--outFileName=' + tmp_out_file_path]
-        p = subprocess.run(cmd_args, check=True, capture_output=True)
-        deallocate_threads(job_id)
+        try:
+            # input files are written only if they are not staged on this worker already
+            with stage_inputs(job) as (rep_set_file_path, primers_file_path):
+                p, cmd_args = run_mopo16s(job, run, rep_set_file_path, primers_file_path,
+                                          tmp_init_file_path, tmp_out_file_path, reroute=not routed)
+            
+            run.set_completed(stdout=p.stdout,
+                              init_file_path=tmp_init_file_path,
+                              out_file_path=tmp_out_file_path,
+                              error=p.stderr,
+                              exit_code=p.returncode,
+                              cmd=' '.join(cmd_args))
+            prerender_result_tables.delay(job.id)
+            send_job_completed_email.delay(job.id)
+        except (Job.UserThreadsCapException, Job.AllocationTimeoutException) as exc:
+            logger.info('Job {} deferred - {}'.format(job_id, exc.description))
+            run.set_deferred(exc.description)
+            delete_tmp_files()
+            # retried later with the same task id and run, freeing the worker meanwhile, with the priority
+            # of the user now (its running threads count), never reaching max_retries
+            raise self.retry(exc=exc, countdown=MOPO16S_RETRY_DELAY, max_retries=self.request.retries + 1,
+                             priority=job.get_priority(),
+                             kwargs=dict(routed=routed, deferrals=deferrals + 1, deferred_run_id=run.id))
+        except Job.NodeBusyException as exc:
+            logger.info('Job {} routed - {}'.format(job_id, exc))
+            run.set_deferred(str(exc))
+            delete_tmp_files()
+            # queue the job again in the queue of the chosen node, with a new task
+            job.task_id = uuid()
+            job.save(update_fields=['task_id'])
+            cache.hset(ROUTED_TASKS_KEY, job.task_id, exc.node)
+            run_mopo16s_job.apply_async((job.id,), dict(routed=True), task_id=job.task_id,
+                                        queue=node_queue(exc.node), priority=job.get_priority())
+            return 'ROUTED'
+        except Job.CancelledException:
+            logger.info('Job {} - cancelled'.format(job_id))
+            run.set_cancelled()
+            delete_tmp_files()
+            return 'CANCELLED'
+        except subprocess.CalledProcessError as exc:
+            logger.error('Error job {} - CalledProcessError\n{!r}'.format(job_id, exc))
+            run.set_failed(error='{!r}'.format(exc),
+                           sterr=exc.stderr,
+                           stoout=exc.stdout,
+                           exit_code=exc.returncode,
+                           cmd=' '.join(exc.cmd))
+            delete_tmp_files()
+            fail_or_retry(self, run, exc, self.request.retries - deferrals)
+        except Exception as exc:
+            logger.error('Error job {} - Exception\n{!r}'.format(job_id, exc))
+            deallocate_threads(job_id)
+            run.set_failed(error=str(exc))
+            delete_tmp_files()
+            fail_or_retry(self, run, exc, self.request.retries - deferrals)
+    return 'OK'
+
+
+def get_job_scratch_path(job_id):
+    return MOPO16S_SCRATCH_ROOT + '/job_{}'.format(job_id)
+
+
+def delete_job_scratch(job_id):
+    rmtree(get_job_scratch_path(job_id), ignore_errors=True)
+
+
+def get_shard_tmp_path(job_id, shard):
+    # outputs of the shard, kept in the scratch area of the job until the job is completed
+    return get_job_scratch_path(job_id) + '/shard_{}_'.format(shard)
+
+
+def get_shard_output_files(shard_tmp_path):
+    return [shard_tmp_path + prefix + extension for prefix in ('init', 'out') for extension in ('.primers', '.scores')]
+
+
+# shards waiting in queue, sorted set 'job_id:shard' -> enqueue timestamp,
+# the merge of the shards waiting in queue (or for a retry) is 'job_id:merge'
+PENDING_SHARDS_KEY = 'queue_mopo16s:pending_shards'
+
+
+def pending_shard_member(job_id, shard):
+    # shard is 'merge' for the merge of the shards
+    return '{}:{}'.format(job_id, shard)
+
+
+def job_has_pending_shards(job):
+    # the merge counts too: between the end of the last shard and the start of the merge the job has no heartbeat
+    pipe = cache.pipeline(transaction=False)
+    for shard in (*range(job.shards), 'merge'):
+        pipe.zscore(PENDING_SHARDS_KEY, pending_shard_member(job.id, shard))
+    return any(score is not None for score in pipe.execute())
+
+
+@celery_app.task(bind=True, queue='queue_mopo16s', max_retries=JOB_MAX_RUN_RETRIES,
+                 default_retry_delay=MOPO16S_RETRY_DELAY)
+def run_mopo16s_shard(self, job_id, shard, job_task_id, allocation_retries=0, deferred_run_id=None):
+    # run a range of the runs of a job, with its own seed
+    # outputs are written in the scratch area of the job (shared MEDIA_ROOT), to be merged by merge_mopo16s_shards
+    # allocation_retries are the retries of the task that waited too long for threads, they are not failures,
+    # and they all share the run deferred_run_id
+    
+    logger.info('Running job {} shard {} - (re)try #{}'.format(job_id, shard, self.request.retries))
+    job = Job.objects.get(id=job_id)
+    if job.status == Job.STATUS_CANCELLED:
+        # the chord fails, without retrying
+        raise Job.CancelledException
+    runs_range, seed = job.get_shard_runs_range(shard), job.get_shard_seed(shard)
+    if deferred_run_id is not None:
+        run = job.runs.get(id=deferred_run_id)
+        run.set_resumed()
+    else:
+        run = job.create_run(shard=shard, runs_range=runs_range, seed=seed)
+    
+    tmp_path = get_shard_tmp_path(job_id, shard)
+    tmp_init_file_path = tmp_path + 'init'
+    tmp_out_file_path = tmp_path + 'out'
+    checkpoint_path = tmp_path + 'checkpoint.json'
+    
+    # the heartbeat of the job task is refreshed too, the job is running as long as one of its shards is
+    # (also while the checkpoint and the staging hash their files)
+    with TaskHeartbeat(self.request.id, job_task_id, on_beat=lambda: renew_threads(lease_id(job_id, shard))):
+        # finished by a previous attempt of the job (e.g. before a worker died or another shard failed for good,
+        # see set_job_failed): its outputs are salvaged, only the unfinished shards are run again
+        checkpoint = read_checkpoint(checkpoint_path, runs_range=runs_range, seed=seed,
+                                     mopo16s_version=job.mopo16s_version)
+        if checkpoint is not None:
+            logger.info('Job {} shard {} - salvaged the outputs of run {}'.format(job_id, shard, checkpoint['run_id']))
+            run.set_salvaged(checkpoint['run_id'])
+            return tmp_path
+        makedirs(get_job_scratch_path(job_id), exist_ok=True)
         
-        run.set_completed(stdout=p.stdout.decode("utf-8"),
-                          init_file_path=tmp_init_file_path,
-                          out_file_path=tmp_out_file_path,
-                          error=p.stderr.decode("utf-8"),
-                          exit_code=p.returncode,
-                          cmd=' '.join(cmd_args))
-        send_job_completed_email.delay(job.id)
-    except subprocess.CalledProcessError as exc:
-        logger.error('Error job {} - CalledProcessError\n{!r}'.format(job_id, exc))
-        deallocate_threads(job_id)
-        run.set_failed(error='{!r}'.format(exc),
-                       sterr=exc.stderr.decode("utf-8"),
-                       stoout=exc.stdout.decode("utf-8"),
-                       exit_code=exc.returncode,
-                       cmd=' '.join(exc.cmd),
-                       output=exc.output.decode("utf-8"))
-        delete_tmp_files()
-        raise run_mopo16s_job.retry(exc=exc)
-    except Exception as exc:
-        logger.error('Error job {} - Exception\n{!r}'.format(job_id, exc))
-        deallocate_threads(job_id)
-        run.set_failed(error=str(exc))
-        delete_tmp_files()
-        raise run_mopo16s_job.retry(exc=exc)
+        try:
+            with stage_inputs(job) as (rep_set_file_path, primers_file_path):
+                p, cmd_args = run_mopo16s(job, run, rep_set_file_path, primers_file_path,
+                                          tmp_init_file_path, tmp_out_file_path, shard)
+            
+            run.set_finished(stdout=p.stdout,
+                             error=p.stderr,
+                             exit_code=p.returncode,
+                             cmd=' '.join(cmd_args))
+            write_checkpoint(checkpoint_path, get_shard_output_files(tmp_path), runs_range=runs_range, seed=seed,
+                             mopo16s_version=job.mopo16s_version, run_id=run.id)
+        except subprocess.CalledProcessError as exc:
+            logger.error('Error job {} shard {} - CalledProcessError\n{!r}'.format(job_id, shard, exc))
+            run.set_failed(error='{!r}'.format(exc),
+                           sterr=exc.stderr,
+                           stoout=exc.stdout,
+                           exit_code=exc.returncode,
+                           cmd=' '.join(exc.cmd))
+            delete_output_files(tmp_init_file_path, tmp_out_file_path)
+            fail_or_retry(self, run, exc, self.request.retries - allocation_retries)
+        except Job.AllocationTimeoutException as exc:
+            logger.info('Job {} shard {} deferred - {}'.format(job_id, shard, exc.description))
+            run.set_deferred(exc.description)
+            # retried with the same task id (the chord waits for it) as long as the threads are busy,
+            # never reaching max_retries
+            raise self.retry(exc=exc, countdown=MOPO16S_RETRY_DELAY, max_retries=self.request.retries + 1,
+                             kwargs=dict(allocation_retries=allocation_retries + 1, deferred_run_id=run.id))
+        except Job.CancelledException:
+            logger.info('Job {} shard {} - cancelled'.format(job_id, shard))
+            run.set_cancelled()
+            delete_output_files(tmp_init_file_path, tmp_out_file_path)
+            raise
+        except Exception as exc:
+            logger.error('Error job {} shard {} - Exception\n{!r}'.format(job_id, shard, exc))
+            deallocate_threads(job_id, shard)
+            run.set_failed(error=str(exc))
+            delete_output_files(tmp_init_file_path, tmp_out_file_path)
+            fail_or_retry(self, run, exc, self.request.retries - allocation_retries)
+    return tmp_path
+
+
+@celery_app.task(bind=True, max_retries=JOB_MAX_RUN_RETRIES, default_retry_delay=MOPO16S_RETRY_DELAY)
+def merge_mopo16s_shards(self, shards_tmp_paths, job_id, job_task_id):
+    # initial primers are the same for every shard, optimized ones are merged into a single non-dominated set
+    
+    logger.info('Merging {} shards of job {}'.format(len(shards_tmp_paths), job_id))
+    job = Job.objects.get(id=job_id)
+    if job.is_completed:
+        return 'SKIPPED, job already completed'
+    if job.status == Job.STATUS_CANCELLED:
+        delete_job_scratch(job_id)
+        return 'CANCELLED'
+    run = job.create_run(merged_shards=len(shards_tmp_paths))
+    
+    tmp_init_file_path = shards_tmp_paths[0] + 'init'
+    tmp_out_file_path = MEDIA_ROOT + '/tmp/job_{}_out'.format(job_id)
+    with TaskHeartbeat(self.request.id, job_task_id):
+        try:
+            merge_mopo16s_outputs((shard_tmp_path + 'out' for shard_tmp_path in shards_tmp_paths), tmp_out_file_path)
+            run.set_completed(stdout='', init_file_path=tmp_init_file_path, out_file_path=tmp_out_file_path)
+        except Exception as exc:
+            logger.error('Error merging job {} - Exception\n{!r}'.format(job_id, exc))
+            run.set_failed(error=str(exc))
+            raise self.retry(exc=exc)
+    
+    # the result is saved, the outputs of the shards are not needed anymore
+    delete_output_files(tmp_out_file_path)
+    delete_job_scratch(job_id)
+    prerender_result_tables.delay(job_id)
+    send_job_completed_email.delay(job_id)
     return 'OK'
 
 
+@celery_app.task(bind=True)
+def set_job_failed(self, job_id):
+    # error callback of a distributed job, when one of its shards (or the merge) failed for good:
+    # the job is queued again, its finished shards are salvaged from their checkpoints and only the others run,
+    # unless the failure would happen again or the job has no runs left
+    job = Job.objects.only('status', 'task_id', 'created_by_id', 'estimated_runtime', 'date_created',
+                           'date_enqueued').get(id=job_id)
+    if job.status == Job.STATUS_CANCELLED:
+        return 'CANCELLED'
+    last_failure = job.runs.filter(log_data__has_keys=['shard', 'failure']).last()
+    if (last_failure is not None and last_failure.log_data['failure']['kind'] == FAILURE_DETERMINISTIC) \
+            or job.job_runs.count() >= JOB_MAX_RUN_RETRIES:
+        Job.update_status(job_id, Job.STATUS_FAILED)
+        return 'FAILED'
+    job.task_id = run_mopo16s_job.apply_async((job.id,), priority=job.get_priority()).id
+    job.save(update_fields=['task_id'])
+    return 'REQUEUED - new task_id: {}'.format(job.task_id)
+
+
 @celery_app.task(bind=True)
 def send_email(self, subject, message, recipient, is_auto=True):
     if is_auto:
@@ -191,8 +669,76 @@ def send_email(self, subject, message, recipient, is_auto=True):
     return send_mail(EMAIL_SUBJECT_PREFIX + subject, message, DEFAULT_FROM_EMAIL, [recipient])
 
 
+@celery_app.task(bind=True, expire=3600)
+def prerender_result_tables(self, job_id):
+    # the tables of a completed job are rendered once, then ResultView serves them from the cache
+    render_result_tables(Result.objects.only('job_id', 'data_npz').get(job_id=job_id))
+    return 'OK'
+
+
 @celery_app.task(bind=True)
 def send_job_completed_email(self, job_id):
     job = Job.objects.get(id=job_id)
     return send_mail('Job completed', 'Your job has been completed.\n\n' + job.get_info_str(),
                      DEFAULT_FROM_EMAIL, [job.created_by.email])
+
+
+# keep the materialized status of the jobs and the pending index up to date with the lifecycle of their tasks,
+# the job id is always the first argument of run_mopo16s_job
+
+
+@before_task_publish.connect
+def job_task_published(sender=None, headers=None, body=None, properties=None, **kwargs):
+    # sender is the task name, body is the tuple (args, kwargs, embed)
+    if sender == run_mopo16s_job.name:
+        index_pending_task(headers['id'], (properties or {}).get('priority'))
+        # the retries of a deferred job are not failures
+        failures = (headers.get('retries') or 0) - body[1].get('deferrals', 0)
+        Job.update_status(body[0][0], Job.STATUS_PENDING_RETRY if failures > 0 else Job.STATUS_PENDING)
+    elif sender == run_mopo16s_shard.name:
+        cache.zadd(PENDING_SHARDS_KEY, {pending_shard_member(*body[0][:2]): time()})
+    elif sender == merge_mopo16s_shards.name:
+        # args are (shards_tmp_paths, job_id, job_task_id), published again by every retry
+        cache.zadd(PENDING_SHARDS_KEY, {pending_shard_member(body[0][1], 'merge'): time()})
+
+
+@task_prerun.connect
+def job_task_started(sender=None, task_id=None, args=None, **kwargs):
+    if sender.name == run_mopo16s_job.name:
+        unindex_pending_tasks(task_id)
+        cache.hdel(ROUTED_TASKS_KEY, task_id)
+        Job.update_status(args[0], Job.STATUS_RUNNING)
+    elif sender.name == run_mopo16s_shard.name:
+        cache.zrem(PENDING_SHARDS_KEY, pending_shard_member(*args[:2]))
+    elif sender.name == merge_mopo16s_shards.name:
+        cache.zrem(PENDING_SHARDS_KEY, pending_shard_member(args[1], 'merge'))
+
+
+@task_revoked.connect
+def job_task_revoked(sender=None, request=None, **kwargs):
+    if sender.name == run_mopo16s_job.name:
+        unindex_pending_tasks(request.id)
+        cache.hdel(ROUTED_TASKS_KEY, request.id)
+    elif sender.name == run_mopo16s_shard.name:
+        cache.zrem(PENDING_SHARDS_KEY, pending_shard_member(*request.args[:2]))
+    elif sender.name == merge_mopo16s_shards.name:
+        cache.zrem(PENDING_SHARDS_KEY, pending_shard_member(request.args[1], 'merge'))
+
+
+@task_success.connect
+def job_task_succeeded(sender=None, result=None, **kwargs):
+    # a skipped task (e.g. duplicated) does not change the status
+    if sender.name == run_mopo16s_job.name and result == 'OK':
+        Job.update_status(sender.request.args[0], Job.STATUS_COMPLETED)
+
+
+@task_failure.connect
+def job_task_failed(sender=None, args=None, **kwargs):
+    if sender.name == run_mopo16s_job.name:
+        Job.update_status(args[0], Job.STATUS_FAILED)
+
+
+@task_retry.connect
+def job_task_retried(sender=None, request=None, **kwargs):
+    if sender.name == run_mopo16s_job.name:
+        Job.update_status(request.args[0], Job.STATUS_PENDING_RETRY)
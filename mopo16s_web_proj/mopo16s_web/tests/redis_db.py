@@ -0,0 +1,37 @@
+from contextlib import ExitStack
+from unittest import mock
+from decouple import config
+from django.test import SimpleTestCase
+from redis import Redis
+from redis.exceptions import ConnectionError
+
+
+# database of the local Redis server used by the tests, emptied by every test: never one of the app (0 and 1)
+TEST_REDIS_DB = config('MOPO16S_TEST_REDIS_DB', default=15, cast=int)
+
+
+class RedisTestCase(SimpleTestCase):
+    """
+    Runs the Redis commands and the Lua scripts of the given modules on TEST_REDIS_DB,
+    instead of the databases of the app. Skipped if Redis is not available.
+    """
+    # modules whose clients ('cache', 'cache_celery') and scripts are redirected
+    modules = ()
+    
+    def setUp(self):
+        self.redis = Redis(db=TEST_REDIS_DB, decode_responses=True)
+        try:
+            self.redis.ping()
+        except ConnectionError:
+            self.skipTest('Redis is not available')
+        self.redis.flushdb()
+        self.addCleanup(self.redis.flushdb)
+        patches = ExitStack()
+        self.addCleanup(patches.close)
+        for module in self.modules:
+            for name, value in list(vars(module).items()):
+                if isinstance(value, Redis):
+                    patches.enter_context(mock.patch.object(module, name, self.redis))
+                elif hasattr(value, 'registered_client'):
+                    # a script registered on one of the clients
+                    patches.enter_context(mock.patch.object(value, 'registered_client', self.redis))
@@ -0,0 +1,116 @@
+from django.test import SimpleTestCase
+
+from .redis_db import RedisTestCase
+from .. import allocator
+from ..allocator import reserve_threads, release_threads, renew_threads, get_leases, get_leases_memory, \
+    get_threads_by_user, get_threads_by_node, reserve_cores, release_cores, LEASES_EXPIRY_KEY, USER_CAP_REACHED
+from ..utils import parse_cpu_list
+
+
+class ReserveThreadsTests(RedisTestCase):
+    modules = (allocator,)
+    
+    def test_granted_up_to_capacity(self):
+        self.assertEqual(4, reserve_threads('a', 4, 6, node='n1'))
+        self.assertEqual(2, reserve_threads('b', 4, 6, node='n1'))
+        self.assertEqual(0, reserve_threads('c', 4, 6, node='n1'))
+        # the capacity is per node
+        self.assertEqual(4, reserve_threads('c', 4, 6, node='n2'))
+        self.assertEqual(dict(a=4, b=2, c=4), get_leases())
+        self.assertEqual(dict(n1=6, n2=4), get_threads_by_node())
+    
+    def test_same_lease_replaced(self):
+        reserve_threads('a', 4, 6, node='n1')
+        self.assertEqual(6, reserve_threads('a', 6, 6, node='n1'))
+        self.assertEqual(dict(a=6), get_leases())
+    
+    def test_released(self):
+        reserve_threads('a', 6, 6, node='n1')
+        release_threads('a')
+        self.assertEqual(6, reserve_threads('b', 6, 6, node='n1'))
+        self.assertEqual(dict(b=6), get_leases())
+    
+    def test_user_cap(self):
+        self.assertEqual(4, reserve_threads('a', 4, 10, user_id=1, user_max_threads=5, node='n1'))
+        # the cap holds on all the nodes
+        self.assertEqual(1, reserve_threads('b', 4, 10, user_id=1, user_max_threads=5, node='n2'))
+        self.assertEqual(USER_CAP_REACHED, reserve_threads('c', 4, 10, user_id=1, user_max_threads=5, node='n1'))
+        # other users are not capped by it
+        self.assertEqual(4, reserve_threads('d', 4, 10, user_id=2, user_max_threads=5, node='n1'))
+        self.assertEqual({'1': 5, '2': 4}, get_threads_by_user())
+    
+    def test_memory_budget(self):
+        reserve = dict(memory_budget=1000, memory_base=100, memory_per_thread=200, node='n1')
+        # (1000 - 100) // 200 threads fit
+        self.assertEqual(4, reserve_threads('a', 6, 10, **reserve))
+        self.assertEqual(dict(a=900), get_leases_memory())
+        self.assertEqual(0, reserve_threads('b', 1, 10, **reserve))
+        release_threads('a')
+        self.assertEqual({}, get_leases_memory())
+        # a single thread is admitted when nothing else runs, even if it does not fit
+        self.assertEqual(1, reserve_threads('c', 6, 10, memory_budget=100, memory_base=200, memory_per_thread=200,
+                                            node='n1'))
+    
+    def test_expired_leases_purged(self):
+        reserve_threads('a', 6, 6, ttl=-1, node='n1')
+        self.assertEqual(6, reserve_threads('b', 6, 6, node='n1'))
+        self.assertEqual(dict(b=6), get_leases())
+    
+    def test_expiry_on_redis_clock(self):
+        seconds, microseconds = self.redis.time()
+        reserve_threads('a', 1, 6, ttl=300, node='n1')
+        self.assertAlmostEqual(seconds + microseconds / 1e6 + 300, self.redis.zscore(LEASES_EXPIRY_KEY, 'a'), delta=5)
+    
+    def test_renewed(self):
+        reserve_threads('a', 6, 6, ttl=-1, node='n1')
+        renew_threads('a', 300)
+        self.assertEqual(0, reserve_threads('b', 6, 6, node='n1'))
+        self.assertEqual(dict(a=6), get_leases())
+    
+    def test_renew_never_creates(self):
+        renew_threads('a', 300)
+        self.assertIsNone(self.redis.zscore(LEASES_EXPIRY_KEY, 'a'))
+
+
+class ReserveCoresTests(RedisTestCase):
+    modules = (allocator,)
+    # two NUMA nodes
+    topology = [[0, 1, 2, 3], [4, 5]]
+    
+    def setUp(self):
+        super().setUp()
+        for lease_id in ('a', 'b', 'c'):
+            reserve_threads(lease_id, 1, 100, node='h1')
+    
+    def test_single_numa_node_preferred(self):
+        # the smallest node that fits all of them
+        self.assertEqual([4, 5], reserve_cores('a', 2, self.topology, host='h1'))
+        self.assertEqual([0, 1, 2], reserve_cores('b', 3, self.topology, host='h1'))
+        # less than wanted if not enough are free
+        self.assertEqual([3], reserve_cores('c', 2, self.topology, host='h1'))
+    
+    def test_split_across_numa_nodes(self):
+        # the nodes with the most free CPUs first
+        self.assertEqual([0, 1, 2, 3, 4], reserve_cores('a', 5, self.topology, host='h1'))
+    
+    def test_freed_with_lease(self):
+        reserve_cores('a', 4, self.topology, host='h1')
+        release_threads('a')
+        self.assertEqual([0, 1, 2, 3], reserve_cores('b', 4, self.topology, host='h1'))
+    
+    def test_released(self):
+        reserve_cores('a', 6, self.topology, host='h1')
+        release_cores('a', host='h1')
+        self.assertEqual([4, 5], reserve_cores('b', 2, self.topology, host='h1'))
+    
+    def test_hosts_are_disjoint(self):
+        reserve_cores('a', 6, self.topology, host='h1')
+        self.assertEqual([4, 5], reserve_cores('b', 2, self.topology, host='h2'))
+
+
+class ParseCpuListTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual([0, 1, 2, 3, 8, 10, 11], parse_cpu_list('0-3,8,10-11\n'))
+    
+    def test_empty(self):
+        self.assertEqual([], parse_cpu_list('\n'))
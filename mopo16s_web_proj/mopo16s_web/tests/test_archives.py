@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+from io import BytesIO
+from os import listdir, path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import mock
+from zipfile import ZipFile, ZIP_STORED
+from django.test import SimpleTestCase
+
+from .. import archives
+from ..archives import stream_result_archive, get_cached_result_archive
+from ..utils import stream_zip
+
+
+ENTRIES = [('init.primers', 'ACGT\tx\tTTGA\n'), ('out.scores', b'0.9\t0.5\t0.1\n' * 1000)]
+
+
+def unzip(data):
+    with ZipFile(BytesIO(data)) as zip_file:
+        return [(info.filename, zip_file.read(info.filename), info.date_time) for info in zip_file.infolist()]
+
+
+class StreamZipTests(SimpleTestCase):
+    def test_entries(self):
+        self.assertEqual([('init.primers', b'ACGT\tx\tTTGA\n', (1980, 1, 1, 0, 0, 0)),
+                          ('out.scores', ENTRIES[1][1], (1980, 1, 1, 0, 0, 0))],
+                         unzip(b''.join(stream_zip(ENTRIES))))
+    
+    def test_streamed_by_entry(self):
+        # a chunk for every entry, then the central directory
+        chunks = list(stream_zip(ENTRIES))
+        self.assertEqual(3, len(chunks))
+        self.assertTrue(all(chunks))
+    
+    def test_stored(self):
+        data = b''.join(stream_zip(ENTRIES, ZIP_STORED))
+        self.assertGreater(len(data), len(ENTRIES[1][1]))
+        self.assertEqual(ENTRIES[1][1], unzip(data)[1][1])
+    
+    def test_reproducible(self):
+        date_time = (2026, 1, 2, 3, 4, 6)
+        data = b''.join(stream_zip(ENTRIES, date_time=date_time))
+        self.assertEqual(data, b''.join(stream_zip(ENTRIES, date_time=date_time)))
+        self.assertEqual(date_time, unzip(data)[0][2])
+
+
+class StreamResultArchiveTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        patch = mock.patch.object(archives, 'RESULT_ARCHIVES_ROOT', path.join(self.tmp_dir.name, 'archives'))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.result = SimpleNamespace(job_id=1, date_completed=datetime(2026, 1, 2, 3, 4, 6, tzinfo=timezone.utc),
+                                      RAW_FIELDS=('init_primers', 'out_scores'), init_primers=ENTRIES[0][1],
+                                      out_scores=ENTRIES[1][1])
+    
+    def test_cached_once_complete(self):
+        self.assertIsNone(get_cached_result_archive(1, self.result.date_completed))
+        data = b''.join(stream_result_archive(self.result))
+        file_path = get_cached_result_archive(1, self.result.date_completed)
+        with open(file_path, 'rb') as file:
+            self.assertEqual(data, file.read())
+        self.assertEqual([name for name, _ in ENTRIES], [name for name, _, _ in unzip(data)])
+        # the same archive when streamed again
+        self.assertEqual(data, b''.join(stream_result_archive(self.result)))
+    
+    def test_interrupted_leaves_nothing(self):
+        chunks = stream_result_archive(self.result)
+        next(chunks)
+        chunks.close()
+        self.assertIsNone(get_cached_result_archive(1, self.result.date_completed))
+        self.assertEqual([], listdir(archives.RESULT_ARCHIVES_ROOT))
+    
+    def test_cache_disabled(self):
+        with mock.patch.object(archives, 'RESULT_ARCHIVES_ROOT', None):
+            data = b''.join(stream_result_archive(self.result))
+            self.assertIsNone(get_cached_result_archive(1, self.result.date_completed))
+        self.assertEqual(2, len(unzip(data)))
+        self.assertFalse(path.exists(archives.RESULT_ARCHIVES_ROOT))
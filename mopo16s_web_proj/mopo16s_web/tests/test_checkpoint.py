@@ -0,0 +1,44 @@
+from os import path, remove
+from tempfile import TemporaryDirectory
+from django.test import SimpleTestCase
+
+from ..utils import write_checkpoint, read_checkpoint
+
+
+class CheckpointTests(SimpleTestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.checkpoint_path = path.join(tmp.name, 'checkpoint.json')
+        self.file_paths = [path.join(tmp.name, name) for name in ('out.primers', 'out.scores')]
+        for file_path in self.file_paths:
+            with open(file_path, 'w') as file:
+                file.write(file_path)
+        write_checkpoint(self.checkpoint_path, self.file_paths, runs_range=(0, 5), seed=7, run_id=3)
+    
+    def test_salvaged(self):
+        checkpoint = read_checkpoint(self.checkpoint_path, runs_range=(0, 5), seed=7)
+        self.assertEqual(3, checkpoint['run_id'])
+        self.assertEqual(set(self.file_paths), set(checkpoint['files']))
+        self.assertFalse(path.exists(self.checkpoint_path + '.tmp'))
+    
+    def test_missing(self):
+        remove(self.checkpoint_path)
+        self.assertIsNone(read_checkpoint(self.checkpoint_path, runs_range=(0, 5), seed=7))
+    
+    def test_produced_from_other_data(self):
+        self.assertIsNone(read_checkpoint(self.checkpoint_path, runs_range=(0, 4), seed=7))
+        self.assertIsNone(read_checkpoint(self.checkpoint_path, runs_range=(0, 5), seed=8))
+        self.assertIsNone(read_checkpoint(self.checkpoint_path, runs_range=(0, 5), seed=7, mopo16s_version='2'))
+    
+    def test_file_missing_or_changed(self):
+        with open(self.file_paths[1], 'a') as file:
+            file.write('\n')
+        self.assertIsNone(read_checkpoint(self.checkpoint_path, runs_range=(0, 5), seed=7))
+        remove(self.file_paths[1])
+        self.assertIsNone(read_checkpoint(self.checkpoint_path, runs_range=(0, 5), seed=7))
+    
+    def test_corrupted(self):
+        with open(self.checkpoint_path, 'w') as file:
+            file.write('{"runs_range": [0, ')
+        self.assertIsNone(read_checkpoint(self.checkpoint_path, runs_range=(0, 5), seed=7))
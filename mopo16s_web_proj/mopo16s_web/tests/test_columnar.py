@@ -0,0 +1,110 @@
+from django.test import SimpleTestCase
+
+from ..columnar import ResultColumns, ROW_FIELDS
+from ..models import Result
+
+
+# rows [forward primers, reverse primers, efficiency, coverage, matching-bias], with ties on efficiency
+ROWS = [
+    [['ACGT'], ['TTGA', 'TTGG'], 0.9, 0.5, 0.1],
+    [['ACGA'], ['TTGA'], 0.7, 0.8, 0.3],
+    [['ACGT'], ['TTGA'], 0.9, 0.6, 0.2],
+    [['ACGC', 'ACGG'], ['TTGC'], 0.5, 0.9, 0.05],
+    [['ACGA'], ['TTGG'], 0.7, 0.4, 0.4],
+    ]
+
+
+class ResultColumnsTests(SimpleTestCase):
+    def setUp(self):
+        self.columns = ResultColumns.from_bytes(ResultColumns.from_rows(dict(init=ROWS[:2], out=ROWS)).to_bytes())
+    
+    def test_round_trip(self):
+        self.assertEqual(ROWS[:2], self.columns.rows('init'))
+        self.assertEqual(ROWS, self.columns.rows('out'))
+        self.assertEqual([ROWS[3], ROWS[0]], self.columns.rows('out', [3, 0]))
+    
+    def test_primer_sets_stored_once(self):
+        self.assertEqual(['ACGT', 'TTGA\tTTGG', 'ACGA', 'TTGA', 'ACGC\tACGG', 'TTGC', 'TTGG'],
+                         self.columns['primer_sets'].tobytes().decode('ascii').split('\n'))
+        self.assertEqual([['ACGT'], ['ACGA'], ['ACGT'], ['ACGC', 'ACGG'], ['ACGA']],
+                         self.columns.primers('out', 'forward').tolist())
+    
+    def test_scores(self):
+        self.assertEqual(5, self.columns.count('out'))
+        self.assertEqual([row[2:] for row in ROWS], self.columns.scores('out').tolist())
+    
+    def test_empty_prefix(self):
+        columns = ResultColumns.from_bytes(ResultColumns.from_rows(dict(out=ROWS)).to_bytes())
+        self.assertEqual(0, columns.count('init'))
+        self.assertEqual([], columns.rows('init'))
+    
+    def test_file_order(self):
+        page = self.columns.select('out')
+        self.assertEqual(5, page['total'])
+        self.assertEqual([dict(zip(('index', *ROW_FIELDS), (i, *row))) for i, row in enumerate(ROWS)], page['rows'])
+        self.assertIsNone(page['next'])
+    
+    def test_order_by_is_stable(self):
+        indexes = [row['index'] for row in self.columns.select('out', order_by='-efficiency')['rows']]
+        self.assertEqual([0, 2, 1, 4, 3], indexes)
+        indexes = [row['index'] for row in self.columns.select('out', order_by='matching_bias')['rows']]
+        self.assertEqual([3, 0, 2, 1, 4], indexes)
+    
+    def test_thresholds(self):
+        page = self.columns.select('out', thresholds=dict(min_efficiency=0.7, max_matching_bias=0.3))
+        self.assertEqual(3, page['total'])
+        self.assertEqual([0, 1, 2], [row['index'] for row in page['rows']])
+    
+    def test_fields(self):
+        row = self.columns.select('out', fields=('coverage',), limit=1)['rows'][0]
+        self.assertEqual(dict(index=0, coverage=0.5), row)
+    
+    def test_keyset_paging(self):
+        # pages of 2 rows, ties of efficiency across pages
+        indexes, after = [], None
+        while True:
+            page = self.columns.select('out', order_by='-efficiency', limit=2, after=after)
+            indexes.extend(row['index'] for row in page['rows'])
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual([0, 2, 1, 4, 3], indexes)
+    
+    def test_offset_paging(self):
+        page = self.columns.select('out', order_by='-efficiency', offset=2, limit=2)
+        self.assertEqual([1, 4], [row['index'] for row in page['rows']])
+        self.assertEqual(4, page['next'])
+        self.assertIsNone(self.columns.select('out', offset=4, limit=2)['next'])
+    
+    def test_invalid(self):
+        for kwargs in (dict(order_by='tm'), dict(thresholds=dict(min_tm=50)), dict(fields=('tm',)), dict(offset=-1),
+                       dict(limit=-1), dict(after=5)):
+            with self.subTest(**kwargs), self.assertRaises(ValueError):
+                self.columns.select('out', **kwargs)
+
+
+class ResultGetRowsTests(SimpleTestCase):
+    def setUp(self):
+        self.result = Result(data_npz=ResultColumns.from_rows(dict(init=ROWS[:2], out=ROWS)).to_bytes())
+    
+    def test_page(self):
+        page = self.result.get_rows('out', order_by='-coverage', fields='forward, coverage', limit=2,
+                                    min_efficiency=0.6)
+        self.assertEqual(4, page['total'])
+        self.assertEqual([dict(index=1, forward=['ACGA'], coverage=0.8), dict(index=2, forward=['ACGT'], coverage=0.6)],
+                         page['rows'])
+        self.assertEqual(2, page['next'])
+        self.assertEqual((0, 2), (page['offset'], page['limit']))
+    
+    def test_limits(self):
+        self.assertEqual(Result.ROWS_PAGE_SIZE, self.result.get_rows('init')['limit'])
+        self.assertEqual(Result.ROWS_MAX_PAGE_SIZE, self.result.get_rows('init', limit=10 ** 6)['limit'])
+    
+    def test_structured_before_data_npz(self):
+        result = Result(data=dict(init=ROWS[:2], out=ROWS))
+        self.assertEqual(self.result.get_rows('out', order_by='efficiency'),
+                         result.get_rows('out', order_by='efficiency'))
+    
+    def test_invalid_prefix(self):
+        with self.assertRaises(ValueError):
+            self.result.get_rows('all')
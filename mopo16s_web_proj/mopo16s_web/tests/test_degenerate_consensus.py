@@ -0,0 +1,36 @@
+from random import Random
+from Bio import motifs
+from Bio.Seq import Seq
+from django.test import SimpleTestCase
+
+from ..utils import degenerate_consensus
+
+
+def bio_consensus(sequences):
+    return str(motifs.create([Seq(seq) for seq in sequences]).degenerate_consensus)
+
+
+class DegenerateConsensusTests(SimpleTestCase):
+    def test_rules(self):
+        # a single base, two bases, the bases present, N
+        self.assertEqual('A', degenerate_consensus(['A', 'A', 'A', 'C']))
+        self.assertEqual('M', degenerate_consensus(['A', 'A', 'C', 'C']))
+        self.assertEqual('V', degenerate_consensus(['A', 'C', 'G', 'A', 'C', 'G']))
+        self.assertEqual('N', degenerate_consensus(['A', 'C', 'G', 'T']))
+    
+    def test_as_bio_motifs(self):
+        rng = Random(0)
+        for _ in range(500):
+            # few sequences and few bases, to have ties and all the rules
+            bases = rng.sample('ACGT', rng.randint(1, 4))
+            length = rng.randint(1, 20)
+            sequences = [''.join(rng.choice(bases) for _ in range(length)) for _ in range(rng.randint(1, 8))]
+            self.assertEqual(bio_consensus(sequences), degenerate_consensus(sequences), sequences)
+    
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            degenerate_consensus(['ACG', 'AC'])
+        with self.assertRaises(ValueError):
+            degenerate_consensus(['ACN', 'ACG'])
+        with self.assertRaises(ValueError):
+            degenerate_consensus(['acg'])
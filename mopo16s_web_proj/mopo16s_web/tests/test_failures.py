@@ -0,0 +1,69 @@
+from errno import ENOSPC, ENOENT
+from signal import SIGKILL
+import subprocess
+from django.test import SimpleTestCase
+
+from mopo16s_web_proj.settings import MOPO16S_PATH, MOPO16S_RETRY_DELAY, MOPO16S_RETRY_BACKOFF_MAX
+from ..failures import classify_failure, retry_policy, FAILURE_DETERMINISTIC, FAILURE_RESOURCE, FAILURE_TRANSIENT
+
+
+def process_error(returncode=1, stderr=''):
+    return subprocess.CalledProcessError(returncode, [MOPO16S_PATH], output='', stderr=stderr)
+
+
+class ClassifyFailureTests(SimpleTestCase):
+    def assertKind(self, kind, *args):
+        self.assertEqual(kind, classify_failure(*args)[0])
+    
+    def test_killed(self):
+        self.assertKind(FAILURE_RESOURCE, process_error(), dict(oom_kills=1))
+        self.assertKind(FAILURE_RESOURCE, process_error(-SIGKILL))
+    
+    def test_stderr_patterns(self):
+        self.assertKind(FAILURE_RESOURCE, process_error(stderr="terminate called: std::bad_alloc"))
+        self.assertKind(FAILURE_DETERMINISTIC, process_error(stderr="Invalid option --foo"))
+        # resource patterns first, 'cannot allocate memory' is not 'cannot open'
+        self.assertKind(FAILURE_RESOURCE, process_error(stderr="cannot open file: Cannot allocate memory"))
+    
+    def test_usage_and_fasta_patterns_anchored(self):
+        self.assertKind(FAILURE_DETERMINISTIC, process_error(stderr="Usage: /opt/mopo16s/mopo16s [options] a b\n"))
+        self.assertKind(FAILURE_DETERMINISTIC, process_error(stderr="ERROR: invalid FASTA record at line 3\n"))
+        # lines that only mention an input file or a usage are not errors of the inputs
+        self.assertKind(FAILURE_TRANSIENT, process_error(stderr="Reading rep_set.fasta\nError: lost connection\n"))
+        self.assertKind(FAILURE_TRANSIENT, process_error(stderr="Memory usage: 1024 MB\n"))
+        self.assertKind(FAILURE_TRANSIENT, process_error(stderr="Error: simulated failure after run 1\n"))
+    
+    def test_exit_codes(self):
+        self.assertKind(FAILURE_DETERMINISTIC, process_error(127))
+        self.assertKind(FAILURE_TRANSIENT, process_error(1))
+    
+    def test_memory_reserved_exhausted(self):
+        self.assertKind(FAILURE_RESOURCE, process_error(), dict(max_rss=2048), 1024)
+        self.assertKind(FAILURE_TRANSIENT, process_error(), dict(max_rss=512), 1024)
+    
+    def test_python_exceptions(self):
+        self.assertKind(FAILURE_RESOURCE, MemoryError())
+        self.assertKind(FAILURE_RESOURCE, OSError(ENOSPC, 'No space left on device'))
+        self.assertKind(FAILURE_DETERMINISTIC, OSError(ENOENT, 'No such file or directory', MOPO16S_PATH))
+        self.assertKind(FAILURE_TRANSIENT, OSError(ENOENT, 'No such file or directory', '/tmp/other'))
+        self.assertKind(FAILURE_DETERMINISTIC, KeyError('runs'))
+        self.assertKind(FAILURE_TRANSIENT, ConnectionError())
+
+
+class RetryPolicyTests(SimpleTestCase):
+    def test_deterministic_fails(self):
+        self.assertEqual('fail', retry_policy(FAILURE_DETERMINISTIC, 0, 8)['action'])
+    
+    def test_transient_retries_as_is(self):
+        self.assertEqual(dict(action='retry', countdown=MOPO16S_RETRY_DELAY, max_threads=None),
+                         retry_policy(FAILURE_TRANSIENT, 3, 8))
+    
+    def test_resource_backoff_and_downsize(self):
+        policies = [retry_policy(FAILURE_RESOURCE, retries, 8) for retries in range(20)]
+        countdowns = [policy['countdown'] for policy in policies]
+        self.assertEqual(MOPO16S_RETRY_DELAY * 2, countdowns[0])
+        self.assertEqual(sorted(countdowns), countdowns)
+        self.assertEqual(MOPO16S_RETRY_BACKOFF_MAX, countdowns[-1])
+        self.assertTrue(all(1 <= policy['max_threads'] < 8 for policy in policies))
+        self.assertEqual(1, retry_policy(FAILURE_RESOURCE, 0, 1)['max_threads'])
+        self.assertIsNone(retry_policy(FAILURE_RESOURCE, 0)['max_threads'])
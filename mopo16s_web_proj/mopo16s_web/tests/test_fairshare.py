@@ -0,0 +1,49 @@
+from unittest import mock
+
+from .redis_db import RedisTestCase
+from .. import allocator, fairshare
+from ..allocator import reserve_threads
+from ..fairshare import charge_usage, get_usages, get_penalties
+
+
+HALF_LIFE = 3600
+
+
+@mock.patch.object(fairshare, 'MOPO16S_FAIR_SHARE_HALF_LIFE', HALF_LIFE)
+@mock.patch.object(fairshare, 'MOPO16S_FAIR_SHARE_UNIT', 1)
+class FairShareTests(RedisTestCase):
+    modules = (allocator, fairshare)
+    
+    def at(self, timestamp):
+        return mock.patch.object(fairshare, 'time', return_value=timestamp)
+    
+    def test_charged(self):
+        with self.at(1000):
+            self.assertEqual(2, charge_usage(1, 2))
+            self.assertEqual(3, charge_usage(1, 1))
+            self.assertEqual({1: 3, 2: 0}, get_usages([1, 2, 1]))
+    
+    def test_decayed_with_half_life(self):
+        with self.at(1000):
+            charge_usage(1, 4)
+        with self.at(1000 + HALF_LIFE):
+            self.assertAlmostEqual(2, get_usages([1])[1])
+        with self.at(1000 + 2 * HALF_LIFE):
+            # decayed before adding the new usage
+            self.assertAlmostEqual(2, charge_usage(1, 1))
+    
+    def test_penalty_every_doubling(self):
+        with self.at(1000):
+            charge_usage(2, 1)
+            charge_usage(3, 3)
+            charge_usage(4, 100)
+            self.assertEqual({1: 0, 2: 1, 3: 2, 4: 6}, get_penalties([1, 2, 3, 4]))
+    
+    def test_running_threads_count(self):
+        reserve_threads('a', 3, 10, user_id=1, node='n1')
+        with self.at(1000):
+            self.assertEqual({1: 2, 2: 0}, get_penalties([1, 2]))
+    
+    def test_no_users(self):
+        self.assertEqual({}, get_usages([]))
+        self.assertEqual({}, get_penalties([]))
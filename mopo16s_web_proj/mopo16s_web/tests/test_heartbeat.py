@@ -0,0 +1,51 @@
+from time import sleep
+from unittest import mock
+from .redis_db import RedisTestCase
+from mopo16s_web_proj import celery
+from mopo16s_web_proj.celery import TaskHeartbeat, task_is_running, tasks_are_running, heartbeat_key, HEARTBEAT_TTL
+
+
+class TaskHeartbeatTests(RedisTestCase):
+    modules = (celery,)
+    
+    def test_running_inside_context(self):
+        with TaskHeartbeat('a'):
+            self.assertTrue(task_is_running('a'))
+            self.assertFalse(task_is_running('b'))
+        self.assertFalse(task_is_running('a'))
+    
+    def test_key_expires(self):
+        with TaskHeartbeat('a'):
+            self.assertLessEqual(0, self.redis.ttl(heartbeat_key('a')))
+            self.assertGreaterEqual(HEARTBEAT_TTL, self.redis.ttl(heartbeat_key('a')))
+    
+    def test_parents_kept_alive(self):
+        with TaskHeartbeat('shard', 'job'):
+            self.assertTrue(task_is_running('job'))
+        # the parent key is left to expire, another shard may still be running
+        self.assertTrue(task_is_running('job'))
+        self.assertFalse(task_is_running('shard'))
+    
+    def test_on_beat(self):
+        on_beat = mock.Mock()
+        with TaskHeartbeat('a', on_beat=on_beat):
+            on_beat.assert_called_once_with()
+    
+    def test_beats_after_a_failure(self):
+        on_beat = mock.Mock(side_effect=[None, ValueError('lease')] + [None] * 1000)
+        with mock.patch.object(celery, 'HEARTBEAT_INTERVAL', 0.01), \
+                self.assertLogs(celery.logger, 'WARNING'), TaskHeartbeat('a', on_beat=on_beat):
+            for _ in range(100):
+                if on_beat.call_count >= 3:
+                    break
+                sleep(0.01)
+        self.assertGreaterEqual(on_beat.call_count, 3)
+    
+    def test_no_task_id(self):
+        self.assertFalse(task_is_running(None))
+        self.assertFalse(task_is_running(''))
+    
+    def test_many_tasks(self):
+        self.assertEqual([], tasks_are_running([]))
+        with TaskHeartbeat('a'), TaskHeartbeat('c'):
+            self.assertEqual([True, False, True, False], tasks_are_running(['a', 'b', 'c', None]))
@@ -0,0 +1,25 @@
+from django.test import SimpleTestCase
+
+from ..utils import fit_memory_model
+
+
+class FitMemoryModelTests(SimpleTestCase):
+    def test_no_points(self):
+        self.assertIsNone(fit_memory_model([], 100))
+    
+    def test_single_thread_count_uses_the_default_slope(self):
+        self.assertEqual((800, 100), fit_memory_model([(2, 900), (2, 1000), (2, 950)], 100))
+    
+    def test_exact_line(self):
+        self.assertEqual((100, 50), fit_memory_model([(1, 150), (2, 200), (4, 300)], 10))
+    
+    def test_never_underestimates(self):
+        points = [(1, 150), (2, 260), (4, 300), (8, 520), (8, 480)]
+        base, per_thread = fit_memory_model(points, 10)
+        for threads, memory in points:
+            self.assertGreaterEqual(base + per_thread * threads, memory)
+    
+    def test_slope_not_negative(self):
+        base, per_thread = fit_memory_model([(1, 500), (8, 100)], 10)
+        self.assertEqual(0, per_thread)
+        self.assertEqual(500, base)
@@ -0,0 +1,78 @@
+from os import path
+from random import Random
+from tempfile import TemporaryDirectory
+from django.test import SimpleTestCase
+
+from ..utils import is_dominated, pareto_front, merge_mopo16s_outputs, read_mopo16s_output, write_mopo16s_output
+
+
+def naive_pareto_front(rows):
+    rows = list(dict(rows).items())
+    return [(primers, scores) for primers, scores in rows
+            if not any(is_dominated(scores, other_scores) for _, other_scores in rows)]
+
+
+def shard_front(rng, shard, size):
+    # non-dominated primer set pairs of a shard, scores on a noisy trade-off surface
+    rows = []
+    for i in range(size):
+        efficiency, coverage = rng.random(), rng.random()
+        rows.append(('F{}_{}\tx\tR{}_{}'.format(shard, i, shard, i),
+                     (efficiency, coverage, round((efficiency + coverage) / 2 + rng.random() * 0.05, 6))))
+    return naive_pareto_front(rows)
+
+
+class ParetoFrontTests(SimpleTestCase):
+    def test_same_as_naive(self):
+        rng = Random(0)
+        for trial in range(200):
+            # few distinct values, to have ties and equal scores
+            values = (0.1, 0.2, 0.3, 0.5) if trial % 2 else None
+            rows = [('p{}'.format(rng.randint(0, 40)),
+                     tuple(rng.choice(values) if values else rng.random() for _ in range(3)))
+                    for _ in range(rng.randint(0, 50))]
+            self.assertEqual(naive_pareto_front(rows), pareto_front(rows))
+    
+    def test_equal_scores_are_kept(self):
+        rows = [('a', (0.5, 0.5, 0.1)), ('b', (0.5, 0.5, 0.1)), ('c', (0.4, 0.5, 0.1))]
+        self.assertEqual(rows[:2], pareto_front(rows))
+    
+    def test_empty(self):
+        self.assertEqual([], pareto_front([]))
+
+
+class MergeOutputsTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.header = 'Efficiency\tCoverage\tMatchingBias'
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def write_shard(self, shard, rows):
+        file_path = path.join(self.tmp_dir.name, 'shard_{}_out'.format(shard))
+        write_mopo16s_output(file_path, self.header, rows)
+        return file_path
+    
+    def test_merged_shard_fronts_same_as_naive(self):
+        rng = Random(1)
+        fronts = [shard_front(rng, shard, 150) for shard in range(8)]
+        file_paths = [self.write_shard(shard, ((primers, '\t'.join(repr(score) for score in scores))
+                                               for primers, scores in front))
+                      for shard, front in enumerate(fronts)]
+        merged_file_path = path.join(self.tmp_dir.name, 'merged_out')
+        merge_mopo16s_outputs(file_paths, merged_file_path)
+        
+        header, merged = read_mopo16s_output(merged_file_path)
+        self.assertEqual(self.header, header)
+        expected = naive_pareto_front(row for front in fronts for row in front)
+        self.assertEqual(expected, [(primers, scores) for primers, _, scores in merged])
+    
+    def test_scores_lines_are_kept(self):
+        file_paths = [self.write_shard(0, [('a\tx\tb', '0.90\t0.80\t1e-05'), ('c\tx\td', '0.5\t0.5\t0.5')]),
+                      self.write_shard(1, [('e\tx\tf', '0.950\t0.1\t0.2')])]
+        merged_file_path = path.join(self.tmp_dir.name, 'merged_out')
+        merge_mopo16s_outputs(file_paths, merged_file_path)
+        _, merged = read_mopo16s_output(merged_file_path)
+        self.assertEqual([('a\tx\tb', '0.90\t0.80\t1e-05'), ('e\tx\tf', '0.950\t0.1\t0.2')],
+                         [row[:2] for row in merged])
@@ -0,0 +1,61 @@
+from .redis_db import RedisTestCase
+from .. import allocator, nodes
+from ..allocator import reserve_threads
+from ..nodes import register_node, unregister_node, get_live_nodes, get_nodes_load, pick_node, \
+    get_max_threads_per_instance, get_task_queue, node_queue, ROUTED_TASKS_KEY, MOPO16S_QUEUE
+
+
+def capacity(max_threads, scratch_free=10 ** 12, max_threads_per_instance=None):
+    return dict(cores=max_threads, max_threads=max_threads,
+                max_threads_per_instance=max_threads_per_instance or max_threads, memory_budget=0,
+                scratch_free=scratch_free)
+
+
+class NodesTests(RedisTestCase):
+    modules = (allocator, nodes)
+    
+    def test_registered(self):
+        register_node('n1', capacity(8))
+        register_node('n2', capacity(4))
+        self.assertEqual(dict(n1=capacity(8), n2=capacity(4)), get_live_nodes())
+        unregister_node('n1')
+        self.assertEqual(['n2'], list(get_live_nodes()))
+    
+    def test_expired(self):
+        register_node('n1', capacity(8))
+        self.assertEqual({}, get_live_nodes(ttl=-1))
+    
+    def test_load(self):
+        register_node('n1', capacity(8))
+        reserve_threads('a', 2, 8, node='n1')
+        load = get_nodes_load()['n1']
+        self.assertEqual((2, 6, 0.25), (load['threads_used'], load['threads_free'], load['load']))
+    
+    def test_least_loaded_picked(self):
+        register_node('n1', capacity(8))
+        register_node('n2', capacity(4))
+        reserve_threads('a', 4, 8, node='n1')
+        reserve_threads('b', 1, 4, node='n2')
+        self.assertEqual('n2', pick_node())
+        self.assertEqual('n1', pick_node(exclude=('n2',)))
+        reserve_threads('c', 4, 8, node='n1')
+        self.assertIsNone(pick_node(exclude=('n2',)))
+    
+    def test_equally_loaded_most_free_picked(self):
+        register_node('n1', capacity(4))
+        register_node('n2', capacity(8))
+        self.assertEqual('n2', pick_node())
+    
+    def test_scratch_full_not_picked(self):
+        register_node('n1', capacity(8, scratch_free=0))
+        self.assertIsNone(pick_node(min_scratch_free=1))
+    
+    def test_max_threads_per_instance(self):
+        register_node('n1', capacity(8, max_threads_per_instance=2))
+        register_node('n2', capacity(4))
+        self.assertEqual(4, get_max_threads_per_instance())
+    
+    def test_task_queue(self):
+        self.redis.hset(ROUTED_TASKS_KEY, 'a', 'n1')
+        self.assertEqual(node_queue('n1'), get_task_queue('a'))
+        self.assertEqual(MOPO16S_QUEUE, get_task_queue('b'))
@@ -0,0 +1,97 @@
+from json import dumps, loads
+from unittest import mock
+
+import mopo16s_web_proj.celery as project_celery
+from mopo16s_web_proj.celery import index_pending_task, move_pending_task, unindex_pending_tasks, \
+    get_pending_tasks_ids, get_queue_position, priority_queue_key
+from .redis_db import RedisTestCase
+
+
+QUEUE = 'queue_mopo16s'
+
+
+class PendingIndexTests(RedisTestCase):
+    modules = (project_celery,)
+    
+    def publish(self, task_id, priority=0, index=True):
+        # as kombu: pushed on the left of the list of the priority, consumed from the right
+        self.redis.lpush(priority_queue_key(QUEUE, priority), dumps(dict(headers=dict(id=task_id))))
+        if index:
+            index_pending_task(task_id, priority)
+    
+    def consume(self, priority):
+        message = self.redis.rpop(priority_queue_key(QUEUE, priority))
+        return loads(message)['headers']['id'] if message else None
+    
+    def test_priority_then_enqueue_order(self):
+        self.publish('a', 5)
+        self.publish('b', 5)
+        self.publish('c', 0)
+        self.assertEqual(['c', 'a', 'b'], get_pending_tasks_ids())
+        self.assertEqual((2, 3), get_queue_position('a', QUEUE))
+    
+    def test_unindexed(self):
+        self.publish('a', 5)
+        self.publish('b', 5)
+        unindex_pending_tasks('a')
+        self.assertIsNone(get_queue_position('a', QUEUE))
+        self.assertEqual((2, 2), get_queue_position('b', QUEUE))
+    
+    def test_position_among_the_messages_of_the_queue(self):
+        self.publish('a', 5)
+        # shards are not in the index, but wait in the same lists
+        self.publish('shard', 0, index=False)
+        self.publish('b', 5)
+        # routed to the queue of a node
+        self.redis.lpush(priority_queue_key(QUEUE + '.n1', 0), dumps(dict(headers=dict(id='c'))))
+        index_pending_task('c', 0)
+        self.assertEqual((3, 3), get_queue_position('b', QUEUE))
+        self.assertEqual((1, 1), get_queue_position('c', QUEUE + '.n1'))
+    
+    def test_delayed_not_in_queue(self):
+        # a retry with a countdown is indexed, but held by a worker until its eta
+        index_pending_task('a', 0)
+        self.publish('b', 0)
+        self.assertIsNone(get_queue_position('a', QUEUE))
+        self.assertEqual((1, 1), get_queue_position('b', QUEUE))
+    
+    def test_move(self):
+        self.publish('a', 5)
+        self.publish('b', 5)
+        self.publish('c', 0)
+        self.assertTrue(move_pending_task('b', QUEUE, 0))
+        # behind the tasks already waiting at the new priority, as in the broker
+        self.assertEqual(['c', 'b', 'a'], get_pending_tasks_ids())
+        self.assertEqual(['c', 'b', None], [self.consume(0) for _ in range(3)])
+        self.assertEqual(['a', None], [self.consume(5) for _ in range(2)])
+    
+    def test_move_to_lower_priority(self):
+        self.publish('a', 0)
+        self.publish('b', 0)
+        self.publish('c', 9)
+        self.assertTrue(move_pending_task('a', QUEUE, 9))
+        self.assertEqual(['b', 'c', 'a'], get_pending_tasks_ids())
+        self.assertEqual(['c', 'a'], [self.consume(9) for _ in range(2)])
+    
+    def test_not_moved(self):
+        self.publish('a', 5)
+        # same priority
+        self.assertFalse(move_pending_task('a', QUEUE, 5))
+        # not waiting
+        self.assertFalse(move_pending_task('b', QUEUE, 0))
+        # indexed, but its message is gone
+        index_pending_task('c', 5)
+        self.assertFalse(move_pending_task('c', QUEUE, 0))
+        self.assertEqual(['a', 'c'], get_pending_tasks_ids())
+    
+    def test_found_outside_the_expected_window(self):
+        self.publish('a', 5)
+        # messages not in the index (e.g. of shards) shift it away from its expected position
+        for i in range(10):
+            self.publish('shard_{}'.format(i), 5, index=False)
+        self.publish('b', 5)
+        with mock.patch.object(project_celery, 'MOVE_SEARCH_WINDOW', 1):
+            self.assertTrue(move_pending_task('b', QUEUE, 0))
+            self.assertTrue(move_pending_task('a', QUEUE, 0))
+        self.assertEqual(['b', 'a'], [self.consume(0) for _ in range(2)])
+        self.assertEqual(10, self.redis.llen(priority_queue_key(QUEUE, 5)))
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from .redis_db import RedisTestCase
+from .. import progress
+from ..progress import ProgressReporter, get_progress, get_progresses, delete_progress, progress_key
+
+
+def job(job_id=1, runs=10):
+    return SimpleNamespace(id=job_id, mopo16s_parameters=dict(runs=runs))
+
+
+class ProgressReporterTests(RedisTestCase):
+    modules = (progress,)
+    
+    def test_lines_parsed(self):
+        reporter = ProgressReporter(job())
+        for line in ('Restart 1 done', 'Restart 2 completed', 'Run 1 finished', 'nothing to see',
+                     '0.5\t0.9\t0.2', '0.7\t0.8\t0.3', '0.6\t0.95\t0.1'):
+            reporter.parse_line(line)
+        self.assertEqual(1, reporter.runs_done)
+        self.assertEqual(2, reporter.restarts_done)
+        self.assertEqual(dict(efficiency=0.7, coverage=0.95, matching_bias=0.1), reporter.best)
+    
+    def test_chunks_split_anywhere(self):
+        reporter = ProgressReporter(job())
+        with mock.patch.object(progress, 'MOPO16S_PROGRESS_INTERVAL', 3600):
+            for chunk in (b'Run 1 do', b'ne\nRun 2 done\nRun', b' 3 done'):
+                reporter.feed(chunk)
+        # the last line is complete only when its newline arrives
+        self.assertEqual(2, reporter.runs_done)
+    
+    def test_published_at_most_once_per_interval(self):
+        reporter = ProgressReporter(job())
+        with mock.patch.object(progress, 'MOPO16S_PROGRESS_INTERVAL', 3600):
+            reporter.feed(b'Run 1 done\n')
+            reporter.feed(b'Run 2 done\n')
+        self.assertEqual(1, get_progress(1)['runs_done'])
+        reporter.publish()
+        self.assertEqual(2, get_progress(1)['runs_done'])
+    
+    def test_shards_merged(self):
+        first, second = ProgressReporter(job(runs=20), 0), ProgressReporter(job(runs=20), 1)
+        for line in ('Run 1 done', 'Run 2 done', '0.5\t0.9\t0.2'):
+            first.parse_line(line)
+        for line in ('Run 11 done', 'Restart 1 done', '0.7\t0.8\t0.3'):
+            second.parse_line(line)
+        first.publish()
+        second.publish()
+        snapshot = get_progress(1)
+        self.assertEqual(20, snapshot['runs'])
+        self.assertEqual(3, snapshot['runs_done'])
+        self.assertEqual(1, snapshot['restarts_done'])
+        self.assertEqual(dict(efficiency=0.7, coverage=0.9, matching_bias=0.2), snapshot['best'])
+        self.assertEqual({'0', '1'}, set(snapshot['shards']))
+        self.assertLessEqual(0, self.redis.ttl(progress_key(1)))
+    
+    def test_many_jobs(self):
+        ProgressReporter(job(1)).publish()
+        ProgressReporter(job(3)).publish()
+        self.assertEqual({}, get_progresses([]))
+        self.assertEqual({1, 3}, set(get_progresses([1, 2, 3])))
+        delete_progress(1)
+        self.assertIsNone(get_progress(1))
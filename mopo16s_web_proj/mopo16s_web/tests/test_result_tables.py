@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+
+from mopo16s_web_proj.settings import RESULT_TABLES_VERSION, RESULT_TABLES_TTL
+from .redis_db import RedisTestCase
+from .. import result_tables
+from ..result_tables import get_result_tables, render_result_tables, result_tables_key, result_tables_etag
+
+
+class FakeResult:
+    # counts the renderings, as the Styler of Result.get_html_tables
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.rendered = 0
+    
+    def get_html_tables(self):
+        self.rendered += 1
+        return '<table>init {}</table>'.format(self.rendered), '<table>out {}</table>'.format(self.rendered)
+    
+    def get_matrices(self):
+        return dict(init=[], out=[])
+
+
+class ResultTablesTests(RedisTestCase):
+    modules = (result_tables,)
+    
+    def test_rendered_once(self):
+        result = FakeResult(1)
+        render_result_tables(result)
+        tables = get_result_tables(result)
+        self.assertEqual(1, result.rendered)
+        self.assertEqual(dict(init='<table>init 1</table>', out='<table>out 1</table>',
+                              matrices='{"init": [], "out": []}'), tables)
+        self.assertAlmostEqual(RESULT_TABLES_TTL, self.redis.ttl(result_tables_key(1)), delta=5)
+    
+    def test_rendered_on_miss(self):
+        result = FakeResult(1)
+        get_result_tables(result)
+        get_result_tables(result)
+        self.assertEqual(1, result.rendered)
+    
+    def test_other_version_not_served(self):
+        self.redis.hset(result_tables_key(1, RESULT_TABLES_VERSION - 1), mapping=dict(init='old', out='old',
+                                                                                       matrices='{}'))
+        result = FakeResult(1)
+        self.assertEqual('<table>init 1</table>', get_result_tables(result)['init'])
+    
+    def test_incomplete_rendered_again(self):
+        self.redis.hset(result_tables_key(1), 'init', 'partial')
+        result = FakeResult(1)
+        self.assertEqual('<table>out 1</table>', get_result_tables(result)['out'])
+        self.assertEqual(1, result.rendered)
+    
+    def test_etag(self):
+        date_completed = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(result_tables_etag(1, date_completed), result_tables_etag(1, date_completed))
+        self.assertNotEqual(result_tables_etag(1, date_completed), result_tables_etag(2, date_completed))
+        self.assertNotEqual(result_tables_etag(1, date_completed),
+                            result_tables_etag(1, date_completed, RESULT_TABLES_VERSION + 1))
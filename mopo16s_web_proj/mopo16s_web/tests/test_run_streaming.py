@@ -0,0 +1,133 @@
+import subprocess
+import sys
+from time import monotonic, sleep
+from io import BytesIO
+from types import SimpleNamespace
+from os import path
+from tempfile import TemporaryDirectory
+from django.test import SimpleTestCase
+
+from ..utils import OutputExcerpt, run_streaming, rusage_to_dict, ProcessCancelledError
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+def is_alive(pid):
+    # a killed process whose parent is gone could still be a zombie, waiting for init to reap it
+    try:
+        with open('/proc/{}/stat'.format(pid)) as file:
+            return file.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class OutputExcerptTests(SimpleTestCase):
+    def write(self, excerpt_size, *chunks):
+        file = BytesIO()
+        excerpt = OutputExcerpt(file, excerpt_size)
+        for chunk in chunks:
+            excerpt.write(chunk)
+        return file.getvalue(), str(excerpt)
+    
+    def test_short_stream_whole(self):
+        for chunks in ((b'abcdef',), (b'ab', b'cd', b'ef'), (b'abcdef', b'')):
+            self.assertEqual((b'abcdef', 'abcdef'), self.write(3, *chunks))
+        self.assertEqual((b'abcd', 'abcd'), self.write(3, b'a', b'bcd'))
+    
+    def test_long_stream_head_and_tail(self):
+        data, excerpt = self.write(3, b'abcd', b'efg', b'hij')
+        self.assertEqual(b'abcdefghij', data)
+        self.assertEqual('abc\n[... 4 bytes omitted ...]\nhij', excerpt)
+    
+    def test_split_characters_replaced(self):
+        data, excerpt = self.write(2, 'àbcdè'.encode())
+        self.assertEqual('àbcdè'.encode(), data)
+        self.assertTrue(excerpt.startswith('à'))
+
+
+class RunStreamingTests(SimpleTestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.stdout_path, self.stderr_path = path.join(tmp.name, 'stdout'), path.join(tmp.name, 'stderr')
+    
+    def read(self, file_path):
+        with open(file_path, 'rb') as file:
+            return file.read()
+    
+    def test_outputs_streamed_to_files(self):
+        chunks = []
+        p = run_streaming(python('import sys\nfor i in range(20000): print(i)\nsys.stderr.write("x" * 100000)'),
+                          self.stdout_path, self.stderr_path, 16, chunk_size=1024, on_stdout=chunks.append)
+        stdout = ''.join('{}\n'.format(i) for i in range(20000)).encode()
+        self.assertEqual(stdout, self.read(self.stdout_path))
+        self.assertEqual(stdout, b''.join(chunks))
+        self.assertEqual(b'x' * 100000, self.read(self.stderr_path))
+        self.assertEqual(0, p.returncode)
+        self.assertTrue(p.stdout.startswith('0\n1\n2\n'))
+        self.assertTrue(p.stdout.endswith('19999\n'))
+        self.assertIn('bytes omitted', p.stderr)
+    
+    def test_failure_raised_with_excerpts(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            run_streaming(python('import sys\nprint("out")\nsys.stderr.write("err")\nsys.exit(3)'),
+                          self.stdout_path, self.stderr_path, 1024)
+        self.assertEqual(3, cm.exception.returncode)
+        self.assertEqual('out\n', cm.exception.stdout)
+        self.assertEqual('err', cm.exception.stderr)
+    
+    def test_resources_passed_on_exit(self):
+        resources = []
+        run_streaming(python('bytearray(50 * 1024 * 1024)'), self.stdout_path, self.stderr_path, 16,
+                      on_exit=resources.append)
+        self.assertEqual(1, len(resources))
+        self.assertGreater(resources[0]['wall_time'], 0)
+        self.assertGreater(resources[0]['max_rss'], 50 * 1024 * 1024)
+    
+    def test_resources_passed_on_failure(self):
+        resources = []
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_streaming(python('raise SystemExit(1)'), self.stdout_path, self.stderr_path, 16,
+                          on_exit=resources.append)
+        self.assertEqual(1, len(resources))
+
+    
+    def test_cancelled_terminated(self):
+        started = monotonic()
+        with self.assertRaises(ProcessCancelledError):
+            run_streaming(python('import time\ntime.sleep(60)'), self.stdout_path, self.stderr_path, 16,
+                          is_cancelled=lambda: True, kill_timeout=30)
+        # stopped by SIGTERM, without waiting for the kill timeout
+        self.assertLess(monotonic() - started, 10)
+    
+    def test_cancelled_kills_the_process_group(self):
+        # the child ignores SIGTERM and writes its pid, the parent waits for it
+        child = 'import signal, time\nsignal.signal(signal.SIGTERM, signal.SIG_IGN)\ntime.sleep(60)'
+        code = 'import subprocess, sys\np = subprocess.Popen([sys.executable, "-c", {!r}])\n' \
+               'print(p.pid, flush=True)\np.wait()'.format(child)
+        pids = []
+        started = monotonic()
+        with self.assertRaises(ProcessCancelledError):
+            run_streaming(python(code), self.stdout_path, self.stderr_path, 16,
+                          on_stdout=lambda data: pids.extend(int(pid) for pid in data.split()),
+                          is_cancelled=lambda: bool(pids), kill_timeout=1)
+        self.assertLess(monotonic() - started, 30)
+        self.assertEqual(1, len(pids))
+        # killed with SIGKILL after the timeout, together with its parent
+        for _ in range(50):
+            if not is_alive(pids[0]):
+                break
+            sleep(0.1)
+        else:
+            self.fail('child process still alive')
+
+
+class RusageToDictTests(SimpleTestCase):
+    def test_units(self):
+        rusage = SimpleNamespace(ru_utime=1.23456, ru_stime=0.5, ru_maxrss=2048, ru_inblock=1, ru_oublock=2,
+                                 ru_majflt=3, ru_nvcsw=4, ru_nivcsw=5)
+        self.assertEqual(dict(wall_time=2.346, user_time=1.235, system_time=0.5, max_rss=2 * 1024 * 1024,
+                              block_in=1, block_out=2, major_faults=3, voluntary_switches=4, involuntary_switches=5),
+                         rusage_to_dict(rusage, 2.3456))
@@ -0,0 +1,36 @@
+from random import Random
+from django.test import SimpleTestCase
+
+from ..runtime import runtime_features, fit_runtime_model, predict_runtime, runtime_priority, RUNTIME_MIN_SAMPLES, \
+    PRIORITY_HIGHEST, PRIORITY_LOWEST, PRIORITY_UNKNOWN
+
+
+class RuntimeModelTests(SimpleTestCase):
+    def samples(self, count):
+        # runtime = 0.01 * sequences * runs * restarts + 1 / threads
+        rng = Random(0)
+        for _ in range(count):
+            sequences, runs = rng.randint(10, 5000), rng.randint(1, 50)
+            restarts, threads = rng.randint(0, 40), rng.randint(1, 16)
+            features = runtime_features(sequences, sequences * 1500, runs, restarts, 18, 22, threads)
+            yield features, 0.01 * sequences * runs * (restarts + 1) / threads
+    
+    def test_not_enough_samples(self):
+        self.assertIsNone(fit_runtime_model(self.samples(RUNTIME_MIN_SAMPLES - 1)))
+        # not positive runtimes are not samples
+        self.assertIsNone(fit_runtime_model([(features, 0) for features, _ in self.samples(RUNTIME_MIN_SAMPLES)]))
+    
+    def test_power_law_recovered(self):
+        coefficients = fit_runtime_model(self.samples(200))
+        features = runtime_features(1000, 1500000, 10, 19, 18, 22, 4)
+        self.assertAlmostEqual(0.01 * 1000 * 10 * 20 / 4, predict_runtime(coefficients, features), delta=1)
+
+
+class RuntimePriorityTests(SimpleTestCase):
+    def test_unknown(self):
+        self.assertEqual(PRIORITY_UNKNOWN, runtime_priority(None))
+    
+    def test_one_level_every_doubling(self):
+        self.assertEqual(PRIORITY_HIGHEST, runtime_priority(59))
+        self.assertEqual([1, 1, 2, 3, 4], [runtime_priority(60 * minutes) for minutes in (1, 1.9, 2, 4, 8)])
+        self.assertEqual(PRIORITY_LOWEST, runtime_priority(60 * 60 * 24 * 365))
@@ -0,0 +1,32 @@
+from django.test import SimpleTestCase
+
+from ..utils import split_runs, derive_seed
+
+
+class SplitRunsTests(SimpleTestCase):
+    def test_disjoint_ranges_covering_all_runs(self):
+        for runs in range(0, 30):
+            for shards in range(1, 8):
+                ranges = split_runs(runs, shards)
+                self.assertEqual(shards, len(ranges))
+                self.assertEqual(list(range(runs)), [run for start, stop in ranges for run in range(start, stop)])
+                sizes = [stop - start for start, stop in ranges]
+                self.assertLessEqual(max(sizes) - min(sizes), 1)
+    
+    def test_larger_shards_first(self):
+        self.assertEqual([(0, 4), (4, 7), (7, 10)], split_runs(10, 3))
+
+
+class DeriveSeedTests(SimpleTestCase):
+    def test_first_shard_keeps_the_seed(self):
+        self.assertEqual(42, derive_seed(42, 0))
+    
+    def test_distinct_and_stable(self):
+        seeds = [derive_seed(42, shard) for shard in range(100)]
+        self.assertEqual(len(seeds), len(set(seeds)))
+        self.assertEqual(seeds, [derive_seed(42, shard) for shard in range(100)])
+        self.assertNotEqual(derive_seed(42, 1), derive_seed(43, 1))
+    
+    def test_positive_32_bit_int(self):
+        for shard in range(1, 100):
+            self.assertTrue(0 <= derive_seed(7, shard) < 1 << 31)
@@ -0,0 +1,89 @@
+from hashlib import sha256
+from os import path, utime, listdir
+from tempfile import TemporaryDirectory
+from django.test import SimpleTestCase
+
+from ..staging import StagingCache, StagingVerificationError
+
+
+def writer(content, calls=None):
+    def write(file):
+        if calls is not None:
+            calls.append(content)
+        file.write(content)
+    return write
+
+
+class StagingCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.staging = StagingCache(root=self.tmp_dir.name, budget=10, verify_hits=False)
+    
+    def stage(self, content, calls=None, staging=None):
+        staging = staging or self.staging
+        with staging.stage('sha256', sha256(content).hexdigest(), writer(content, calls)) as file_path:
+            with open(file_path, 'rb') as file:
+                self.assertEqual(content, file.read())
+            return file_path
+    
+    def staged_files(self):
+        return sorted(name for directory in listdir(self.tmp_dir.name)
+                      for name in listdir(path.join(self.tmp_dir.name, directory)))
+    
+    def test_written_only_on_miss(self):
+        calls = []
+        first_path = self.stage(b'ACGT', calls)
+        self.assertEqual(first_path, self.stage(b'ACGT', calls))
+        self.assertEqual([b'ACGT'], calls)
+    
+    def test_content_not_matching_digest(self):
+        with self.assertRaises(StagingVerificationError):
+            with self.staging.stage('sha256', sha256(b'ACGT').hexdigest(), writer(b'TGCA')):
+                pass
+        # neither the file nor its temporary file are left
+        self.assertEqual([], self.staged_files())
+    
+    def test_corrupted_hit(self):
+        file_path = self.stage(b'ACGT')
+        with open(file_path, 'wb') as file:
+            file.write(b'TGCA')
+        # trusted if hits are not verified
+        with self.staging.stage('sha256', sha256(b'ACGT').hexdigest(), writer(b'ACGT')):
+            pass
+        staging = StagingCache(root=self.tmp_dir.name, budget=10, verify_hits=True)
+        with self.assertRaises(StagingVerificationError):
+            with staging.stage('sha256', sha256(b'ACGT').hexdigest(), writer(b'ACGT')):
+                pass
+        self.assertFalse(path.exists(file_path))
+        # staged again at the next request
+        self.stage(b'ACGT', staging=staging)
+    
+    def test_least_recently_used_evicted(self):
+        old_path = self.stage(b'AAAAAA')
+        utime(old_path, (0, 0))
+        new_path = self.stage(b'CCCCCC')
+        self.assertFalse(path.exists(old_path))
+        self.assertTrue(path.exists(new_path))
+    
+    def test_hit_refreshes(self):
+        first_path = self.stage(b'AAAA')
+        second_path = self.stage(b'CCCC')
+        utime(first_path, (0, 0))
+        utime(second_path, (1, 1))
+        # the hit makes the first file the most recently used
+        self.stage(b'AAAA')
+        third_path = self.stage(b'GGGG')
+        self.assertTrue(path.exists(first_path))
+        self.assertFalse(path.exists(second_path))
+        self.assertTrue(path.exists(third_path))
+    
+    def test_file_in_use_not_evicted(self):
+        with self.staging.stage('sha256', sha256(b'AAAAAA').hexdigest(), writer(b'AAAAAA')) as used_path:
+            utime(used_path, (0, 0))
+            new_path = self.stage(b'CCCCCC')
+            self.assertTrue(path.exists(used_path))
+            self.assertTrue(path.exists(new_path))
+        # evicted once released
+        self.assertEqual(6, self.staging.evict())
+        self.assertFalse(path.exists(used_path))
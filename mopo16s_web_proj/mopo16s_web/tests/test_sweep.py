@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+
+from mopo16s_web_proj.settings import MOPO16S_PARAMETERS
+from ..utils import parse_sweep, sweep_grid
+
+
+class ParseSweepTests(SimpleTestCase):
+    def test_values_and_ranges(self):
+        sweep = parse_sweep('maxMismatches=0:3; minTm=50,52,55\nminGCCont=0.4:0.6:0.1', MOPO16S_PARAMETERS)
+        self.assertEqual({'maxMismatches': [0, 1, 2, 3], 'minTm': [50, 52, 55], 'minGCCont': [0.4, 0.5, 0.6]}, sweep)
+    
+    def test_float_steps_are_not_accumulated(self):
+        self.assertEqual([0.1, 0.2, 0.3], parse_sweep('minGCCont=0.1:0.3:0.1', MOPO16S_PARAMETERS)['minGCCont'])
+    
+    def test_duplicates_removed_in_order(self):
+        self.assertEqual([3, 1, 2], parse_sweep('maxMismatches=3,1:3', MOPO16S_PARAMETERS)['maxMismatches'])
+    
+    def test_empty_entries_ignored(self):
+        self.assertEqual({'minTm': [50]}, parse_sweep(';\n minTm = 50 ;;', MOPO16S_PARAMETERS))
+    
+    def test_invalid(self):
+        for text in ('unknown=1', 'minTm', 'minTm=50; minTm=52', 'minTm=fifty', 'minTm=50:60:0', 'minTm=50:55:1:2',
+                     'maxMismatches=-1', 'verbose=0:4'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                parse_sweep(text, MOPO16S_PARAMETERS)
+
+
+class SweepGridTests(SimpleTestCase):
+    def test_every_combination(self):
+        grid = sweep_grid({'minTm': [50, 52], 'maxMismatches': [0, 1, 2]}, base={'runs': 20, 'minTm': 40})
+        self.assertEqual(6, len(grid))
+        self.assertEqual({'runs': 20, 'minTm': 50, 'maxMismatches': 0}, grid[0])
+        self.assertEqual({(50, 0), (50, 1), (50, 2), (52, 0), (52, 1), (52, 2)},
+                         set((combination['minTm'], combination['maxMismatches']) for combination in grid))
+    
+    def test_bounds(self):
+        grid = sweep_grid({'minPrimerLen': [17, 19, 21]}, base={'maxPrimerLen': 19},
+                          bounds=(('minPrimerLen', 'maxPrimerLen'), ('minGCCont', 'maxGCCont')))
+        self.assertEqual([17, 19], [combination['minPrimerLen'] for combination in grid])
+    
+    def test_empty_sweep(self):
+        self.assertEqual([{'runs': 20}], sweep_grid({}, base={'runs': 20}))
@@ -1,6 +1,19 @@
 from Bio.SeqIO import parse as fasta_parse
 from io import StringIO, TextIOWrapper
 from django.forms import ValidationError
+from hashlib import sha256, new as new_hash
+from os import read, set_blocking, wait4, WIFSIGNALED, WTERMSIG, WEXITSTATUS, mkdir, rmdir, path, killpg, replace, \
+    sched_getaffinity, sched_setaffinity
+from glob import glob
+from signal import SIGTERM, SIGKILL
+from time import monotonic, sleep
+from itertools import product
+from json import dumps, loads
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+import selectors
+import subprocess
+import numpy as np
+from mopo16s_web_proj.caches import cached_string
 
 
 def dummy_callback(_):
@@ -28,3 +41,518 @@ def validate_fasta_str(text, *args, **kwargs):
 
 def validate_fasta_file(text, *args, **kwargs):
     return validate_fasta(TextIOWrapper(text), *args, **kwargs)
+
+
+def file_digest(file_path, algorithm='sha256', chunk_size=1 << 20):
+    digest = new_hash(algorithm)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# uploaded files are never modified, and their names are unique, so the digest can be cached by path
+@cached_string('file.sha256', 30 * 24 * 60 * 60, encoder=None, decoder=None)
+def file_sha256(file_path, chunk_size=1 << 20):
+    return file_digest(file_path, 'sha256', chunk_size)
+
+
+def split_runs(runs, shards):
+    """
+    Split the runs of a job into disjoint ranges, one for each shard
+    :return: list of tuples (first run, last run + 1), sizes differ at most by one
+    """
+    ranges = []
+    start = 0
+    for shard in range(shards):
+        stop = start + runs // shards + (shard < runs % shards)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def _parse_sweep_values(text, value_type):
+    # comma separated values, each one can be an inclusive range 'start:stop' or 'start:stop:step'
+    values = []
+    for item in text.split(','):
+        bounds = [value_type(bound) for bound in item.split(':')]
+        if len(bounds) == 1:
+            values.append(bounds[0])
+            continue
+        if len(bounds) > 3:
+            raise ValueError("invalid range '{}'".format(item.strip()))
+        start, stop, step = bounds[0], bounds[1], bounds[2] if len(bounds) == 3 else value_type(1)
+        if step <= 0:
+            raise ValueError("step of range '{}' must be positive".format(item.strip()))
+        # floats are computed from the start, not accumulated, and rounded to avoid 0.30000000000000004
+        count = int(round((stop - start) / step, 9)) + 1
+        values.extend(value_type(round(start + i * step, 9)) for i in range(max(count, 0)))
+    return values
+
+
+def parse_sweep(text, parameters):
+    """
+    Parse a parameter sweep, e.g. 'maxMismatches=0:3; minTm=50,52,55; minGCCont=0.4:0.6:0.1'
+    (one parameter per line or separated by ';', ranges are inclusive, a single value fixes the parameter)
+    :param parameters: dict parameter name -> details (type, min, max), see settings.MOPO16S_PARAMETERS
+    :return: dict parameter name -> list of distinct values, in order
+    Raises ValueError if the text is not valid.
+    """
+    sweep = {}
+    for entry in text.replace('\n', ';').split(';'):
+        if not entry.strip():
+            continue
+        name, separator, values = entry.partition('=')
+        name = name.strip()
+        if not separator or name not in parameters:
+            raise ValueError("unknown parameter '{}'".format(name))
+        if name in sweep:
+            raise ValueError("parameter '{}' is repeated".format(name))
+        details = parameters[name]
+        try:
+            values = _parse_sweep_values(values, details['type'])
+        except ValueError as exc:
+            raise ValueError("invalid values of '{}': {}".format(name, exc))
+        for value in values:
+            if value < details.get('min', value) or value > details.get('max', value):
+                raise ValueError("value {} of '{}' is out of range".format(value, name))
+        sweep[name] = list(dict.fromkeys(values))
+    return sweep
+
+
+def sweep_grid(sweep, base=None, bounds=()):
+    """
+    Every combination of the values of a sweep
+    :param base: dict of the parameters shared by every combination, overridden by the sweep
+    :param bounds: pairs of parameter names (low, high), combinations with low greater than high are skipped
+    :return: list of dicts parameter name -> value
+    """
+    names = list(sweep.keys())
+    grid = (dict(base or {}, **dict(zip(names, values))) for values in product(*(sweep[name] for name in names)))
+    return [combination for combination in grid
+            if all(combination[low] <= combination[high] for low, high in bounds
+                   if low in combination and high in combination)]
+
+
+def derive_seed(seed, shard):
+    # the first shard keeps the job seed, so a single shard job is identical to a not sharded one
+    if shard == 0:
+        return seed
+    return int.from_bytes(sha256('{}:{}'.format(seed, shard).encode()).digest()[:4], 'big') >> 1
+
+
+def fit_memory_model(points, default_per_thread):
+    """
+    Fit of memory = base + per_thread * threads: the slope is the least squares one (not negative),
+    the line is then raised so that it does not underestimate any point
+    :param points: iterable of tuples (threads, peak memory), the maximum peak is taken for every thread count
+    :param default_per_thread: slope used when all the points have the same thread count
+    :return: tuple (base, per_thread), None if there are no points
+    """
+    peaks = {}
+    for threads, memory in points:
+        peaks[threads] = max(memory, peaks.get(threads, 0))
+    if not peaks:
+        return None
+    per_thread = default_per_thread
+    if len(peaks) > 1:
+        mean_threads = sum(peaks) / len(peaks)
+        mean_memory = sum(peaks.values()) / len(peaks)
+        per_thread = max(0, sum((threads - mean_threads) * (memory - mean_memory) for threads, memory in peaks.items())
+                         / sum((threads - mean_threads) ** 2 for threads in peaks))
+    base = max(0, max(memory - per_thread * threads for threads, memory in peaks.items()))
+    return base, per_thread
+
+
+def is_dominated(scores, other):
+    # efficiency and coverage are maximized, matching-bias is minimized
+    return other[0] >= scores[0] and other[1] >= scores[1] and other[2] <= scores[2] and other != scores
+
+
+def pareto_front(rows):
+    """
+    Non-dominated subset of the rows, duplicates are removed and the order is preserved
+    :param rows: iterable of tuples (primer set pair line, (efficiency, coverage, matching-bias))
+    :return: list of tuples, same as rows
+    """
+    rows = list(dict(rows).items())
+    if not rows:
+        return []
+    scores = np.array([row_scores for _, row_scores in rows], dtype=np.float64).reshape(-1, 3)
+    # sorted by efficiency and coverage descending, then matching-bias ascending, a row can be dominated only by the
+    # rows before it, and only by the non-dominated ones (dominance is transitive): the sweep compares every row with
+    # the front found so far
+    order = np.lexsort((scores[:, 2], -scores[:, 1], -scores[:, 0]))
+    front = np.empty_like(scores)
+    size = 0
+    keep = np.zeros(len(rows), dtype=bool)
+    for i in order.tolist():
+        efficiency, coverage, matching_bias = scores[i]
+        others = front[:size]
+        if not np.any((others[:, 1] >= coverage) & (others[:, 2] <= matching_bias)
+                      & ((others[:, 0] > efficiency) | (others[:, 1] > coverage) | (others[:, 2] < matching_bias))):
+            keep[i] = True
+            front[size] = scores[i]
+            size += 1
+    return [row for row, kept in zip(rows, keep.tolist()) if kept]
+
+
+# IUPAC code of every set of bases, indexed by its bitmask (A=1, C=2, G=4, T=8)
+IUPAC_CODES = np.frombuffer(b'-ACMGRSVTWYHKDBN', dtype=np.uint8)
+BASE_BITS = np.array([1, 2, 4, 8], dtype=np.uint8)
+# bitmask of every byte, 0 if it is not one of A, C, G, T
+_BYTE_BITS = np.zeros(256, dtype=np.uint8)
+_BYTE_BITS[np.frombuffer(b'ACGT', dtype=np.uint8)] = BASE_BITS
+
+
+def degenerate_consensus(sequences):
+    """
+    Degenerate consensus of sequences of the same length, with the rules of Cavener used by Bio.motifs, in every column:
+    the most frequent base if it is more than all the others together and more than twice the second one,
+    otherwise the two most frequent bases if they are more than 3/4 of the sequences,
+    otherwise the bases present if one is missing, otherwise N
+    (ties between equally frequent bases are broken in the order A, C, G, T, as Bio.motifs)
+    Raises ValueError if the sequences have different lengths or contain anything but A, C, G, T
+    :return: IUPAC string
+    """
+    length = len(sequences[0])
+    if any(len(sequence) != length for sequence in sequences):
+        raise ValueError('sequences of different lengths')
+    bits = _BYTE_BITS[np.frombuffer(''.join(sequences).encode('ascii'), dtype=np.uint8)].reshape(len(sequences), length)
+    if not bits.all():
+        raise ValueError('sequences contain other symbols than A, C, G, T')
+    # bases present in every column (the third rule, N if all of them are), and their counts (bases x columns)
+    present = np.bitwise_or.reduce(bits, axis=0)
+    counts = (bits == BASE_BITS[:, np.newaxis, np.newaxis]).sum(axis=1)
+    # the most frequent base and the second one, argmax takes the first of equally frequent bases
+    columns = np.arange(length)
+    first = counts.argmax(axis=0)
+    first_count = counts[first, columns]
+    counts[first, columns] = -1
+    second = counts.argmax(axis=0)
+    second_count = counts[second, columns]
+    masks = np.where((2 * first_count > len(sequences)) & (first_count > 2 * second_count), BASE_BITS[first],
+                     np.where(4 * (first_count + second_count) > 3 * len(sequences),
+                              BASE_BITS[first] | BASE_BITS[second], present))
+    return IUPAC_CODES[masks].tobytes().decode('ascii')
+
+
+def read_mopo16s_output(file_path):
+    """
+    :return: tuple (scores header line, list of tuples (primer set pair line, scores line, scores)),
+             the lines are as written by mopo16s
+    """
+    with open(file_path + '.primers', 'rt') as primers_file, open(file_path + '.scores', 'rt') as scores_file:
+        header = scores_file.readline().rstrip('\n')
+        rows = [(primers_line.rstrip('\n'), scores_line.rstrip('\n'),
+                 tuple(float(score) for score in scores_line.split('\t')))
+                for primers_line, scores_line in zip(primers_file, scores_file)]
+    return header, rows
+
+
+def write_mopo16s_output(file_path, header, rows):
+    """
+    :param rows: iterable of tuples (primer set pair line, scores line)
+    """
+    with open(file_path + '.primers', 'wt') as primers_file, open(file_path + '.scores', 'wt') as scores_file:
+        scores_file.write(header + '\n')
+        for primers_line, scores_line in rows:
+            primers_file.write(primers_line + '\n')
+            scores_file.write(scores_line + '\n')
+
+
+def merge_mopo16s_outputs(out_file_paths, merged_file_path):
+    """
+    Merge the optimized primers of many mopo16s executions into a single non-dominated set
+    :param out_file_paths: output file paths, without extension
+    :param merged_file_path: path of the merged output, without extension
+    """
+    header = None
+    rows = []
+    for file_path in out_file_paths:
+        header, file_rows = read_mopo16s_output(file_path)
+        rows.extend(file_rows)
+    # the scores are parsed only to compare them, the lines of mopo16s are written as they are
+    scores_lines = dict((primers_line, scores_line) for primers_line, scores_line, _ in rows)
+    front = pareto_front((primers_line, scores) for primers_line, _, scores in rows)
+    write_mopo16s_output(merged_file_path, header,
+                         ((primers_line, scores_lines[primers_line]) for primers_line, _ in front))
+
+
+class _ZipChunks:
+    # write-only file object collecting what ZipFile writes: it is not seekable, so the entries have data descriptors
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries, compression=ZIP_DEFLATED, compresslevel=None, date_time=(1980, 1, 1, 0, 0, 0)):
+    """
+    Zip archive generated while it is streamed, without temporary files:
+    at most one compressed entry is held in memory
+    :param entries: iterable of tuples (name in the archive, str or bytes)
+    :param compression: zipfile compression constant, e.g. ZIP_STORED
+    :param compresslevel: [Optional] see ZipFile. Default: None.
+    :param date_time: modification time of every entry, the same entries give the same archive. Default: 1980-01-01.
+    :return: generator of bytes
+    """
+    output = _ZipChunks()
+    with ZipFile(output, 'w', compression=compression, compresslevel=compresslevel) as zip_file:
+        for name, content in entries:
+            zip_file.writestr(ZipInfo(name, date_time=date_time), content, compression, compresslevel)
+            yield output.pop()
+    yield output.pop()
+
+
+def write_checkpoint(checkpoint_path, file_paths, **data):
+    """
+    Record that the files were completely written, with their digests, so that they can be salvaged by a retry.
+    The checkpoint is written atomically: it exists only if all the files do.
+    :param data: what the files were produced from (e.g. runs range and seed), compared by read_checkpoint
+    """
+    tmp_checkpoint_path = checkpoint_path + '.tmp'
+    with open(tmp_checkpoint_path, 'w') as checkpoint_file:
+        checkpoint_file.write(dumps(dict(data, files=dict((file_path, file_digest(file_path))
+                                                          for file_path in file_paths))))
+    replace(tmp_checkpoint_path, checkpoint_path)
+
+
+def read_checkpoint(checkpoint_path, **data):
+    """
+    :param data: what the files must have been produced from, see write_checkpoint
+    :return: dict of the checkpoint data, None if there is no checkpoint, it doesn't match data,
+             or one of its files is missing or changed
+    """
+    try:
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = loads(checkpoint_file.read())
+    except (OSError, ValueError):
+        return None
+    # compare the json representations, e.g. tuples and lists are the same
+    if any(checkpoint.get(name) != value for name, value in loads(dumps(data)).items()):
+        return None
+    for file_path, digest in checkpoint.get('files', {}).items():
+        if not path.exists(file_path) or file_digest(file_path) != digest:
+            return None
+    return checkpoint
+
+
+class OutputExcerpt:
+    """
+    Copy of a stream into a file, keeping in memory only its first and last bytes
+    
+    @param file:            Binary file where the whole stream is written.
+    @param excerpt_size:    Number of bytes kept of both the beginning and the end of the stream.
+    """
+    
+    def __init__(self, file, excerpt_size):
+        self.file = file
+        self.excerpt_size = excerpt_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+    
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+        if len(self.head) < self.excerpt_size:
+            self.head += data[:self.excerpt_size - len(self.head)]
+        self.tail += data
+        del self.tail[:-self.excerpt_size]
+    
+    def __str__(self):
+        if self.size <= 2 * self.excerpt_size:
+            # head and tail overlap, take the whole stream from them
+            text = self.head + self.tail[len(self.tail) - (self.size - len(self.head)):]
+        else:
+            text = self.head + '\n[... {} bytes omitted ...]\n'.format(
+                    self.size - 2 * self.excerpt_size).encode() + self.tail
+        return text.decode('utf-8', errors='replace')
+
+
+def rusage_to_dict(rusage, wall_time):
+    # ru_maxrss is in kilobytes on Linux
+    return dict(wall_time=round(wall_time, 3),
+                user_time=round(rusage.ru_utime, 3),
+                system_time=round(rusage.ru_stime, 3),
+                max_rss=rusage.ru_maxrss * 1024,
+                block_in=rusage.ru_inblock,
+                block_out=rusage.ru_oublock,
+                major_faults=rusage.ru_majflt,
+                voluntary_switches=rusage.ru_nvcsw,
+                involuntary_switches=rusage.ru_nivcsw)
+
+
+def create_cgroup(cgroup_path):
+    # cgroup v2 scope, its parent must be delegated to the user of the worker: if it cannot be created, skip it
+    try:
+        mkdir(cgroup_path)
+        return cgroup_path
+    except OSError:
+        return None
+
+
+def read_cgroup_memory(cgroup_path):
+    """
+    :return: dict with the peak memory usage of the cgroup and the number of processes killed by the OOM killer
+    """
+    memory = {}
+    try:
+        with open(path.join(cgroup_path, 'memory.peak')) as file:
+            memory['memory_peak'] = int(file.read())
+        with open(path.join(cgroup_path, 'memory.events')) as file:
+            events = dict(line.split() for line in file)
+        memory['oom_kills'] = int(events.get('oom_kill', 0))
+    except (OSError, ValueError):
+        # memory.peak is available since Linux 5.19
+        pass
+    return memory
+
+
+def parse_cpu_list(cpu_list):
+    # kernel format, e.g. '0-3,8,10-11'
+    cpus = []
+    for item in cpu_list.strip().split(','):
+        if item:
+            first, _, last = item.partition('-')
+            cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def read_cpu_topology():
+    """
+    CPUs usable by this process, grouped by NUMA node (a single group if the topology is unknown)
+    :return: list of lists of CPU ids, sorted by node
+    """
+    usable = sched_getaffinity(0)
+    nodes = []
+    for node_path in sorted(glob('/sys/devices/system/node/node[0-9]*'), key=lambda p: int(p.rsplit('node', 1)[1])):
+        try:
+            with open(path.join(node_path, 'cpulist')) as file:
+                cpus = [cpu for cpu in parse_cpu_list(file.read()) if cpu in usable]
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(usable)]
+
+
+class ProcessCancelledError(subprocess.SubprocessError):
+    pass
+
+
+def kill_process_group(process, timeout):
+    # SIGTERM to the whole group (the process and its children), SIGKILL to the group if any of them is still alive
+    # after the timeout: the children can outlive the process
+    deadline = monotonic() + timeout
+    try:
+        killpg(process.pid, SIGTERM)
+        process.wait(timeout)
+        while monotonic() < deadline:
+            killpg(process.pid, 0)
+            sleep(0.1)
+    except subprocess.TimeoutExpired:
+        pass
+    except ProcessLookupError:
+        # the whole group is gone
+        return
+    try:
+        killpg(process.pid, SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def run_streaming(cmd_args, stdout_file_path, stderr_file_path, excerpt_size, chunk_size=1 << 16, on_stdout=None,
+                  on_exit=None, cgroup_path=None, is_cancelled=None, kill_timeout=10, cpus=None):
+    """
+    Same as subprocess.run(cmd_args, check=True, capture_output=True), but stdout and stderr are streamed
+    to files while the process runs, so the memory used does not depend on the size of the output.
+    on_stdout, if given, is called with every chunk of stdout read (bytes).
+    on_exit, if given, is called with the dict of the resources used by the process (see rusage_to_dict),
+    with the peak memory too if the process is placed in the cgroup v2 scope at cgroup_path (created and removed here).
+    is_cancelled, if given, is called about every second: when it returns True the process group is killed
+    (SIGTERM, then SIGKILL after kill_timeout seconds) and ProcessCancelledError is raised.
+    cpus, if given, is the set of CPUs the process (and its threads) is pinned to.
+    Raises subprocess.CalledProcessError if the exit code is not zero.
+    :return: subprocess.CompletedProcess, stdout and stderr are strings with the excerpts of the outputs
+    """
+    if cgroup_path is not None:
+        cgroup_path = create_cgroup(cgroup_path)
+    started = checked = monotonic()
+    # the process leads its own group, so that it can be killed together with its children
+    with open(stdout_file_path, 'wb') as stdout_file, open(stderr_file_path, 'wb') as stderr_file, \
+            subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             start_new_session=True) as process:
+        # pinned from here rather than with preexec_fn, which is unsafe in the threads of the worker:
+        # mopo16s starts its threads only after parsing its inputs, so they inherit the affinity
+        if cpus:
+            try:
+                sched_setaffinity(process.pid, cpus)
+            except ProcessLookupError:
+                pass
+        if cgroup_path is not None:
+            try:
+                with open(path.join(cgroup_path, 'cgroup.procs'), 'w') as file:
+                    file.write(str(process.pid))
+            except OSError:
+                rmdir(cgroup_path)
+                cgroup_path = None
+        outputs = {process.stdout.fileno(): OutputExcerpt(stdout_file, excerpt_size),
+                   process.stderr.fileno(): OutputExcerpt(stderr_file, excerpt_size)}
+        try:
+            # read both pipes as soon as data is available, the process never blocks on a full pipe
+            with selectors.DefaultSelector() as selector:
+                for fd in outputs:
+                    set_blocking(fd, False)
+                    selector.register(fd, selectors.EVENT_READ)
+                while selector.get_map():
+                    if is_cancelled is not None and monotonic() - checked >= 1:
+                        checked = monotonic()
+                        if is_cancelled():
+                            kill_process_group(process, kill_timeout)
+                            raise ProcessCancelledError
+                    for key, _ in selector.select(timeout=1):
+                        try:
+                            data = read(key.fd, chunk_size)
+                        except BlockingIOError:
+                            continue
+                        if data:
+                            outputs[key.fd].write(data)
+                            if on_stdout is not None and key.fd == process.stdout.fileno():
+                                on_stdout(data)
+                        else:
+                            selector.unregister(key.fd)
+            # reap the process with its resource usage
+            _, status, rusage = wait4(process.pid, 0)
+            returncode = process.returncode = -WTERMSIG(status) if WIFSIGNALED(status) else WEXITSTATUS(status)
+            resources = rusage_to_dict(rusage, monotonic() - started)
+            if cgroup_path is not None:
+                resources.update(read_cgroup_memory(cgroup_path))
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            if cgroup_path is not None:
+                try:
+                    rmdir(cgroup_path)
+                except OSError:
+                    pass
+    if on_exit is not None:
+        on_exit(resources)
+    stdout, stderr = (str(output) for output in outputs.values())
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd_args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd_args, returncode, stdout, stderr)
@@ -1,9 +1,18 @@
 from redis import Redis
 from json import dumps, loads
+from decouple import config
 
 
-cache_celery = Redis(db=0, decode_responses=True)
-cache = Redis(db=1, decode_responses=True)
+if config('MOPO16S_FAKEREDIS', default=False, cast=bool):
+    # in-process stand-in of Redis, e.g. for the benchmark_scheduler command (requires fakeredis and lupa)
+    from fakeredis import FakeServer, FakeRedis
+    
+    _fake_server = FakeServer()
+    cache_celery = FakeRedis(server=_fake_server, db=0, decode_responses=True)
+    cache = FakeRedis(server=_fake_server, db=1, decode_responses=True)
+else:
+    cache_celery = Redis(db=0, decode_responses=True)
+    cache = Redis(db=1, decode_responses=True)
 
 
 def bool_encoder(value):
@@ -1,13 +1,18 @@
 import os
 from celery import Celery
+from celery.signals import celeryd_after_setup, worker_ready, worker_shutdown
+from celery.utils.log import get_logger
 from time import sleep
-from .caches import cached_string, bool_encoder
+from threading import Thread, Event
+from .caches import cache, cache_celery
+from .settings import MOPO16S_NODE_NAME
 
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mopo16s_web_proj.settings')
 
 app = Celery('mopo16s_web_proj')
+logger = get_logger(__name__)
 
 # Using a string here means the worker doesn't have to serialize
 # the configuration object to child processes.
@@ -22,6 +27,9 @@ app.conf.result_backend = 'django-db'
 app.conf.beat_scheduler = 'django_celery_beat.schedulers:DatabaseScheduler'
 app.conf.worker_prefetch_multiplier = 1
 app.conf.task_track_started = True
+# Redis has no native priorities: kombu keeps a list for every priority step, consumed from 0 (highest) to 9
+PRIORITY_STEPS = list(range(10))
+app.conf.broker_transport_options = {'priority_steps': PRIORITY_STEPS}
 
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
@@ -34,27 +42,284 @@ def debug_task(self):
 
 
 app.conf.beat_schedule = {
-    'check_failed_jobs':       {
+    'check_failed_jobs':         {
         'task':     'mopo16s_web.tasks.check_failed_jobs',
         'schedule': 60 * 15
         },
-    'clean_allocated_threads': {
+    'clean_allocated_threads':   {
         'task':     'mopo16s_web.tasks.clean_allocated_threads',
         'schedule': 60 * 15
         },
-    'debug_task':              {
+    'reprioritize_pending_jobs': {
+        'task':     'mopo16s_web.tasks.reprioritize_pending_jobs',
+        'schedule': 60 * 5
+        },
+    'fit_runtime_model':         {
+        'task':     'mopo16s_web.tasks.fit_runtime_model',
+        'schedule': 60 * 60
+        },
+    'debug_task':                {
         'task':     'mopo16s_web_proj.celery.debug_task',
         'schedule': 60 * 60
         },
     }
 
 
-def get_running_tasks_ids(pattern='*'):
-    # get info of workers with name matching the pattern
-    active_workers = app.control.inspect(pattern=pattern).active()
-    return tuple(task['id'] for worker_name, task_list in active_workers.items() for task in task_list)
+# every worker node consuming the shared queue of mopo16s consumes also its own queue (jobs routed to the node),
+# and publishes its capacity with a heartbeat while it is up
+_node_heartbeat = None
+
+
+def consumes_mopo16s_queue(app):
+    from mopo16s_web.nodes import MOPO16S_QUEUE
+    # no selection means all the queues
+    return not app.amqp.queues.consume_from or MOPO16S_QUEUE in app.amqp.queues.consume_from
+
+
+@celeryd_after_setup.connect
+def add_node_queue(sender=None, instance=None, **kwargs):
+    from mopo16s_web.nodes import node_queue
+    if consumes_mopo16s_queue(instance.app):
+        instance.app.amqp.queues.select_add(node_queue(MOPO16S_NODE_NAME))
+
+
+@worker_ready.connect
+def register_worker_node(sender=None, **kwargs):
+    from mopo16s_web.nodes import NodeHeartbeat
+    global _node_heartbeat
+    if consumes_mopo16s_queue(sender.app) and _node_heartbeat is None:
+        _node_heartbeat = NodeHeartbeat()
+        _node_heartbeat.start()
+
+
+@worker_ready.connect
+def fit_missing_runtime_model(sender=None, **kwargs):
+    # jobs get the unknown priority while the runtime model is not cached, fit it now instead of at the next beat
+    from mopo16s_web.runtime import get_runtime_model
+    from mopo16s_web.tasks import fit_runtime_model
+    if consumes_mopo16s_queue(sender.app) and get_runtime_model() is None:
+        fit_runtime_model.delay()
+
+
+@worker_shutdown.connect
+def unregister_worker_node(**kwargs):
+    global _node_heartbeat
+    if _node_heartbeat is not None:
+        _node_heartbeat.stop()
+        _node_heartbeat = None
+
+
+# a running task refreshes its heartbeat key every HEARTBEAT_INTERVAL seconds,
+# the key expires after HEARTBEAT_TTL seconds if the worker dies
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TTL = 30
+
+
+def heartbeat_key(task_id):
+    return 'celery.task.heartbeat:' + task_id
+
+
+class TaskHeartbeat:
+    """
+    Context manager publishing the heartbeat of a task from a background thread,
+    as long as the context is open the task is considered running.
+    
+    @param task_id:         Id of the running task.
+    @param parent_task_ids: [Optional] Ids of other tasks kept alive by this one (e.g. a job split into shards).
+                            Their keys are not deleted on exit, they simply expire.
+    @param on_beat:         [Optional] Function called at every heartbeat (e.g. to renew leases). Default: None.
+    """
+    
+    def __init__(self, task_id, *parent_task_ids, on_beat=None):
+        self.key = heartbeat_key(task_id)
+        self.parent_keys = [heartbeat_key(parent_task_id) for parent_task_id in parent_task_ids]
+        self.on_beat = on_beat
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+    
+    def beat(self):
+        pipe = cache.pipeline(transaction=False)
+        for key in (self.key, *self.parent_keys):
+            pipe.set(key, 1, HEARTBEAT_TTL)
+        pipe.execute()
+        if self.on_beat is not None:
+            self.on_beat()
+    
+    def _run(self):
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.beat()
+            except Exception as exc:
+                # the thread must keep beating: the key will be refreshed at the next beat, if redis is back in time
+                logger.warning('Heartbeat {} failed - {!r}'.format(self.key, exc))
+    
+    def __enter__(self):
+        self.beat()
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        cache.delete(self.key)
+
+
+def task_is_running(task_id):
+    return bool(task_id) and bool(cache.exists(heartbeat_key(task_id)))
+
+
+def tasks_are_running(task_ids):
+    """
+    Check the heartbeat of many tasks with a single MGET.
+    :param task_ids: iterable of task ids
+    :return: list of booleans, in the same order of task_ids
+    """
+    task_ids = list(task_ids)
+    if not task_ids:
+        return []
+    return [value is not None for value in cache.mget([heartbeat_key(task_id or '') for task_id in task_ids])]
+
+
+# side index of the tasks waiting in 'queue_mopo16s': sorted set task_id -> priority and enqueue order,
+# updated when tasks are published and consumed, instead of scanning the whole queue
+PENDING_INDEX_KEY = 'queue_mopo16s:pending'
+PENDING_SEQUENCE_KEY = 'queue_mopo16s:sequence'
+# score = priority * PRIORITY_SCORE_STEP + enqueue order, so the rank is the order of consumption
+PRIORITY_SCORE_STEP = 1 << 40
+# separator of the priority lists of kombu: 'queue', 'queue\x06\x161', ..., 'queue\x06\x169'
+PRIORITY_QUEUE_SEP = '\x06\x16'
+
+# (re)index the task at the end of the queue of its priority, returns its enqueue order
+_index_pending_task_script = cache.register_script("""
+local sequence = redis.call('INCR', KEYS[2])
+redis.call('ZADD', KEYS[1], tonumber(ARGV[2]) * tonumber(ARGV[3]) + sequence, ARGV[1])
+return sequence
+""")
+
+# messages around the expected position searched by the scripts, before searching the whole list
+MOVE_SEARCH_WINDOW = 64
+
+# find the message of a task in a priority list, returns the message and its position from the right (0 = next):
+# kombu pushes on the left and pops from the right, expected is the position of the message from the right
+# (its rank in the index), the messages within window positions from there are searched first
+LUA_FIND_MESSAGE = """
+local function find_message(key, task_id, expected, window)
+    local pattern = '"id": "' .. task_id .. '"'
+    local length = redis.call('LLEN', key)
+    local function find(first, last)
+        first = math.max(0, first)
+        if last < first then
+            return nil
+        end
+        for i, message in ipairs(redis.call('LRANGE', key, first, last)) do
+            if string.find(message, pattern, 1, true) then
+                return message, length - first - i
+            end
+        end
+        return nil
+    end
+    local message, position = find(length - 1 - expected - window, length - 1 - math.max(0, expected - window))
+    if not message then
+        -- the index is off (e.g. messages of shards in the same list)
+        message, position = find(0, length - 1)
+    end
+    return message, position
+end
+"""
+
+# move the message of the task ARGV[1] from the list KEYS[1] to the end of the list KEYS[2], returns 1 if found,
+# ARGV[2] is its expected position and ARGV[3] the search window (see LUA_FIND_MESSAGE)
+_move_message_script = cache_celery.register_script(LUA_FIND_MESSAGE + """
+local message = find_message(KEYS[1], ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]))
+if not message then
+    return 0
+end
+redis.call('LREM', KEYS[1], -1, message)
+redis.call('LPUSH', KEYS[2], message)
+return 1
+""")
+
+# position of the message of the task ARGV[1] in the queue whose priority lists are KEYS (from priority 0),
+# returns {position from 1, messages in the queue}, nil if not found:
+# ARGV[2] is the priority of the task, ARGV[3] and ARGV[4] as in _move_message_script
+_queue_position_script = cache_celery.register_script(LUA_FIND_MESSAGE + """
+local priority = tonumber(ARGV[2])
+local message, position = find_message(KEYS[priority + 1], ARGV[1], tonumber(ARGV[3]), tonumber(ARGV[4]))
+if not message then
+    return nil
+end
+local length = 0
+for i, key in ipairs(KEYS) do
+    local messages = redis.call('LLEN', key)
+    length = length + messages
+    -- the lists of the higher priorities are consumed first
+    if i <= priority then
+        position = position + messages
+    end
+end
+return {position + 1, length}
+""")
+
+
+def priority_queue_key(queue, priority):
+    if priority:
+        return queue + PRIORITY_QUEUE_SEP + str(priority)
+    return queue
+
+
+def index_pending_task(task_id, priority=0):
+    return _index_pending_task_script(keys=(PENDING_INDEX_KEY, PENDING_SEQUENCE_KEY),
+                                      args=(task_id, priority or 0, PRIORITY_SCORE_STEP))
+
+
+def _expected_position(score):
+    # the tasks indexed with the same priority before it are consumed before it
+    priority = int(score) // PRIORITY_SCORE_STEP
+    return priority, cache.zcount(PENDING_INDEX_KEY, priority * PRIORITY_SCORE_STEP, '({}'.format(int(score)))
+
+
+def move_pending_task(task_id, queue, priority):
+    """
+    Move a waiting task to another priority, without publishing it again.
+    :return: True if the task has been moved, False if it is not waiting or its priority is already the same
+    """
+    score = cache.zscore(PENDING_INDEX_KEY, task_id)
+    if score is None:
+        return False
+    current_priority, expected = _expected_position(score)
+    if priority == current_priority:
+        return False
+    if not _move_message_script(keys=(priority_queue_key(queue, current_priority), priority_queue_key(queue, priority)),
+                                args=(task_id, expected, MOVE_SEARCH_WINDOW)):
+        return False
+    # the message is now the last one of its new priority, so is the task in the index
+    cache.zadd(PENDING_INDEX_KEY, {task_id: priority * PRIORITY_SCORE_STEP + cache.incr(PENDING_SEQUENCE_KEY)},
+               xx=True)
+    return True
+
+
+def unindex_pending_tasks(*task_ids):
+    if task_ids:
+        cache.zrem(PENDING_INDEX_KEY, *task_ids)
+
+
+def get_pending_tasks_ids():
+    return cache.zrange(PENDING_INDEX_KEY, 0, -1)
 
 
-@cached_string('celery.task.running', 8, encoder=bool_encoder, decoder=bool)
-def task_is_running(task_id, pattern='*'):
-    return task_id in get_running_tasks_ids(pattern)
+def get_queue_position(task_id, queue):
+    """
+    Position of a waiting task among the messages of its queue, consumed before it or after it
+    (shards included, tasks of other queues and tasks delayed by a countdown excluded).
+    :param queue: queue of the task (the shared one or the one of a node)
+    :return: tuple (position, queue length), position starts from 1, None if the task is not waiting in queue
+    """
+    if not task_id:
+        return None
+    score = cache.zscore(PENDING_INDEX_KEY, task_id)
+    if score is None:
+        return None
+    priority, expected = _expected_position(score)
+    position = _queue_position_script(keys=[priority_queue_key(queue, p) for p in PRIORITY_STEPS],
+                                      args=(task_id, priority, expected, MOVE_SEARCH_WINDOW))
+    return tuple(position) if position else None
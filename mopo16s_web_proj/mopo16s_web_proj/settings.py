@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import socket
 from decouple import config
 
 
@@ -30,9 +31,80 @@ ALLOWED_HOSTS = ['*']
 
 # mopo16s configurations
 MOPO16S_VERSION = '1.0'
-MOPO16S_PATH = '/home/gasta/mopo16s/release/mopo16s'
+# can be set from the environment, e.g. to benchmark/fake_mopo16s.py for the benchmark_scheduler command
+MOPO16S_PATH = config('MOPO16S_PATH', default='/home/gasta/mopo16s/release/mopo16s')
+# name of this worker node, its threads and memory are allocated independently from the ones of the other nodes
+MOPO16S_NODE_NAME = socket.gethostname()
+# capacity of this worker node, registered with a heartbeat (see mopo16s_web/nodes.py)
 MOPO16S_MAX_THREADS = os.cpu_count() - 1 or 1
 MOPO16S_MAX_THREADS_PER_INSTANCE = os.cpu_count() // 2 or 1
+# seconds between two heartbeats of a worker node, it is considered gone after missing a few of them
+MOPO16S_NODE_HEARTBEAT_INTERVAL = 30
+MOPO16S_NODE_HEARTBEAT_TTL = 3 * MOPO16S_NODE_HEARTBEAT_INTERVAL
+# a job that cannot get threads on its node is routed to the least-loaded node with free threads,
+# that also has at least these bytes free on the scratch disk
+MOPO16S_NODE_MIN_SCRATCH_FREE = 1024 * 1024 * 1024
+# seconds to wait before trying again to allocate threads, when none is free
+MOPO16S_ALLOCATION_RETRY_DELAY = 5
+# seconds a task waits for threads on its node before it is queued again, freeing the worker for other tasks
+MOPO16S_ALLOCATION_MAX_WAIT = 10 * 60
+# bytes of memory that running instances of mopo16s can reserve, by default 80% of the physical memory
+MOPO16S_MEMORY_BUDGET = int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * 0.8)
+# memory model used until a representative sequence set has a history of measured runs:
+# base + rep-set file size * per rep-set byte, plus per thread for each thread
+MOPO16S_MEMORY_BASE = 64 * 1024 * 1024
+MOPO16S_MEMORY_PER_REP_SET_BYTE = 4
+MOPO16S_MEMORY_PER_THREAD = 64 * 1024 * 1024
+# estimates are increased by this factor before reserving the memory
+MOPO16S_MEMORY_SAFETY_MARGIN = 1.25
+# a waiting job gains one priority level for every interval (seconds) spent in queue, so it is never starved
+MOPO16S_PRIORITY_AGING_INTERVAL = 60 * 60
+# fair share: CPU-hours used by each user are halved every MOPO16S_FAIR_SHARE_HALF_LIFE seconds,
+# the jobs of a user lose a priority level for every doubling of its usage, in units of MOPO16S_FAIR_SHARE_UNIT hours
+MOPO16S_FAIR_SHARE_HALF_LIFE = 7 * 24 * 60 * 60
+MOPO16S_FAIR_SHARE_UNIT = 1
+# maximum number of threads allocated at the same time to the jobs of a single user, None for no cap
+MOPO16S_USER_MAX_THREADS = None
+# failures of mopo16s are classified by exit code, stderr and resource usage (see mopo16s_web/failures.py):
+# a stderr matching a 'deterministic' pattern fails the job at once, a 'resource' one retries it with less threads;
+# the usage and FASTA ones match the error lines of mopo16s only, not any line naming an input file
+MOPO16S_FAILURE_PATTERNS = dict(
+        resource=(r'(?i)bad_alloc', r'(?i)out of memory', r'(?i)cannot allocate memory',
+                  r'(?i)no space left on device', r'(?i)disk quota exceeded'),
+        deterministic=(r'(?i)invalid (option|argument|parameter|value)', r'(?i)unrecognized option',
+                       r'(?i)(cannot|could not|unable to) (open|read)', r'(?im)^usage:\s*\S*mopo16s\b',
+                       r'(?im)^error\b.*\b(invalid|malformed|empty|parse|parsing)\b.*\bfasta\b'),
+        )
+# seconds before retrying after a transient failure, doubled at every retry after a resource failure (up to the max),
+# when the threads of the retry are also reduced by the factor
+MOPO16S_RETRY_DELAY = 30
+MOPO16S_RETRY_BACKOFF_MAX = 30 * 60
+MOPO16S_RETRY_DOWNSIZE_FACTOR = 0.5
+# pin every mopo16s to its own CPUs (disjoint from the ones of the other instances on the same host),
+# on a single NUMA node when they fit, so that concurrent instances don't share caches and memory bandwidth
+MOPO16S_CPU_AFFINITY = True
+# seconds given to a cancelled mopo16s to terminate after SIGTERM, before SIGKILL
+MOPO16S_CANCEL_KILL_TIMEOUT = 10
+# maximum number of shards a distributed job is split into
+MOPO16S_MAX_SHARDS = 8
+# maximum number of jobs a parameter sweep can create
+MOPO16S_MAX_BATCH_JOBS = 64
+# bytes of the beginning and of the end of stdout/stderr kept in the run log data, the full output is in the log files
+MOPO16S_LOG_EXCERPT_SIZE = 4096
+# regular expressions matched against every line of the stdout of mopo16s, to publish the progress of the running jobs:
+# a line matching 'run' or 'restart' counts as one finished run or restart,
+# 'scores' named groups (efficiency, coverage, matching_bias) update the best scores found so far
+MOPO16S_PROGRESS_PATTERNS = dict(
+        run=r'(?i)\brun\b.*\b(done|completed|finished)\b',
+        restart=r'(?i)\brestart\b.*\b(done|completed|finished)\b',
+        scores=r'(?P<efficiency>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\t(?P<coverage>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\t'
+               r'(?P<matching_bias>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)',
+        )
+# minimum seconds between two progress updates of the same running mopo16s
+MOPO16S_PROGRESS_INTERVAL = 2
+# cgroup v2 directory delegated to the celery worker user (e.g. '/sys/fs/cgroup/mopo16s'),
+# every run of mopo16s is placed in its own child cgroup to measure its peak memory; None to disable
+MOPO16S_CGROUP_ROOT = None
 MOPO16S_PARAMETERS = dict(
         seed=dict(type=int, default=0, description="Seed of the random number generator (default 0)."),
         restarts=dict(type=int, default=20, min=0,
@@ -188,6 +260,25 @@ STATICFILES_DIRS = [
     ]
 
 MEDIA_ROOT = '/home/gasta/mopo16s_web_media'
+# stdout and stderr of every run of mopo16s
+MOPO16S_LOGS_ROOT = MEDIA_ROOT + '/logs'
+# worker-local cache of the input files of mopo16s (sequence sets and initial primer pairs), keyed by content hash:
+# least recently used files are evicted beyond the budget (bytes), hits are hashed again only if verification is on
+MOPO16S_STAGING_ROOT = '/var/tmp/mopo16s_staging'
+MOPO16S_STAGING_BUDGET = 10 * 1024 * 1024 * 1024
+MOPO16S_STAGING_VERIFY_HITS = False
+# durable per-job scratch area, shared by the workers: the outputs of the finished shards are kept here until the job
+# is completed, so that a retry of the job runs again only the shards that did not finish
+MOPO16S_SCRATCH_ROOT = MEDIA_ROOT + '/scratch'
+# styled HTML tables of the results, rendered once when a job is completed and cached for the seconds of the TTL:
+# increase the version whenever Result.get_html_tables or the results template change, to render them again
+RESULT_TABLES_VERSION = 1
+RESULT_TABLES_TTL = 30 * 24 * 60 * 60
+# zip archives of the raw outputs of the results: compression ('stored', 'deflated', 'bzip2' or 'lzma') and level
+# (None for the default one), directory where complete archives are cached to be sent again as files (None to disable)
+RESULT_ARCHIVE_COMPRESSION = 'deflated'
+RESULT_ARCHIVE_COMPRESSLEVEL = None
+RESULT_ARCHIVES_ROOT = MEDIA_ROOT + '/archives'
 
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
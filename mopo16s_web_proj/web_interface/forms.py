@@ -2,11 +2,11 @@ from os import remove
 from django import forms
 from django.forms import ValidationError
 from django.forms import ModelForm, IntegerField, DecimalField, TextInput
-from mopo16s_web.models import Job, RepresentativeSequenceSet, InitialPrimerPairs
-from mopo16s_web_proj.settings import MOPO16S_PARAMETERS, MEDIA_ROOT
+from mopo16s_web.models import Job, JobBatch, RepresentativeSequenceSet, InitialPrimerPairs
+from mopo16s_web_proj.settings import MOPO16S_PARAMETERS, MEDIA_ROOT, MOPO16S_MAX_BATCH_JOBS
 from django.core.files.base import File
 from time import time
-from mopo16s_web.utils import validate_fasta_str, validate_fasta_file
+from mopo16s_web.utils import validate_fasta_str, validate_fasta_file, parse_sweep
 
 
 # prepare mopo16s parameter fields dynamically, according to settings
@@ -39,6 +39,13 @@ class _NewJobForm(ModelForm):
     defines the non-dynamic part
     """
     
+    force_run = forms.BooleanField(required=False, label='Run again even if an identical job exists?',
+                                   help_text='Otherwise the result of a completed job with the same input files, '
+                                             'parameters and mopo16S version is reused instantly.')
+    distributed = forms.BooleanField(required=False, label='Distribute the runs across workers?',
+                                     help_text='The runs are split in shards executed in parallel, '
+                                               'their primer pairs are merged keeping the Pareto-optimal ones.')
+    
     def __init__(self, *args, request_user, **kwargs):
         super().__init__(*args, **kwargs)
         # rep_set order, filtered by user: list databases first, then the other sequence sets
@@ -81,6 +88,49 @@ class _NewJobForm(ModelForm):
 NewJobForm = type('NewJobForm', (_NewJobForm,), JOB_FORM_PARAMETERS.copy())
 
 
+class _NewJobBatchForm(_NewJobForm):
+    """
+    Base class for NewJobBatchForm
+    the parameter fields are shared by all the jobs, the sweep overrides them
+    """
+    
+    sweep = forms.CharField(widget=forms.Textarea(attrs=dict(rows=4)), label='Parameter sweep',
+                            help_text='One parameter per line, with its values separated by commas, ranges are '
+                                      'inclusive (start:stop or start:stop:step), e.g. "maxMismatches=0:3" and '
+                                      '"minTm=50,52,55". A job is created for every combination, '
+                                      'at most {}.'.format(MOPO16S_MAX_BATCH_JOBS))
+    
+    class Meta(_NewJobForm.Meta):
+        model = JobBatch
+        labels = {
+            'is_public': 'Make the jobs public?'
+            }
+        help_texts = dict(_NewJobForm.Meta.help_texts,
+                          name='Name or brief description of the batch, the jobs are named after it (required).')
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.errors:
+            return cleaned_data
+        try:
+            sweep = parse_sweep(cleaned_data.get('sweep', ''), dict(
+                    (name, details) for name, details in MOPO16S_PARAMETERS.items() if name in JOB_FORM_PARAMETERS))
+        except ValueError as exc:
+            self.add_error('sweep', 'Invalid sweep: {}.'.format(exc))
+            return cleaned_data
+        self.instance.sweep = sweep
+        parameters = dict((name, MOPO16S_PARAMETERS[name]['type'](value)) for name, value in self.mopo16s_parameters)
+        parameters_grid = self.instance.get_parameters_grid(parameters)
+        if not 0 < len(parameters_grid) <= MOPO16S_MAX_BATCH_JOBS:
+            self.add_error('sweep', 'The sweep makes {} jobs, they must be between 1 and {}.'.format(
+                    len(parameters_grid), MOPO16S_MAX_BATCH_JOBS))
+        cleaned_data['parameters_grid'] = parameters_grid
+        return cleaned_data
+
+
+NewJobBatchForm = type('NewJobBatchForm', (_NewJobBatchForm,), JOB_FORM_PARAMETERS.copy())
+
+
 def clean_sequences_upload(modelform, cleaned_data):
     # validate uploaded file here because adding a validator and scanning the stream
     # will close it after the loop, making it not reusable
@@ -8,6 +8,14 @@ urlpatterns = [
     path('jobs/', views.JobListView.as_view(), name='jobs.list'),
     path('jobs/<int:id>/', views.JobDetailView.as_view(), name='jobs.details'),
     path('jobs/new/', views.jobs_new, name='jobs.new'),
+    path('jobs/<int:id>/progress/', views.jobs_progress, name='jobs.progress'),
+    path('jobs/<int:id>/cancel/', views.jobs_cancel, name='jobs.cancel'),
+    path('jobs/<int:id>/runs/<int:run_id>/<str:stream>/', views.jobs_run_log, name='jobs.runs.log'),
+    
+    path('batches/', views.JobBatchListView.as_view(), name='batches.list'),
+    path('batches/<int:id>/', views.JobBatchDetailView.as_view(), name='batches.details'),
+    path('batches/new/', views.batches_new, name='batches.new'),
+    path('batches/<int:id>/progress/', views.batches_progress, name='batches.progress'),
     
     path('sequences/', views.RepresentativeSequenceSetListView.as_view(), name='sequences.list'),
     path('sequences/<int:id>/', views.RepresentativeSequenceSetDetailView.as_view(), name='sequences.details'),
@@ -19,4 +27,5 @@ urlpatterns = [
     
     path('results/<int:job_id>/', views.ResultView.as_view(), name='results.view'),
     path('results/<int:job_id>/download', views.download_file, name='results.download'),
+    path('results/<int:job_id>/rows/<str:prefix>/', views.results_rows, name='results.rows'),
     ]
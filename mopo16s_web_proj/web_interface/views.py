@@ -1,14 +1,23 @@
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import login_required
-from mopo16s_web.models import Job, RepresentativeSequenceSet, InitialPrimerPairs, Result
+from mopo16s_web.models import Job, JobBatch, Run, RepresentativeSequenceSet, InitialPrimerPairs, Result
 from django.views.generic import ListView, DetailView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from web_interface.forms import NewJobForm, NewRepresentativeSequenceSet, NewInitialPrimerPairs
-from mopo16s_web.tasks import run_mopo16s_job
-from os import remove
-from mopo16s_web_proj.settings import MEDIA_ROOT
-from django.http import HttpResponse
-from zipfile import ZipFile
+from web_interface.forms import NewJobForm, NewJobBatchForm, NewRepresentativeSequenceSet, NewInitialPrimerPairs
+from mopo16s_web.tasks import submit_jobs, cancel_job
+from os import remove, path
+from django.http import HttpResponse, FileResponse, Http404, JsonResponse, HttpResponseForbidden, \
+    StreamingHttpResponse
+from django.views.decorators.http import require_POST, condition
+from mopo16s_web.progress import get_progress
+from mopo16s_web.utils import file_digest
+from mopo16s_web.result_tables import get_result_tables, result_tables_etag
+from mopo16s_web.columnar import THRESHOLD_NAMES
+from django.utils.decorators import method_decorator
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag
+from mopo16s_web.archives import stream_result_archive, get_cached_result_archive, result_archive_etag
+import re
 
 
 def home(request):
@@ -16,6 +25,8 @@ def home(request):
 
 
 class JobListView(LoginRequiredMixin, ListView):
+    ORDERINGS = ('status', '-status', 'date_status_changed', '-date_status_changed')
+    
     model = Job
     context_object_name = 'jobs'
     template_name = 'jobs/list.html'
@@ -24,9 +35,22 @@ class JobListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         # filter results based on the authenticated user
         # ordering by 'id' equals ordering by 'created_at', and it's more efficient
-        return Job.objects.filter(request_user=self.request.user) \
-            .select_related('created_by', 'result', 'task') \
-            .order_by('-id')
+        queryset = Job.objects.filter(request_user=self.request.user).select_related('created_by')
+        # status is a column, so it can be filtered and sorted in the query
+        if self.request.GET.get('status') in Job.STATUSES:
+            queryset = queryset.filter(status=self.request.GET['status'])
+        if self.request.GET.get('order') in self.ORDERINGS:
+            return queryset.order_by(self.request.GET['order'], '-id')
+        return queryset.order_by('-id')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # keep filter and ordering while paginating
+        filter_query = self.request.GET.copy()
+        filter_query.pop('page', None)
+        context.update(statuses=Job.STATUSES, status_filter=self.request.GET.get('status', ''),
+                       filter_query=filter_query.urlencode())
+        return context
 
 
 class JobDetailView(LoginRequiredMixin, DetailView):
@@ -37,6 +61,46 @@ class JobDetailView(LoginRequiredMixin, DetailView):
     def get_object(self, **kwargs):
         # filter results based on the authenticated user
         return get_object_or_404(Job.objects.filter(request_user=self.request.user), id=self.kwargs['id'])
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['runs'] = self.object.runs.order_by('id')
+        return context
+
+
+@login_required
+def jobs_run_log(request, id, run_id, stream):
+    """
+    Stream the full stdout or stderr of a run of mopo16s from its log file.
+    """
+    job = get_object_or_404(Job.objects.filter(request_user=request.user), id=id)
+    run = get_object_or_404(job.runs, id=run_id)
+    if stream not in Run.LOG_STREAMS or not path.exists(run.get_log_file_path(stream)):
+        raise Http404('Log not found.')
+    return FileResponse(open(run.get_log_file_path(stream), 'rb'), content_type='text/plain; charset=utf-8')
+
+
+@login_required
+def jobs_progress(request, id):
+    """
+    Latest progress snapshot of a running job, published by the worker (empty if unknown).
+    """
+    if not Job.objects.filter(request_user=request.user).filter(id=id).exists():
+        raise Http404('Job not found.')
+    return JsonResponse(get_progress(id) or {})
+
+
+@login_required
+@require_POST
+def jobs_cancel(request, id):
+    """
+    Cancel a pending or running job, only its creator (or staff) can.
+    """
+    job = get_object_or_404(Job.objects.filter(request_user=request.user), id=id)
+    if job.created_by_id != request.user.id and not request.user.is_staff:
+        return HttpResponseForbidden('Only the creator can cancel the job.')
+    cancel_job(job)
+    return redirect('jobs.details', id=job.id)
 
 
 @login_required
@@ -50,17 +114,71 @@ def jobs_new(request):
             job = form.save(commit=False)
             job.created_by = request.user
             job.set_mopo16s_parameters(form.mopo16s_parameters)
+            job.set_shards(form.cleaned_data['distributed'])
+            job.estimated_runtime = job.estimate_runtime()
             job.save()
-            # task = run_mopo16s_job.delay(job.id)
-            # job.task_id = task.id
-            job.task_id = run_mopo16s_job.delay(job.id).id
-            job.save()
+            # the status is updated by the task signals, only the task id is saved
+            submit_jobs([job], force_run=form.cleaned_data['force_run'])
             return redirect('jobs.details', id=job.id)
     else:
         form = NewJobForm(request_user=request.user)
     return render(request, 'jobs/new.html', dict(form=form))
 
 
+class JobBatchListView(LoginRequiredMixin, ListView):
+    model = JobBatch
+    context_object_name = 'batches'
+    template_name = 'batches/list.html'
+    paginate_by = 20
+    
+    def get_queryset(self):
+        # filter results based on the authenticated user
+        return JobBatch.objects.filter(request_user=self.request.user).select_related('created_by').order_by('-id')
+
+
+class JobBatchDetailView(LoginRequiredMixin, DetailView):
+    model = JobBatch
+    context_object_name = 'batch'
+    template_name = 'batches/details.html'
+    
+    def get_object(self, **kwargs):
+        # filter results based on the authenticated user
+        return get_object_or_404(JobBatch.objects.filter(request_user=self.request.user), id=self.kwargs['id'])
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(progress=self.object.get_progress(), comparison=self.object.get_comparison(),
+                       swept_parameters=self.object.swept_parameters)
+        return context
+
+
+@login_required
+def batches_progress(request, id):
+    """
+    Aggregate progress of the jobs of a batch.
+    """
+    batch = get_object_or_404(JobBatch.objects.filter(request_user=request.user), id=id)
+    return JsonResponse(batch.get_progress())
+
+
+@login_required
+def batches_new(request):
+    """
+    Get a form for a parameter sweep, or validate the form and save the batch with all its jobs.
+    """
+    if request.method == 'POST':
+        form = NewJobBatchForm(request.POST, request_user=request.user)
+        if form.is_valid():
+            batch = form.save(commit=False)
+            batch.created_by = request.user
+            jobs = batch.save_with_jobs(form.cleaned_data['parameters_grid'], form.cleaned_data['distributed'])
+            submit_jobs(jobs, force_run=form.cleaned_data['force_run'])
+            return redirect('batches.details', id=batch.id)
+    else:
+        form = NewJobBatchForm(request_user=request.user)
+    return render(request, 'batches/new.html', dict(form=form))
+
+
 class RepresentativeSequenceSetListView(LoginRequiredMixin, ListView):
     model = RepresentativeSequenceSet
     context_object_name = 'sequences'
@@ -82,6 +200,11 @@ class RepresentativeSequenceSetDetailView(LoginRequiredMixin, DetailView):
         # filter results based on the authenticated user
         return get_object_or_404(RepresentativeSequenceSet.objects.filter(request_user=self.request.user),
                                  id=self.kwargs['id'])
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['resources_summary'] = Run.objects.get_resources_summary(job__rep_set_id=self.object.id)
+        return context
 
 
 @login_required
@@ -95,6 +218,7 @@ def sequences_new(request):
             sequence_set.file = form.cleaned_data['validated_file']
             sequence_set.sequences_count = form.cleaned_data['validated_seq_count']
             sequence_set.file_size = sequence_set.file.size
+            sequence_set.file_sha256 = file_digest(form.cleaned_data['validated_file'].name)
             sequence_set.save()
             remove(form.cleaned_data['validated_file'].name)
             return redirect('sequences.details', id=sequence_set.id)
@@ -143,32 +267,123 @@ def primers_new(request):
     return render(request, 'primers/new.html', dict(form=form))
 
 
+def get_result_date_completed(request, job_id):
+    # None if the user cannot view the result, the query is done once per request
+    if not hasattr(request, 'result_date_completed'):
+        request.result_date_completed = Result.objects.filter(request_user=request.user, job_id=job_id) \
+            .values_list('date_completed', flat=True).first()
+    return request.result_date_completed
+
+
+def result_etag(request, job_id):
+    date_completed = get_result_date_completed(request, job_id)
+    if date_completed is None:
+        return None
+    # the page shows the authenticated user too
+    return '{}-{}'.format(result_tables_etag(job_id, date_completed), request.user.id)
+
+
+def result_last_modified(request, job_id):
+    return get_result_date_completed(request, job_id)
+
+
 class ResultView(LoginRequiredMixin, DetailView):
     context_object_name = 'result'
     template_name = 'results/view.html'
     
+    # repeat visits get 304 Not Modified, without loading the result
+    @method_decorator(condition(etag_func=result_etag, last_modified_func=result_last_modified))
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
     def get_object(self, **kwargs):
         job_id = self.kwargs['job_id']
-        # filter results based on the authenticated user
-        result = get_object_or_404(Result.objects.filter(request_user=self.request.user).only('job_id', 'data'),
-                                   job_id=job_id)
-        html_init, html_out = result.get_html_tables()
-        return html_init, html_out, result.data, job_id
+        # filter results based on the authenticated user, data_npz is loaded only if the tables are not cached
+        result = get_object_or_404(Result.objects.filter(request_user=self.request.user)
+                                   .only('job_id', 'date_completed'), job_id=job_id)
+        tables = get_result_tables(result)
+        return tables['init'], tables['out'], tables['matrices'], job_id
 
 
 @login_required
+def results_rows(request, job_id, prefix):
+    """
+    Page of the rows of a result (prefix 'init' or 'out'), see Result.get_rows.
+    Query parameters: order_by, fields, offset, limit, after and the thresholds (e.g. min_efficiency).
+    """
+    result = get_object_or_404(Result.objects.filter(request_user=request.user).only('job_id', 'data_npz'),
+                               job_id=job_id)
+    try:
+        params = dict((name, int(request.GET[name])) for name in ('offset', 'limit', 'after') if request.GET.get(name))
+        params.update((name, float(request.GET[name])) for name in THRESHOLD_NAMES if request.GET.get(name))
+        return JsonResponse(result.get_rows(prefix, order_by=request.GET.get('order_by'),
+                                            fields=request.GET.get('fields'), **params))
+    except ValueError as e:
+        return JsonResponse(dict(error=str(e)), status=400)
+
+
+def read_file_range(file_path, start, length, chunk_size=1 << 16):
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def ranged_file_response(request, file_path, etag, content_type):
+    """
+    Whole file (sent with sendfile, if the server supports it), or a single byte range of it if requested
+    (206 Partial Content), unless If-Range does not match the ETag. Multiple ranges get the whole file.
+    """
+    size = path.getsize(file_path)
+    match = re.match(r'^bytes=(\d*)-(\d*)$', request.META.get('HTTP_RANGE', '').strip())
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if match is None or not any(match.groups()) or (if_range is not None and if_range != quote_etag(etag)):
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+    else:
+        start, end = match.groups()
+        if start:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        else:
+            # suffix range: the last bytes
+            start, end = max(0, size - int(end)), size - 1
+        if start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+        response = StreamingHttpResponse(read_file_range(file_path, start, end - start + 1), status=206,
+                                         content_type=content_type)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def download_etag(request, job_id):
+    date_completed = get_result_date_completed(request, job_id)
+    return result_archive_etag(job_id, date_completed) if date_completed is not None else None
+
+
+@login_required
+@condition(etag_func=download_etag, last_modified_func=result_last_modified)
 def download_file(request, job_id):
-    result = Result.objects.filter(request_user=request.user).get(job_id=job_id)
-    tmp_zip_name = MEDIA_ROOT + '/tmp/results_{}.zip'.format(job_id)
-    with ZipFile(tmp_zip_name, 'w') as zip_file:
-        for name in ('init_primers', 'init_scores', 'out_primers', 'out_scores'):
-            name_ = name.replace('_', '.')
-            tmp_file_name = MEDIA_ROOT + '/tmp/{}_{}'.format(job_id, name_)
-            with open(tmp_file_name, 'w') as tmp_file:
-                tmp_file.write(getattr(result, name))
-            zip_file.write(tmp_file_name, name_)
-            remove(tmp_file_name)
-    response = HttpResponse(open(tmp_zip_name, 'rb'), content_type="application/zip")
+    """
+    Zip of the raw outputs of a result: streamed while generated, or sent as a file if already cached.
+    """
+    date_completed = get_result_date_completed(request, job_id)
+    if date_completed is None:
+        raise Http404('Result not found.')
+    archive_path = get_cached_result_archive(job_id, date_completed)
+    if archive_path is not None:
+        response = ranged_file_response(request, archive_path, result_archive_etag(job_id, date_completed),
+                                        'application/zip')
+    else:
+        result = Result.objects.only('job_id', 'date_completed', *Result.RAW_FIELDS).get(job_id=job_id)
+        response = StreamingHttpResponse(stream_result_archive(result), content_type='application/zip')
     response['Content-Disposition'] = 'inline; filename=mopo16S_webapp_job_{}_results.zip'.format(job_id)
-    remove(tmp_zip_name)
     return response